@@ -0,0 +1,74 @@
+#  This file is part of twitter-text-python.
+#
+#  twitter-text-python is free software: you can redistribute it and/or
+#  modify it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  twitter-text-python is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License along with
+#  twitter-text-python. If not, see <http://www.gnu.org/licenses/>.
+
+# Regex engines against each other ---------------------------------------------
+# ------------------------------------------------------------------------------
+#
+#   $ python benchmarks/bench_engines.py [tweets]
+#
+# Parses the synthetic corpus with every installed engine, checks that each
+# one finds exactly what re finds and times it. The long texts are the kind of
+# input the adversarial tests use, 30000 characters each.
+#
+from __future__ import print_function
+
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                os.pardir))
+
+import corpus
+from ttp import engines, ttp
+
+LONG_TEXTS = (('hashtags', u'#a ' * 10000),
+              ('mentions', u'@a \xe9' * 7500),
+              ('urls', u'http://a.com/ ' * 2000 + u'\xe9'))
+
+
+def entities(parser, texts):
+    return [(result.reply, result.entities)
+            for result in (parser.parse(text, False) for text in texts)]
+
+
+def best(func, number):
+    '''Return the best time of func in microseconds.'''
+    return min(timeit.repeat(func, number=number, repeat=5)) / number * 1e6
+
+
+def main(count=2000):
+    tweets = corpus.make_corpus(count)
+    expected = entities(ttp.Parser(), tweets)
+    print('%-8s %12s' % ('engine', 'us/tweet')
+          + ''.join('%12s' % ('ms ' + kind) for kind, text in LONG_TEXTS))
+    for name in engines.ENGINES:
+        if not engines.available(name):
+            print('%-8s not installed' % name)
+            continue
+
+        parser = ttp.Parser(engine=name)
+        if entities(parser, tweets) != expected:
+            print('%-8s found other entities than re' % name)
+            sys.exit(1)
+
+        took = best(lambda: entities(parser, tweets), 5) / count
+        print('%-8s %12.2f' % (name, took) + ''.join(
+            '%12.1f' % (best(lambda: parser.parse(text, False), 1) / 1e3)
+            for kind, text in LONG_TEXTS))
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
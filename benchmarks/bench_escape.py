@@ -0,0 +1,66 @@
+# -*- coding: UTF-8 -*-
+#  This file is part of twitter-text-python.
+#
+#  twitter-text-python is free software: you can redistribute it and/or
+#  modify it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  twitter-text-python is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License along with
+#  twitter-text-python. If not, see <http://www.gnu.org/licenses/>.
+
+# HTML escaping of URLs --------------------------------------------------------
+# ------------------------------------------------------------------------------
+#
+#   $ python benchmarks/bench_escape.py
+#
+from __future__ import print_function
+
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                os.pardir))
+
+import legacy
+from ttp import ttp
+
+LENGTHS = (10, 30, 100, 300, 1000, 4000)
+
+# A query string has an & every few characters, a plain path has no entities
+QUERY = u'http://example.com/search?q="ttp"&lang=en&src=typd&page=2&'
+PATH = u'http://example.com/2013/06/01/twitter-text-python-released/'
+
+
+def make_url(pattern, length):
+    return (pattern * (length // len(pattern) + 1))[:length]
+
+
+def bench(func, url):
+    '''Return the best time per call in microseconds.'''
+    number = max(10, 100000 // len(url))
+    best = min(timeit.repeat(lambda: func(url), number=number, repeat=5))
+    return best / number * 1e6
+
+
+def main():
+    print('%-8s %6s %12s %12s %8s' % ('url', 'length', '1.0.1', 'now',
+                                      'speedup'))
+    for name, pattern in (('query', QUERY), ('path', PATH)):
+        for length in LENGTHS:
+            url = make_url(pattern, length)
+            assert legacy.escape(url) == ttp.escape(url)
+            old = bench(legacy.escape, url)
+            new = bench(ttp.escape, url)
+            print('%-8s %6d %9.2f us %9.2f us %7.1fx' % (name, length, old,
+                                                         new, old / new))
+
+
+if __name__ == '__main__':
+    main()
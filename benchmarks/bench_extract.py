@@ -0,0 +1,62 @@
+# -*- coding: UTF-8 -*-
+#  This file is part of twitter-text-python.
+#
+#  twitter-text-python is free software: you can redistribute it and/or
+#  modify it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  twitter-text-python is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License along with
+#  twitter-text-python. If not, see <http://www.gnu.org/licenses/>.
+
+# Entity only extraction vs. parse ---------------------------------------------
+# ------------------------------------------------------------------------------
+#
+#   $ python benchmarks/bench_extract.py
+#
+from __future__ import print_function
+
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                os.pardir))
+
+import legacy
+from bench_scanner import TWEETS
+from ttp import ttp
+
+
+def bench(func, number):
+    '''Return the best time per tweet in microseconds.'''
+    def run():
+        for tweet in TWEETS:
+            func(tweet)
+
+    best = min(timeit.repeat(run, number=number, repeat=5))
+    return best / (number * len(TWEETS)) * 1e6
+
+
+def main(number=2000):
+    parser = ttp.Parser()
+    old = legacy.Parser()
+    cases = [('four pass parse(html=False)', lambda t: old.parse(t, False)),
+             ('parse(html=True)', lambda t: parser.parse(t, True).html),
+             ('parse(html=False)', lambda t: parser.parse(t, False)),
+             ('extract()', parser.extract)]
+
+    baseline = None
+    for name, func in cases:
+        took = bench(func, number)
+        baseline = baseline or took
+        print('%-28s %9.2f us %7.2fx' % (name, took, baseline / took))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,82 @@
+#  This file is part of twitter-text-python.
+#
+#  twitter-text-python is free software: you can redistribute it and/or
+#  modify it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  twitter-text-python is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License along with
+#  twitter-text-python. If not, see <http://www.gnu.org/licenses/>.
+
+# Import and first parse in a fresh interpreter --------------------------------
+# ------------------------------------------------------------------------------
+#
+#   $ python benchmarks/bench_import.py [runs]
+#
+# Every run starts a new interpreter, imports ttp and parses a tweet twice.
+# The first parse compiles the regexes it needs, the second one shows what a
+# parse costs afterwards. "eager" compiles every regex of the module right
+# after the import, which is what importing it cost before they were lazy.
+# The bytecode is compiled up front so that no run pays for that.
+#
+from __future__ import print_function
+
+import compileall
+import os
+import subprocess
+import sys
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir)
+
+SNIPPET = '''
+import sys
+import timeit
+clock = timeit.default_timer
+sys.path.insert(0, %r)
+start = clock()
+from ttp import ttp
+imported = clock()
+if %r:
+    for value in list(vars(ttp).values()) + list(ttp.TRIGGER_REGEXES.values()):
+        if isinstance(value, ttp.LazyRegex):
+            value.pattern
+compiled = clock()
+ttp.Parser().parse(u'@user: #tag http://example.com', html=False)
+parsed = clock()
+ttp.Parser().parse(u'@user: #tag http://example.com', html=False)
+print('%%r %%r %%r %%r' %% (imported - start, compiled - imported,
+                          parsed - compiled, clock() - parsed))
+'''
+
+STEPS = ('import', 'eager compile', 'first parse', 'second parse')
+
+
+def run(eager, runs):
+    '''Return the median time of each of the STEPS in milliseconds.'''
+    code = SNIPPET % (ROOT, eager)
+    times = []
+    for _ in range(runs):
+        output = subprocess.check_output([sys.executable, '-c', code])
+        times.append([float(value) * 1e3 for value in output.split()])
+
+    return [sorted(step)[len(step) // 2] for step in zip(*times)]
+
+
+def main(runs=21):
+    for name in ('__init__.py', 'cache.py', 'ttp.py'):
+        compileall.compile_file(os.path.join(ROOT, 'ttp', name), quiet=1)
+
+    print('%-20s' % 'ms, median of %d' % runs
+          + ''.join('%15s' % step for step in STEPS))
+    for name, eager in (('lazy', False), ('eager', True)):
+        times = run(eager, runs)
+        print('%-20s' % name + ''.join('%15.3f' % took for took in times))
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
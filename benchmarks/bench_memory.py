@@ -0,0 +1,96 @@
+# -*- coding: UTF-8 -*-
+#  This file is part of twitter-text-python.
+#
+#  twitter-text-python is free software: you can redistribute it and/or
+#  modify it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  twitter-text-python is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License along with
+#  twitter-text-python. If not, see <http://www.gnu.org/licenses/>.
+
+# Memory held by ParseResults --------------------------------------------------
+# ------------------------------------------------------------------------------
+#
+#   $ python benchmarks/bench_memory.py
+#
+# Counts every object a result keeps alive, except for the Parser and the tweet
+# text itself which the caller holds anyway.
+#
+from __future__ import print_function
+
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                os.pardir))
+
+import legacy
+from bench_scanner import TWEETS
+from ttp import ttp
+
+
+def retained_size(obj, skip):
+    '''Return the size in bytes of obj and everything it references.'''
+    seen = set(id(item) for item in skip)
+    size = 0
+    todo = [obj]
+    while todo:
+        obj = todo.pop()
+        if id(obj) in seen or isinstance(obj, (ttp.Parser, type)):
+            continue
+
+        seen.add(id(obj))
+        size += sys.getsizeof(obj)
+        if isinstance(obj, dict):
+            todo.extend(obj.keys())
+            todo.extend(obj.values())
+
+        elif isinstance(obj, (list, tuple, set, frozenset)):
+            todo.extend(obj)
+
+        if hasattr(obj, '__dict__'):
+            todo.append(obj.__dict__)
+
+        for cls in type(obj).__mro__:
+            for name in cls.__dict__.get('__slots__', ()):
+                if hasattr(obj, name):
+                    todo.append(getattr(obj, name))
+
+    return size
+
+
+def average_size(parser, html, render):
+    total = 0
+    for tweet in TWEETS:
+        result = parser.parse(tweet, html)
+        if render:
+            result.html
+
+        total += retained_size(result, TWEETS)
+
+    return float(total) / len(TWEETS)
+
+
+def main():
+    print('%-40s %10s %10s %8s' % ('bytes per result', '1.0.1', 'now',
+                                    'saved'))
+    for html, spans, render in ((False, False, False), (False, True, False),
+                                (True, True, False), (True, True, True)):
+        name = 'html=%s include_spans=%s' % (html, spans)
+        if html:
+            name += ' (rendered)' if render else ' (unread)'
+
+        old = average_size(legacy.Parser(include_spans=spans), html, render)
+        new = average_size(ttp.Parser(include_spans=spans), html, render)
+        print('%-40s %10d %10d %7d%%' % (name, old, new,
+                                         100 - new * 100 / old))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,70 @@
+# -*- coding: UTF-8 -*-
+#  This file is part of twitter-text-python.
+#
+#  twitter-text-python is free software: you can redistribute it and/or
+#  modify it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  twitter-text-python is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License along with
+#  twitter-text-python. If not, see <http://www.gnu.org/licenses/>.
+
+# Trigger prefilter on a mix of tweets -----------------------------------------
+# ------------------------------------------------------------------------------
+#
+#   $ python benchmarks/bench_prefilter.py
+#
+from __future__ import print_function
+
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                os.pardir))
+
+from corpus import make_corpus
+from ttp import ttp
+
+
+class UnfilteredParser(ttp.Parser):
+
+    '''Parser without the prefilter, always looks for all triggers.'''
+
+    def parse(self, text, html=True):
+        reply = ttp.REPLY_REGEX.match(text)
+        reply = reply.groups(0)[0] if reply is not None else None
+        return ttp.ParseResult.from_entities(
+            self._scan(text), reply, include_spans=self._include_spans)
+
+
+def bench(parser, tweets, number):
+    '''Return the best time per tweet in microseconds.'''
+    def run():
+        for tweet in tweets:
+            parser.parse(tweet, html=False)
+
+    best = min(timeit.repeat(run, number=number, repeat=5))
+    return best / (number * len(tweets)) * 1e6
+
+
+def main(number=20):
+    tweets = make_corpus()
+    plain = [tweet for tweet in tweets if not ttp.prefilter(tweet)]
+    print('%-24s %12s %12s %8s' % ('tweets', 'no filter', 'prefilter',
+                                    'speedup'))
+    for name, sample in (('mix', tweets), ('without triggers', plain)):
+        old = bench(UnfilteredParser(), sample, number)
+        new = bench(ttp.Parser(), sample, number)
+        print('%-24s %9.2f us %9.2f us %7.2fx' % (name, old, new, old / new))
+
+    print('%d of %d tweets have no triggers' % (len(plain), len(tweets)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,70 @@
+# -*- coding: UTF-8 -*-
+#  This file is part of twitter-text-python.
+#
+#  twitter-text-python is free software: you can redistribute it and/or
+#  modify it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  twitter-text-python is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License along with
+#  twitter-text-python. If not, see <http://www.gnu.org/licenses/>.
+
+# Single pass scanner vs. the old four pass parser -----------------------------
+# ------------------------------------------------------------------------------
+#
+#   $ python benchmarks/bench_scanner.py
+#
+from __future__ import print_function
+
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                os.pardir))
+
+import legacy
+from ttp import ttp
+
+TWEETS = [
+    u'Coca-Cola Hits 50 Million Facebook Likes http://bit.ly/QlKOc7',
+    u'Follow @CokeZero & Retweet for a chance to win @EASPORTS '
+    u'@EANCAAFootball 13 #GameOn #ad Rules: http://bit.ly/EANCAA',
+    u' #ABillionReasonsToBelieveInAfrica ARISE MAG.FASHION WEEK NY! Tsemaye '
+    u'B,Maki Oh,Tiffany Amber, Ozwald.Showin NY reasons2beliv @CocaCola_NG',
+    u'@ianozsvald, you now support #IvoWertzel\'s tweet parser! '
+    u'https://github.com/ianozsvald/',
+    u'just had the best coffee of my life, no links or mentions here at all',
+    u'いまなにしてるhttp://example.comいまなにしてる #hashtagの ＠username',
+    u'big url: http://blah.com:8080/path/to/here?p=1&q=abc,def#posn2 #ahashtag',
+    u'RT @someone: check out @username/list and www.example.com/path #tag',
+]
+
+
+def bench(parser, html, number):
+    '''Return the best time per tweet in microseconds.'''
+    def run():
+        for tweet in TWEETS:
+            parser.parse(tweet, html=html).html
+
+    best = min(timeit.repeat(run, number=number, repeat=5))
+    return best / (number * len(TWEETS)) * 1e6
+
+
+def main(number=2000):
+    print('%-12s %12s %12s %8s' % ('mode', 'four pass', 'single pass',
+                                    'speedup'))
+    for html in (True, False):
+        old = bench(legacy.Parser(), html, number)
+        new = bench(ttp.Parser(), html, number)
+        print('%-12s %9.2f us %9.2f us %7.2fx' % ('html' if html else 'text',
+                                                 old, new, old / new))
+
+
+if __name__ == '__main__':
+    main()
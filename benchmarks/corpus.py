@@ -0,0 +1,144 @@
+# -*- coding: UTF-8 -*-
+#  This file is part of twitter-text-python.
+#
+#  twitter-text-python is free software: you can redistribute it and/or
+#  modify it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  twitter-text-python is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License along with
+#  twitter-text-python. If not, see <http://www.gnu.org/licenses/>.
+
+# Synthetic tweet corpus -------------------------------------------------------
+# ------------------------------------------------------------------------------
+"""Random but reproducible tweets for the benchmarks.
+
+    $ python benchmarks/corpus.py 5 --kind cjk
+
+Every kind of tweet stresses another part of the parser, make_corpus() mixes
+them roughly the way a sample of the firehose does.
+
+"""
+from __future__ import print_function
+
+import argparse
+import random
+
+WORDS = (u'the of and to in is you that it he was for on are as with his they '
+         u'at be this have from or one had by word but not what all were we '
+         u'when your can said there use an each which she do how their if '
+         u'will up other about out many then them these so some her would '
+         u'make like him into time has look two more write go see number no '
+         u'way could people my than first water been call who oil its now. '
+         u'find long down day did get come made may part over new. sound. '
+         u'いま なに して る 今日 は 天気 が いい').split()
+
+CJK_WORDS = (u'いま なに して る 今日 は 天気 が いい です ね 東京 大阪 新しい '
+             u'ニュース 写真 動画 見て ください 中文 推特 今天 天气 很好 '
+             u'한국어 트위터 오늘 날씨').split()
+
+DOMAINS = (u'example.com', u'bit.ly', u't.co', u'www.example.org',
+           u'github.com', u'news.bbc.co.uk', u'youtube.com', u'x.com')
+
+# Share of each kind of tweet, roughly what a sample of the firehose looks like
+MIX = ((u'plain', 55), (u'mention', 15), (u'hashtag', 10), (u'url', 10),
+       (u'cjk', 5), (u'mixed', 5))
+
+KINDS = tuple(kind for kind, share in MIX)
+
+
+def make_words(rnd, low=6, high=18, words=WORDS):
+    return [rnd.choice(words) for _ in range(rnd.randint(low, high))]
+
+
+def make_url(rnd):
+    url = u'%s/%s' % (rnd.choice(DOMAINS), u'/'.join(
+        u'%x' % rnd.getrandbits(24) for _ in range(rnd.randint(0, 4))))
+    if rnd.random() < 0.3:
+        url += u'?' + u'&'.join(u'%s=%d' % (rnd.choice(WORDS[:40]), i)
+                                for i in range(rnd.randint(1, 8)))
+
+    if not url.startswith(u'www.'):
+        url = rnd.choice((u'http://', u'https://')) + url
+
+    return url
+
+
+def make_tweet(kind, rnd):
+    '''Return a random tweet of the kind, one of KINDS.'''
+    if kind == u'cjk':
+        # No spaces between words, fullwidth ＠ and ＃, URLs glued to the text
+        words = make_words(rnd, 4, 14, CJK_WORDS)
+        for _ in range(rnd.randint(0, 2)):
+            words.insert(rnd.randint(0, len(words)), rnd.choice(
+                (u'＠user%d ' % rnd.randint(0, 999),
+                 u' ＃タグ%d ' % rnd.randint(0, 99),
+                 u'#話題%d ' % rnd.randint(0, 99), make_url(rnd))))
+
+        return u''.join(words)
+
+    words = make_words(rnd)
+    if kind == u'mention':
+        for _ in range(rnd.randint(1, 4)):
+            words.insert(rnd.randint(0, len(words)),
+                         u'@user%d' % rnd.randint(0, 999))
+
+        if rnd.random() < 0.2:
+            words.append(u'@user%d/list%d' % (rnd.randint(0, 999),
+                                              rnd.randint(0, 9)))
+
+    elif kind == u'hashtag':
+        for _ in range(rnd.randint(2, 5)):
+            words.insert(rnd.randint(0, len(words)),
+                         u'#tag%d' % rnd.randint(0, 99))
+
+    elif kind == u'url':
+        for _ in range(rnd.randint(1, 3)):
+            words.insert(rnd.randint(0, len(words)), make_url(rnd))
+
+    elif kind == u'mixed':
+        words.insert(0 if rnd.random() < 0.5 else len(words),
+                     u'@user%d' % rnd.randint(0, 999))
+        words.append(u'#tag%d' % rnd.randint(0, 99))
+        words.append(make_url(rnd))
+
+    return u' '.join(words)
+
+
+def make_tweets(kind, count=1000, seed=0):
+    '''Return count random tweets of one kind.'''
+    rnd = random.Random(seed)
+    return [make_tweet(kind, rnd) for _ in range(count)]
+
+
+def make_corpus(count=1000, seed=0, mix=MIX):
+    '''Return count random tweets with kinds in the shares of mix.'''
+    rnd = random.Random(seed)
+    kinds = [kind for kind, share in mix for _ in range(share)]
+    return [make_tweet(rnd.choice(kinds), rnd) for _ in range(count)]
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Print synthetic tweets.')
+    parser.add_argument('count', type=int, nargs='?', default=10)
+    parser.add_argument('--kind', choices=KINDS,
+                        help='only tweets of this kind (default: the mix)')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+    if args.kind:
+        tweets = make_tweets(args.kind, args.count, args.seed)
+
+    else:
+        tweets = make_corpus(args.count, args.seed)
+
+    for tweet in tweets:
+        print(tweet.encode('utf-8') if str is bytes else tweet)
+
+
+if __name__ == '__main__':
+    main()
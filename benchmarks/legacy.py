@@ -0,0 +1,142 @@
+# -*- coding: UTF-8 -*-
+#  This file is part of twitter-text-python.
+#
+#  twitter-text-python is free software: you can redistribute it and/or
+#  modify it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  twitter-text-python is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License along with
+#  twitter-text-python. If not, see <http://www.gnu.org/licenses/>.
+
+# The parser of ttp 1.0.1 ------------------------------------------------------
+# ------------------------------------------------------------------------------
+"""The 1.0.1 parser, kept as the baseline for the benchmarks.
+
+One regex pass per entity type with every pass running over the output of
+the last, per call state on the Parser and a ParseResult with a __dict__.
+
+"""
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                os.pardir))
+from ttp import ttp
+
+
+def escape(text):
+    '''Escape some HTML entities.'''
+    return ''.join({'&': '&amp;', '"': '&quot;',
+                    '\'': '&apos;', '>': '&gt;',
+                    '<': '&lt;'}.get(c, c) for c in text)
+
+
+class ParseResult(object):
+
+    def __init__(self, urls, users, reply, lists, tags, html):
+        self.urls = urls if urls else []
+        self.users = users if users else []
+        self.lists = lists if lists else []
+        self.reply = reply if reply else None
+        self.tags = tags if tags else []
+        self.html = html
+
+
+class Parser(ttp.Parser):
+
+    def parse(self, text, html=True):
+        self._urls = []
+        self._users = []
+        self._lists = []
+        self._tags = []
+
+        reply = ttp.REPLY_REGEX.match(text)
+        reply = reply.groups(0)[0] if reply is not None else None
+
+        parsed_html = self._old_html(text) if html else self._old_text(text)
+        return ParseResult(self._urls, self._users, reply,
+                           self._lists, self._tags, parsed_html)
+
+    def _old_text(self, text):
+        ttp.URL_REGEX.sub(self._parse_urls, text)
+        ttp.USERNAME_REGEX.sub(self._parse_users, text)
+        ttp.LIST_REGEX.sub(self._parse_lists, text)
+        ttp.HASHTAG_REGEX.sub(self._parse_tags, text)
+        return None
+
+    def _old_html(self, text):
+        html = ttp.URL_REGEX.sub(self._parse_urls, text)
+        html = ttp.USERNAME_REGEX.sub(self._parse_users, html)
+        html = ttp.LIST_REGEX.sub(self._parse_lists, html)
+        return ttp.HASHTAG_REGEX.sub(self._parse_tags, html)
+
+    def _parse_urls(self, match):
+        mat = match.group(0)
+        if not self._valid_domain(match.group(5)):
+            return mat
+
+        pos = mat.find('http')
+        if pos != -1:
+            pre, url = mat[:pos], mat[pos:]
+            full_url = url
+
+        else:
+            pos = mat.lower().find('www')
+            pre, url = mat[:pos], mat[pos:]
+            full_url = 'http://%s' % url
+
+        if self._include_spans:
+            span = match.span(0)
+            self._urls.append((url, (span[0] + len(pre), span[1])))
+        else:
+            self._urls.append(url)
+
+        return '%s%s' % (pre, self.format_url(full_url,
+                                              self._shorten_url(ttp.escape(url))))
+
+    def _parse_users(self, match):
+        if match.group(2) is not None:
+            return match.group(0)
+
+        mat = match.group(0)
+        if self._include_spans:
+            self._users.append((mat[1:], match.span(0)))
+        else:
+            self._users.append(mat[1:])
+
+        return self.format_username(mat[0:1], mat[1:])
+
+    def _parse_lists(self, match):
+        if match.group(4) is None:
+            return match.group(0)
+
+        pre, at_char, user, list_name = match.groups()
+        list_name = list_name[1:]
+        if self._include_spans:
+            self._lists.append((user, list_name, match.span(0)))
+        else:
+            self._lists.append((user, list_name))
+
+        return '%s%s' % (pre, self.format_list(at_char, user, list_name))
+
+    def _parse_tags(self, match):
+        mat = match.group(0)
+        for tag in u'#＃':
+            pos = mat.rfind(tag)
+            if pos != -1:
+                break
+
+        pre, text = mat[:pos], mat[pos + 1:]
+        if self._include_spans:
+            span = match.span(0)
+            self._tags.append((text, (span[0] + len(pre), span[1])))
+        else:
+            self._tags.append(text)
+
+        return '%s%s' % (pre, self.format_tag(tag, text))
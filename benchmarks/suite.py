@@ -0,0 +1,213 @@
+# -*- coding: UTF-8 -*-
+#  This file is part of twitter-text-python.
+#
+#  twitter-text-python is free software: you can redistribute it and/or
+#  modify it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  twitter-text-python is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License along with
+#  twitter-text-python. If not, see <http://www.gnu.org/licenses/>.
+
+# Benchmark suite of the parser hot paths --------------------------------------
+# ------------------------------------------------------------------------------
+"""Time the hot paths of the parser on a synthetic corpus.
+
+    $ python benchmarks/suite.py --save before.json
+    ... change things ...
+    $ python benchmarks/suite.py --compare before.json
+    $ python benchmarks/suite.py --compare before.json after.json
+
+Every case is timed per item (tweet or URL), the report has the percentiles
+of the time per item and the throughput over the whole corpus. --compare
+flags the cases whose median or throughput got worse by more than
+--threshold percent, and exits with status 1 if there are any.
+
+"""
+from __future__ import print_function
+
+import argparse
+import json
+import os
+import platform
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                os.pardir))
+
+import corpus
+from ttp import ttp
+
+PERCENTILES = (50, 90, 99)
+
+# Shortest time in seconds a single timing is allowed to take
+MIN_TIMING = 50e-6
+
+
+def make_cases(tweets):
+    '''Return a list of (name, function, items) to time.'''
+    parser = ttp.Parser()
+    entities = [parser.extract(tweet) for tweet in tweets]
+    urls = [entity.text for found in entities for entity in found
+            if entity.kind == ttp.ENTITY_URL]
+    escaped = [ttp.escape(url) for url in urls]
+    return [
+        ('parse html', lambda tweet: parser.parse(tweet).html, tweets),
+        ('parse text', lambda tweet: parser.parse(tweet, False), tweets),
+        ('prefilter', ttp.prefilter, tweets),
+        ('reply', ttp.REPLY_REGEX.match, tweets),
+        ('scan urls', lambda tweet: parser._scan(tweet, ttp.TRIGGER_URL),
+         tweets),
+        ('scan mentions',
+         lambda tweet: parser._scan(tweet, ttp.TRIGGER_MENTION), tweets),
+        ('scan hashtags',
+         lambda tweet: parser._scan(tweet, ttp.TRIGGER_HASHTAG), tweets),
+        ('html', lambda item: parser._html(*item),
+         list(zip(tweets, entities))),
+        ('escape', ttp.escape, urls),
+        ('shorten_url', parser._shorten_url, escaped),
+    ]
+
+
+def time_items(func, items, loops, repeat):
+    '''Return the best time per call of func for each item, in seconds.
+
+    Each item is timed over at least loops calls, more for fast functions so
+    that a timing is always well above the resolution of the timer.
+
+    '''
+    timer = timeit.default_timer
+    start = timer()
+    for item in items:
+        func(item)
+
+    mean = (timer() - start) / len(items)
+    loops = max(loops, int(MIN_TIMING / max(mean, 1e-9)))
+    loop = range(loops)
+    best = [float('inf')] * len(items)
+    for _ in range(repeat):
+        for i, item in enumerate(items):
+            start = timer()
+            for _ in loop:
+                func(item)
+
+            best[i] = min(best[i], (timer() - start) / loops)
+
+    return best
+
+
+def percentile(ordered, percent):
+    '''Return the nearest rank percentile of a sorted list.'''
+    rank = max(0, int(round(percent / 100.0 * len(ordered))) - 1)
+    return ordered[rank]
+
+
+def summarize(times):
+    '''Return the percentiles, mean and throughput of a list of times.'''
+    ordered = sorted(times)
+    total = sum(ordered)
+    summary = dict(('p%d' % percent, percentile(ordered, percent) * 1e6)
+                   for percent in PERCENTILES)
+    summary.update(count=len(times), mean=total / len(times) * 1e6,
+                   throughput=len(times) / total)
+    return summary
+
+
+def run(count, seed, kind=None, loops=20, repeat=3):
+    '''Run all cases, return the results as a JSON serializable dict.'''
+    if kind:
+        tweets = corpus.make_tweets(kind, count, seed)
+
+    else:
+        tweets = corpus.make_corpus(count, seed)
+
+    results = {}
+    for name, func, items in make_cases(tweets):
+        if items:
+            results[name] = summarize(time_items(func, items, loops, repeat))
+
+    return {'python': platform.python_version(), 'count': count,
+            'seed': seed, 'kind': kind or 'mix', 'results': results}
+
+
+def report(run):
+    print('python %s, %d %s tweets, times per item in us' % (
+        run['python'], run['count'], run['kind']))
+    print('%-16s %7s %9s %9s %9s %9s %12s' % (
+        'case', 'items', 'mean', 'p50', 'p90', 'p99', 'items/s'))
+    for name, result in sorted(run['results'].items()):
+        print('%-16s %7d %9.2f %9.2f %9.2f %9.2f %12.0f' % (
+            name, result['count'], result['mean'], result['p50'],
+            result['p90'], result['p99'], result['throughput']))
+
+
+def compare(old, new, threshold):
+    '''Print the changes from the old to the new run, return the names of
+    the cases which got slower by more than threshold percent.'''
+    regressions = []
+    print('%-16s %9s %9s %8s %12s %12s %8s' % (
+        'case', 'old p50', 'new p50', 'change', 'old items/s', 'new items/s',
+        'change'))
+    for name in sorted(set(old['results']) & set(new['results'])):
+        before, after = old['results'][name], new['results'][name]
+        slower = (after['p50'] / before['p50'] - 1) * 100
+        fewer = (1 - after['throughput'] / before['throughput']) * 100
+        flag = ''
+        if slower > threshold or fewer > threshold:
+            regressions.append(name)
+            flag = '  REGRESSION'
+
+        print('%-16s %9.2f %9.2f %+7.1f%% %12.0f %12.0f %+7.1f%%%s' % (
+            name, before['p50'], after['p50'], slower, before['throughput'],
+            after['throughput'], -fewer, flag))
+
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the parser.')
+    parser.add_argument('--count', type=int, default=1000,
+                        help='number of tweets in the corpus')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--kind', choices=corpus.KINDS,
+                        help='only tweets of this kind (default: the mix)')
+    parser.add_argument('--loops', type=int, default=20,
+                        help='calls per item and timing')
+    parser.add_argument('--repeat', type=int, default=3,
+                        help='timings per item, the best one counts')
+    parser.add_argument('--save', metavar='FILE',
+                        help='write the results to FILE as JSON')
+    parser.add_argument('--compare', metavar='RUN', nargs='+',
+                        help='compare against a saved run, or compare two '
+                             'saved runs')
+    parser.add_argument('--threshold', type=float, default=10.0,
+                        help='percent slower counted as a regression')
+    args = parser.parse_args()
+
+    runs = []
+    for path in (args.compare or [])[:2]:
+        with open(path) as f:
+            runs.append(json.load(f))
+
+    if len(runs) < 2:
+        runs.append(run(args.count, args.seed, args.kind, args.loops,
+                        args.repeat))
+        report(runs[-1])
+        if args.save:
+            with open(args.save, 'w') as f:
+                json.dump(runs[-1], f, indent=2, sort_keys=True)
+
+    if len(runs) == 2:
+        print()
+        if compare(runs[0], runs[1], args.threshold):
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
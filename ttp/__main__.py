@@ -0,0 +1,94 @@
+#  This file is part of twitter-text-python.
+#
+#  twitter-text-python is free software: you can redistribute it and/or
+#  modify it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  twitter-text-python is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License along with
+#  twitter-text-python. If not, see <http://www.gnu.org/licenses/>.
+
+# Command line interface -------------------------------------------------------
+# ------------------------------------------------------------------------------
+"""Add the entities of every tweet in a JSONL or text file, one line at a time.
+
+    $ python -m ttp tweets.jsonl -o enriched.jsonl
+    $ zcat tweets.jsonl.gz | python -m ttp > enriched.jsonl
+
+"""
+import argparse
+import sys
+
+from . import stream
+from . import ttp
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m ttp',
+                                     description=__doc__.splitlines()[0])
+    parser.add_argument('input', nargs='?', default='-',
+                        help='file to read, - for stdin (the default)')
+    parser.add_argument('-o', '--output', default='-',
+                        help='file to write, - for stdout (the default)')
+    parser.add_argument('--format', choices=stream.FORMATS, default='auto',
+                        help='input format (default: %(default)s)')
+    parser.add_argument('--field', default='text',
+                        help='JSON field with the tweet text '
+                             '(default: %(default)s)')
+    parser.add_argument('--key', default='entities',
+                        help='JSON field to store the entities in '
+                             '(default: %(default)s)')
+    parser.add_argument('--html', action='store_true',
+                        help='also add the formatted HTML')
+    parser.add_argument('--spans', action='store_true',
+                        help='include the span of every entity')
+    parser.add_argument('--max-url-length', type=int, default=30,
+                        help='shorten URLs in the HTML to this length, '
+                             '-1 to never shorten (default: %(default)s)')
+    parser.add_argument('--skip-errors', action='store_true',
+                        help='skip lines that are not valid records and '
+                             'report them on stderr, instead of stopping at '
+                             'the first one')
+    args = parser.parse_args(argv)
+
+    # A count in a list, the closure can't rebind a name on Python 2
+    skipped = [0]
+
+    def skip(number, message):
+        skipped[0] += 1
+        sys.stderr.write('%s: skipped line %d: %s\n'
+                         % (parser.prog, number, message))
+
+    # Bytes on Python 3 too, read_tweets decodes them as UTF-8
+    stdin = getattr(sys.stdin, 'buffer', sys.stdin)
+    infile = stdin if args.input == '-' else open(args.input, 'rb')
+    outfile = sys.stdout if args.output == '-' else open(args.output, 'w')
+    try:
+        stream.write_jsonl(infile, outfile,
+                           parser=ttp.Parser(args.max_url_length, args.spans),
+                           html=args.html, format=args.format,
+                           field=args.field, key=args.key,
+                           on_error=skip if args.skip_errors else None)
+
+    except ValueError as e:
+        parser.exit(1, '%s: %s\n' % (parser.prog, e))
+
+    finally:
+        if infile is not stdin:
+            infile.close()
+
+        if outfile is not sys.stdout:
+            outfile.close()
+
+    if skipped[0]:
+        sys.stderr.write('%s: skipped %d lines\n'
+                         % (parser.prog, skipped[0]))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,335 @@
+#  This file is part of twitter-text-python.
+#
+#  twitter-text-python is free software: you can redistribute it and/or
+#  modify it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  twitter-text-python is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License along with
+#  twitter-text-python. If not, see <http://www.gnu.org/licenses/>.
+
+# Hashtag and mention frequencies ----------------------------------------------
+# ------------------------------------------------------------------------------
+"""Count hashtags and mentions of a stream of tweets in time windows.
+
+    >>> aggregator = FrequencyAggregator(window=3600, step=300)
+    >>> for window in aggregator.aggregate(pairs):
+    ...     print(window.start, window.top[ttp.ENTITY_TAG])
+
+Windows are made of panes of `step` seconds, a window of `window` seconds
+slides by one pane at a time (tumbling windows have no step, or step equal to
+window). Exact counts need memory for every distinct key in a window, with
+approximate=True each pane is a fixed size count-min sketch instead and only
+the top candidates are kept as keys.
+
+"""
+import array
+import collections
+import operator
+import random
+import time
+
+from . import ttp
+
+KINDS = (ttp.ENTITY_TAG, ttp.ENTITY_USER)
+
+# A Mersenne prime larger than any hash, for the hash functions of the sketch
+PRIME = (1 << 61) - 1
+
+
+class CountMinSketch(object):
+
+    '''Approximate counts of keys in width * depth counters.
+
+    An estimate is never below the real count, and above it by at most
+    2 / width of the total with a probability of 1 - 1 / 2 ** depth. Sketches
+    with the same width, depth and seed can be added and subtracted.
+
+    '''
+
+    def __init__(self, width=2048, depth=4, seed=0):
+        rnd = random.Random(seed)
+        self.width = width
+        self.depth = depth
+        self.seed = seed
+        self.total = 0
+        self._hashes = [(rnd.randrange(1, PRIME), rnd.randrange(PRIME))
+                        for _ in range(depth)]
+        self._rows = [array.array('l', [0]) * width for _ in range(depth)]
+
+    def _cells(self, key):
+        value = hash(key)
+        width = self.width
+        return [(a * value + b) % PRIME % width for a, b in self._hashes]
+
+    def add(self, key, count=1):
+        '''Count key count times, return its new estimate.'''
+        estimate = None
+        for row, cell in zip(self._rows, self._cells(key)):
+            row[cell] += count
+            if estimate is None or row[cell] < estimate:
+                estimate = row[cell]
+
+        self.total += count
+        return estimate
+
+    def estimate(self, key):
+        return min(row[cell] for row, cell in zip(self._rows,
+                                                  self._cells(key)))
+
+    def update(self, other, subtract=False):
+        '''Add the counts of another sketch, or subtract them.'''
+        if (other.width, other.depth, other.seed) != (self.width, self.depth,
+                                                      self.seed):
+            raise ValueError('sketches differ in width, depth or seed')
+
+        combine = operator.sub if subtract else operator.add
+        self._rows = [array.array('l', map(combine, row, other_row))
+                      for row, other_row in zip(self._rows, other._rows)]
+        self.total = combine(self.total, other.total)
+
+
+class HeavyHitters(object):
+
+    '''A CountMinSketch which keeps track of its k most frequent keys.
+
+    Up to 2 * k candidate keys are kept, when there are more only the k with
+    the highest estimates stay. A key that drops out is only found again if
+    it is added again.
+
+    '''
+
+    def __init__(self, k=10, width=2048, depth=4, seed=0):
+        self.k = k
+        self.sketch = CountMinSketch(width, depth, seed)
+        self._candidates = set()
+
+    def add(self, key, count=1):
+        self.sketch.add(key, count)
+        self._candidates.add(key)
+        if len(self._candidates) > 2 * self.k:
+            self._candidates = set(key for key, count in self.top())
+
+    def update(self, sketch, subtract=False):
+        '''Add or subtract the counts of a CountMinSketch.'''
+        self.sketch.update(sketch, subtract)
+
+    def top(self, n=None):
+        '''Return the n (default k) most frequent (key, estimate) pairs.'''
+        estimate = self.sketch.estimate
+        counts = [(key, estimate(key)) for key in self._candidates]
+        counts.sort(key=lambda item: (-item[1], item[0]))
+        return [item for item in counts[:n or self.k] if item[1] > 0]
+
+
+class Window(object):
+
+    '''The counts of a closed time window.
+
+    Attributes:
+    - start, end
+        The time window, start <= timestamp < end.
+
+    - tweets
+        The number of tweets in the window.
+
+    - top
+        A dict of a list of the most frequent (key, count) pairs for each
+        ttp.ENTITY_* kind counted, most frequent first. Keys are lower case.
+
+    '''
+
+    __slots__ = ('start', 'end', 'tweets', 'top')
+
+    def __init__(self, start, end, tweets, top):
+        self.start = start
+        self.end = end
+        self.tweets = tweets
+        self.top = top
+
+    def __repr__(self):
+        return '%s(%r, %r, %d)' % (self.__class__.__name__, self.start,
+                                   self.end, self.tweets)
+
+
+class _Pane(object):
+
+    # The counts of one step of time
+    __slots__ = ('index', 'tweets', 'counts')
+
+    def __init__(self, index, counts):
+        self.index = index
+        self.tweets = 0
+        self.counts = counts
+
+
+class FrequencyAggregator(object):
+
+    '''Count the hashtags and mentions of tweets in time windows.
+
+    Counts the ttp.ENTITY_* kinds in `kinds` case folded, in windows of
+    `window` seconds which slide by `step` seconds (tumbling windows without
+    a step). Every closed window with tweets in it is returned as a Window
+    with the `top` most frequent keys of each kind, all of them if top is
+    None and the counts are exact.
+
+    With approximate=True the counts of every pane are kept in a
+    CountMinSketch of width * depth counters and each window only keeps the
+    2 * top most frequent keys, so memory does not grow with the number of
+    distinct keys.
+
+    Timestamps are seconds and should not go backwards, late tweets are
+    counted in the current pane. Tweets without one are counted at the time
+    of the clock.
+
+    '''
+
+    def __init__(self, window=3600, step=None, parser=None, kinds=KINDS,
+                 top=10, approximate=False, width=2048, depth=4,
+                 clock=time.time):
+        step = window if step is None else step
+        if step <= 0 or window % step:
+            raise ValueError('window must be a multiple of step')
+
+        if approximate and not top:
+            raise ValueError('approximate counts need a top')
+
+        self.window = window
+        self.step = step
+        self._parser = parser if parser is not None else ttp.Parser()
+        self._kinds = frozenset(kinds)
+        self._top = top
+        self._approximate = approximate
+        self._width = width
+        self._depth = depth
+        self._clock = clock
+        self._panes_per_window = window // step
+        self._panes = collections.deque()
+        self._pane = None
+        self._tweets = 0
+        if approximate:
+            self._counts = dict((kind, HeavyHitters(top, width, depth))
+                                for kind in kinds)
+
+        else:
+            self._counts = dict((kind, collections.Counter())
+                                for kind in kinds)
+
+    def add(self, text, timestamp=None):
+        '''Count a tweet, return the list of Windows its timestamp closed.'''
+        if timestamp is None:
+            timestamp = self._clock()
+
+        index = int(timestamp // self.step)
+        closed = []
+        if self._pane is None:
+            self._pane = index
+
+        elif index > self._pane:
+            closed = self._advance(index)
+
+        if not self._panes or self._panes[-1].index != self._pane:
+            self._panes.append(_Pane(self._pane, self._new_counts()))
+
+        pane = self._panes[-1]
+        pane.tweets += 1
+        self._tweets += 1
+        kinds = self._kinds
+        counts = self._counts
+        for entity in self._parser.extract(text):
+            if entity.kind in kinds:
+                key = entity.text.lower()
+                if self._approximate:
+                    pane.counts[entity.kind].add(key)
+                    counts[entity.kind].add(key)
+
+                else:
+                    pane.counts[entity.kind][key] += 1
+                    counts[entity.kind][key] += 1
+
+        return closed
+
+    def aggregate(self, items):
+        '''Count an iterable of tweets or (timestamp, text) pairs, yield the
+        Windows as they close and all the remaining ones at the end.'''
+        add = self.add
+        for item in items:
+            if isinstance(item, (tuple, list)):
+                windows = add(item[1], item[0])
+
+            else:
+                windows = add(item)
+
+            for window in windows:
+                yield window
+
+        for window in self.flush():
+            yield window
+
+    def flush(self):
+        '''Close all windows with tweets in them, return them as a list.'''
+        if self._pane is None:
+            return []
+
+        closed = self._advance(self._pane + self._panes_per_window)
+        self._pane = None
+        return closed
+
+    def top(self, kind=ttp.ENTITY_TAG, n=None):
+        '''Return the most frequent (key, count) pairs of the open window.'''
+        n = n or self._top
+        if self._approximate:
+            return self._counts[kind].top(n)
+
+        return sorted(self._counts[kind].items(),
+                      key=lambda item: (-item[1], item[0]))[:n]
+
+    def _new_counts(self):
+        if self._approximate:
+            return dict((kind, CountMinSketch(self._width, self._depth))
+                        for kind in self._kinds)
+
+        return dict((kind, collections.Counter()) for kind in self._kinds)
+
+    def _advance(self, index):
+        # Close the windows ending before pane index and drop the panes which
+        # leave them
+        closed = []
+        while self._pane < index:
+            if self._panes:
+                closed.append(Window(
+                    (self._pane - self._panes_per_window + 1) * self.step,
+                    (self._pane + 1) * self.step, self._tweets,
+                    dict((kind, self.top(kind)) for kind in self._kinds)))
+
+            self._pane += 1
+            oldest = self._pane - self._panes_per_window
+            while self._panes and self._panes[0].index <= oldest:
+                self._expire(self._panes.popleft())
+
+            if not self._panes:
+                # Nothing left to close until the next tweet
+                self._pane = index
+
+        return closed
+
+    def _expire(self, pane):
+        self._tweets -= pane.tweets
+        for kind, counts in pane.counts.items():
+            if self._approximate:
+                self._counts[kind].update(counts, subtract=True)
+                continue
+
+            window = self._counts[kind]
+            for key, count in counts.items():
+                count = window[key] - count
+                if count:
+                    window[key] = count
+
+                else:
+                    del window[key]
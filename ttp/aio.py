@@ -0,0 +1,198 @@
+#  This file is part of twitter-text-python.
+#
+#  twitter-text-python is free software: you can redistribute it and/or
+#  modify it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  twitter-text-python is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License along with
+#  twitter-text-python. If not, see <http://www.gnu.org/licenses/>.
+
+# Asyncio Shortlink Follower ---------------------------------------------------
+# ------------------------------------------------------------------------------
+"""Unwind shortlinks from inside an asyncio event loop (Python 3.6+).
+
+The asynchronous counterpart of utils.follow_shortlinks, with the same
+redirect semantics: every chain starts with the shortlink itself and ends with
+the final URL, shortlinks which can't be followed get an empty chain.
+
+    async for shortlink, chain in aio.follow_shortlinks(urls, limit=16):
+        ...
+
+The HTTP requests are made by a transport, a coroutine function taking the
+method and the URL and returning (status, location). The default one speaks
+just enough HTTP/1.1 over asyncio streams to read the status line and the
+headers, any other client can be plugged in instead.
+
+"""
+import asyncio
+import ssl
+from urllib.parse import quote, urljoin, urlsplit
+
+from .cache import LRUCache
+
+REDIRECT_CODES = (301, 302, 303, 307, 308)
+USER_AGENT = 'twitter-text-python'
+
+# Shortlinks follow_shortlinks remembers to skip duplicates, so that memory
+# stays bounded on endless streams
+SEEN_SIZE = 100000
+
+_END = object()
+
+
+class TransportError(Exception):
+    """Raised by transports for responses which aren't valid HTTP"""
+
+
+async def http_transport(method, url):
+    """Make a single request, return (status, location header or None)"""
+    parts = urlsplit(url)
+    if parts.scheme not in ('http', 'https') or not parts.hostname:
+        raise TransportError('can not request %r' % url)
+
+    https = parts.scheme == 'https'
+    host = parts.hostname.encode('idna').decode('ascii')
+    port = parts.port or (443 if https else 80)
+    path = quote(parts.path or '/', safe="!$%&'()*+,/:;=@~")
+    if parts.query:
+        path += '?' + quote(parts.query, safe="!$%&'()*+,/:;=?@~")
+
+    reader, writer = await asyncio.open_connection(
+        host, port, ssl=ssl.create_default_context() if https else None)
+    try:
+        writer.write(('%s %s HTTP/1.1\r\nHost: %s\r\nUser-Agent: %s\r\n'
+                      'Connection: close\r\n\r\n'
+                      % (method, path, host if parts.port is None
+                         else '%s:%d' % (host, port), USER_AGENT))
+                     .encode('ascii'))
+        status_line = (await reader.readline()).split(None, 2)
+        if len(status_line) < 2 or not status_line[1].isdigit():
+            raise TransportError('invalid status line from %r' % url)
+
+        location = None
+        while True:
+            line = await reader.readline()
+            if not line.strip():
+                break
+
+            name, _, value = line.decode('latin-1').partition(':')
+            if name.strip().lower() == 'location':
+                location = value.strip()
+
+        return int(status_line[1]), location
+
+    finally:
+        writer.close()
+        # Wait for the TLS shutdown and the socket to close, not on 3.6
+        if hasattr(writer, 'wait_closed'):
+            try:
+                await writer.wait_closed()
+
+            except OSError:
+                pass
+
+
+async def follow(shortlink, transport=http_transport, timeout=10,
+                 max_redirects=10):
+    """Return the list of URLs shortlink redirects through, starting with
+    shortlink itself, or an empty list if it can't be followed
+
+    Each hop is a HEAD request, if the server rejects HEAD it is retried as a
+    GET. timeout is in seconds per request."""
+    all_urls = [shortlink]
+    url = shortlink
+    try:
+        for _ in range(max_redirects + 1):
+            status, location = await asyncio.wait_for(
+                transport('HEAD', url), timeout)
+            if status >= 400:
+                status, location = await asyncio.wait_for(
+                    transport('GET', url), timeout)
+
+            if status not in REDIRECT_CODES or location is None:
+                return all_urls
+
+            url = urljoin(url, location)
+            all_urls.append(url)
+
+    except (OSError, asyncio.TimeoutError, TransportError, ValueError):
+        # ValueError (and UnicodeError): malformed URLs, ports and hostnames
+        # which are too long to encode, from the transport or urljoin
+        return []
+
+    # too many redirects
+    return []
+
+
+async def follow_shortlinks(shortlinks, limit=8, seen_size=SEEN_SIZE,
+                            **kwargs):
+    """Follow redirects of shortlinks, yield (shortlink, chain) tuples
+
+    shortlinks is an iterable or an async iterator, it is consumed as the
+    lookups progress and duplicates are only followed once, as long as they
+    are among the last seen_size distinct shortlinks. At most limit
+    shortlinks are followed at the same time, the results are yielded in the
+    order they finish. The keyword arguments are passed to follow()."""
+    links = _aiter(shortlinks)
+    seen = LRUCache(seen_size)
+    pending = set()
+    next_link = None
+    try:
+        while True:
+            if next_link is None and links is not None \
+               and len(pending) < limit:
+                next_link = asyncio.ensure_future(_anext(links))
+
+            waiting = pending | {next_link} if next_link else pending
+            if not waiting:
+                return
+
+            done, _ = await asyncio.wait(waiting,
+                                         return_when=asyncio.FIRST_COMPLETED)
+            if next_link in done:
+                done.discard(next_link)
+                shortlink = next_link.result()
+                next_link = None
+                if shortlink is _END:
+                    links = None
+
+                elif seen.get(shortlink) is None:
+                    seen.set(shortlink, True)
+                    pending.add(asyncio.ensure_future(
+                        _follow_one(shortlink, kwargs)))
+
+            for task in done:
+                pending.discard(task)
+                yield task.result()
+
+    finally:
+        for task in pending | ({next_link} if next_link else set()):
+            task.cancel()
+
+
+async def _follow_one(shortlink, kwargs):
+    return shortlink, await follow(shortlink, **kwargs)
+
+
+async def _aiter(iterable):
+    if hasattr(iterable, '__aiter__'):
+        async for item in iterable:
+            yield item
+
+    else:
+        for item in iterable:
+            yield item
+
+
+async def _anext(iterator):
+    try:
+        return await iterator.__anext__()
+
+    except StopAsyncIteration:
+        return _END
@@ -0,0 +1,128 @@
+#  This file is part of twitter-text-python.
+#
+#  twitter-text-python is free software: you can redistribute it and/or
+#  modify it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  twitter-text-python is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License along with
+#  twitter-text-python. If not, see <http://www.gnu.org/licenses/>.
+
+# Caches -----------------------------------------------------------------------
+# ------------------------------------------------------------------------------
+"""Small caches without any dependencies."""
+import collections
+import threading
+import time
+
+_MISSING = object()
+
+
+class LRUCache(object):
+
+    """Size bounded mapping which evicts the least recently used entries.
+
+    With a ttl entries also expire ttl seconds after they were set, set() can
+    override the ttl per entry. Safe to share between threads. hits and misses
+    count the lookups done with get().
+
+    """
+    def __init__(self, max_size=1024, ttl=None, clock=time.time):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._clock = clock
+        self._entries = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is not None:
+                expires, value = entry
+                if expires is None or expires > self._clock():
+                    self._entries[key] = entry
+                    self.hits += 1
+                    return value
+
+            self.misses += 1
+            return default
+
+    def set(self, key, value, ttl=None):
+        ttl = self.ttl if ttl is None else ttl
+        expires = None if ttl is None else self._clock() + ttl
+        with self._lock:
+            self._entries.pop(key, None)
+            self._entries[key] = (expires, value)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.hits = self.misses = 0
+
+    def stats(self):
+        """Return the counters as a dict"""
+        return {'hits': self.hits, 'misses': self.misses,
+                'size': len(self._entries), 'max_size': self.max_size}
+
+    def __getstate__(self):
+        # Pickles as an empty cache with the same configuration
+        return self.max_size, self.ttl, self._clock
+
+    def __setstate__(self, state):
+        self.__init__(*state)
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class MemoCache(object):
+
+    """Size bounded memo where a hit is a single dict lookup.
+
+    An approximation of an LRU for hot paths where an LRUCache costs more than
+    the value it saves. Entries live in two generations of max_size / 2, a hit
+    in the old generation moves the entry to the young one. When the young
+    generation is full it replaces the old one, which drops every entry not
+    used since the last swap. Concurrent use can lose an insertion, never
+    return a wrong value.
+
+    """
+    def __init__(self, max_size=1024):
+        self.max_size = max_size
+        self._generation_size = max(1, max_size // 2)
+        self._young = {}
+        self._old = {}
+
+    def get(self, key, default=None):
+        value = self._young.get(key, _MISSING)
+        if value is _MISSING:
+            value = self._old.get(key, _MISSING)
+            if value is _MISSING:
+                return default
+
+            self.set(key, value)
+
+        return value
+
+    def set(self, key, value):
+        if len(self._young) >= self._generation_size:
+            self._old = self._young
+            self._young = {}
+
+        self._young[key] = value
+
+    def clear(self):
+        self._young = {}
+        self._old = {}
+
+    def __len__(self):
+        return len(self._young) + len(self._old)
@@ -0,0 +1,149 @@
+#  This file is part of twitter-text-python.
+#
+#  twitter-text-python is free software: you can redistribute it and/or
+#  modify it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  twitter-text-python is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License along with
+#  twitter-text-python. If not, see <http://www.gnu.org/licenses/>.
+
+# Columnar entity output -------------------------------------------------------
+# ------------------------------------------------------------------------------
+"""Extract the entities of a batch of texts into one array per field.
+
+Analytics code wants to count and group entities with vectorized operations,
+not walk a list of ParseResults. extract_columns() puts the entities of all
+texts into array.array buffers, without keeping a Python object per entity,
+and the entity texts into a table of unique strings. With NumPy installed
+EntityColumns.numpy() wraps the buffers without copying them.
+
+"""
+import array
+
+from . import ttp
+
+try:
+    import numpy
+
+except ImportError:
+    numpy = None
+
+# Type codes of the columns: 32 bit ints, the kinds are ttp.ENTITY_* codes
+INDEX_TYPE = 'i'
+KIND_TYPE = 'b'
+
+FIELDS = ('tweet', 'kind', 'start', 'end', 'text_id')
+
+
+class EntityColumns(object):
+
+    '''The entities of a batch of texts, one array per field.
+
+    Attributes:
+    - tweet
+        The index of the text of each entity in the batch.
+
+    - kind
+        The ttp.ENTITY_* code of each entity.
+
+    - start, end
+        The span of each entity in its text.
+
+    - text_id
+        The index of the text of each entity in strings.
+
+    - strings
+        A list of the unique entity texts, in the order they were first seen.
+
+    - text_count
+        The number of texts in the batch, with or without entities.
+
+    Entities are in the order of their texts, and in the order they appear
+    in each text.
+
+    '''
+
+    __slots__ = FIELDS + ('strings', 'text_count')
+
+    def __init__(self):
+        self.tweet = array.array(INDEX_TYPE)
+        self.kind = array.array(KIND_TYPE)
+        self.start = array.array(INDEX_TYPE)
+        self.end = array.array(INDEX_TYPE)
+        self.text_id = array.array(INDEX_TYPE)
+        self.strings = []
+        self.text_count = 0
+
+    def __len__(self):
+        return len(self.tweet)
+
+    def numpy(self):
+        '''Return a dict of the columns as NumPy arrays.
+
+        The arrays share the memory of the array.array buffers, so they are
+        only valid as long as this EntityColumns is not extended.
+
+        '''
+        if numpy is None:
+            raise ImportError('EntityColumns.numpy() needs NumPy')
+
+        arrays = {}
+        for field in FIELDS:
+            column = getattr(self, field)
+            if column:
+                arrays[field] = numpy.frombuffer(column, column.typecode)
+
+            else:
+                # Older versions of NumPy refuse empty buffers
+                arrays[field] = numpy.zeros(0, column.typecode)
+
+        return arrays
+
+
+def extract_columns(texts, parser=None, fold_case=False, columns=None):
+    '''Return the EntityColumns of the entities of an iterable of texts.
+
+    Uses a default Parser if none is given. With fold_case the entity texts
+    are lower cased before they are interned, so #Tag and #tag get the same
+    text_id. Pass the columns of an earlier batch to append to them, the
+    tweet indexes then carry on from its text_count and known texts keep
+    their ids.
+
+    '''
+    if parser is None:
+        parser = ttp.Parser()
+
+    if columns is None:
+        columns = EntityColumns()
+
+    extract = parser.extract
+    strings = columns.strings
+    ids = dict((string, i) for i, string in enumerate(strings))
+    tweet = columns.tweet.append
+    kind = columns.kind.append
+    start = columns.start.append
+    end = columns.end.append
+    text_id = columns.text_id.append
+    index = columns.text_count - 1
+    for index, text in enumerate(texts, columns.text_count):
+        for entity in extract(text):
+            string = entity.text.lower() if fold_case else entity.text
+            string_id = ids.get(string)
+            if string_id is None:
+                string_id = ids[string] = len(strings)
+                strings.append(string)
+
+            tweet(index)
+            kind(entity.kind)
+            start(entity.start)
+            end(entity.end)
+            text_id(string_id)
+
+    columns.text_count = index + 1
+    return columns
@@ -0,0 +1,406 @@
+#  This file is part of twitter-text-python.
+#
+#  twitter-text-python is free software: you can redistribute it and/or
+#  modify it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  twitter-text-python is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License along with
+#  twitter-text-python. If not, see <http://www.gnu.org/licenses/>.
+
+# Regex engines ----------------------------------------------------------------
+# ------------------------------------------------------------------------------
+"""The regex engines a Parser can match with.
+
+    >>> parser = ttp.Parser(engine='auto')
+
+- re
+    The standard library, the default.
+
+- regex
+    The regex module (https://pypi.org/project/regex/).
+
+- re2
+    Google's RE2 through google-re2 (https://pypi.org/project/google-re2/),
+    which matches in time linear in the length of the text whatever the
+    pattern, by construction.
+
+- auto
+    The first of re2, regex and re that is installed.
+
+All engines find the same entities: the patterns of ttp.ttp are compiled
+with the same ASCII semantics on each of them (translated to RE2 syntax for
+re2), and the tests check every installed engine against re.
+
+"""
+import re
+import threading
+
+from . import ttp
+
+ENGINES = ('re', 'regex', 're2')
+AUTO = 'auto'
+
+# Tried in this order by AUTO
+PREFERRED = ('re2', 'regex', 're')
+
+# Flags of re that the patterns use, by name, for the engines that have
+# their own flag values
+FLAG_NAMES = ('IGNORECASE', 'MULTILINE', 'DOTALL', 'VERBOSE')
+
+# What \s matches in re with the ASCII flag, RE2 leaves out the \v
+RE2_SPACES = r' \t\n\r\f\v'
+
+
+class Engine(object):
+
+    '''The compiled regexes of the ttp.ttp scanner on one engine.
+
+    Attributes:
+    - name
+        The name of the engine, one of ENGINES.
+
+    - triggers
+        The TRIGGER_REGEXES of ttp.ttp, by TRIGGER_* kinds.
+
+    - reply, mention, hashtag, url_domain, url_path, domain_run, at_run,
+      run_end
+        REPLY_REGEX, MENTION_ENTITY_REGEX, HASHTAG_ENTITY_REGEX,
+        URL_DOMAIN_REGEX, URL_PATH_REGEX, DOMAIN_RUN_REGEX, AT_RUN_REGEX and
+        RUN_END_REGEX of ttp.ttp.
+
+    Engines are shared by all Parsers, get one with get_engine(). They
+    pickle as their name.
+
+    '''
+    __slots__ = ('name', 'triggers', 'reply', 'mention', 'hashtag',
+                 'url_domain', 'url_path', 'domain_run', 'at_run', 'run_end')
+
+    def __init__(self, name, compile):
+        self.name = name
+        self.triggers = dict((kinds, compile(regex))
+                             for kinds, regex in ttp.TRIGGER_REGEXES.items())
+        self.reply = compile(ttp.REPLY_REGEX)
+        self.mention = compile(ttp.MENTION_ENTITY_REGEX)
+        self.hashtag = compile(ttp.HASHTAG_ENTITY_REGEX)
+        self.url_domain = compile(ttp.URL_DOMAIN_REGEX)
+        self.url_path = compile(ttp.URL_PATH_REGEX)
+        self.domain_run = compile(ttp.DOMAIN_RUN_REGEX)
+        self.at_run = compile(ttp.AT_RUN_REGEX)
+        self.run_end = compile(ttp.RUN_END_REGEX)
+
+    def __reduce__(self):
+        return get_engine, (self.name,)
+
+    def __repr__(self):
+        return '%s(%r)' % (self.__class__.__name__, self.name)
+
+
+_engines = {}
+
+
+def get_engine(name=AUTO):
+    '''Return the Engine of a name in ENGINES, or of AUTO.
+
+    Raises ImportError if the module of the engine is not installed.
+
+    '''
+    if name == AUTO:
+        for name in PREFERRED:
+            if name == 're' or available(name):
+                break
+
+    engine = _engines.get(name)
+    if engine is None:
+        if name not in ENGINES:
+            raise ValueError('unknown engine %r, use one of %s'
+                             % (name, ', '.join(ENGINES + (AUTO,))))
+
+        engine = _engines[name] = Engine(name, COMPILERS[name]())
+
+    return engine
+
+
+def available(name):
+    '''Return whether the module of an engine is installed.'''
+    if name == 're':
+        return True
+
+    try:
+        __import__(name)
+
+    except ImportError:
+        return False
+
+    return True
+
+
+# re ---------------------------------------------------------------------------
+def _re_compiler():
+    # The LazyRegexes themselves, so that nothing gets compiled before use
+    return lambda regex: regex
+
+
+# regex ------------------------------------------------------------------------
+def _regex_compiler():
+    import regex as module
+
+    def compile(lazy):
+        # Version 0 is the behaviour of re, ASCII has another value in regex
+        flags = module.V0 | module.ASCII
+        for name in FLAG_NAMES:
+            if lazy._flags & getattr(re, name):
+                flags |= getattr(module, name)
+
+        return module.compile(lazy._pattern, flags)
+
+    return compile
+
+
+# re2 --------------------------------------------------------------------------
+def _re2_compiler():
+    import re2 as module
+
+    cursors = threading.local()
+
+    def compile(lazy):
+        pattern = re2_pattern(lazy._pattern, lazy._flags & re.IGNORECASE)
+        return RE2Regex(module.compile(pattern), cursors)
+
+    return compile
+
+
+def _re2_tokens(pattern):
+    # Yield (RE2 syntax, code point or None) for each item of a pattern
+    i = 0
+    while i < len(pattern):
+        char = pattern[i]
+        if char != '\\':
+            yield char, ord(char)
+            i += 1
+
+        elif pattern[i + 1] == 'u':
+            yield '\\x{%s}' % pattern[i + 2:i + 6], int(pattern[i + 2:i + 6],
+                                                        16)
+            i += 6
+
+        elif pattern[i + 1] == 'x':
+            yield pattern[i:i + 4], int(pattern[i + 2:i + 4], 16)
+            i += 4
+
+        elif pattern[i + 1].isalnum():
+            # \s, \d, \B and the like, not a single character
+            yield pattern[i:i + 2], None
+            i += 2
+
+        else:
+            yield pattern[i:i + 2], ord(pattern[i + 1])
+            i += 2
+
+
+def _swap_case(low, high):
+    # The ranges of the other case of the ASCII letters from low to high
+    ranges = []
+    for first, last, shift in ((97, 122, -32), (65, 90, 32)):
+        start, end = max(low, first), min(high, last)
+        if start <= end:
+            ranges.append(chr(start + shift) if start == end else
+                          '%s-%s' % (chr(start + shift), chr(end + shift)))
+
+    return ranges
+
+
+def re2_pattern(pattern, ignorecase=False):
+    '''Return a pattern of ttp.ttp in RE2 syntax.
+
+    The result matches what the pattern matches in re with the ASCII flag.
+    RE2 folds case the Unicode way (so (?i)s matches U+017F, the long s),
+    ignorecase is therefore done by adding the other case of every ASCII
+    letter instead. Only handles the syntax that the patterns of ttp.ttp use.
+
+    '''
+    tokens = list(_re2_tokens(pattern)) + [(None, None)]
+    result = []
+    ranges = None   # (low, high) code points of the class being translated
+    last = None     # the code point in front of a - in a class
+    first = None    # the index in result of the first item of the class
+    i = 0
+    while tokens[i][0] is not None:
+        text, code = tokens[i]
+        i += 1
+        if ranges is None:
+            if text == '[':
+                ranges = []
+                last = None
+                first = len(result) + 1
+                if tokens[i][0] == '^':
+                    text += '^'
+                    i += 1
+
+            elif text == '\\s':
+                text = '[%s]' % RE2_SPACES
+
+            elif ignorecase and text.isalpha() and code < 128:
+                text = '[%s%s]' % (text.lower(), text.upper())
+
+            result.append(text)
+
+        elif text == ']':
+            if ignorecase:
+                # First, a trailing - would make them a range
+                result[first:first] = [swapped for low, high in ranges
+                                       for swapped in _swap_case(low, high)]
+
+            result.append(text)
+            ranges = None
+
+        elif text == '-' and last is not None and tokens[i][0] != ']':
+            high_text, high = tokens[i]
+            i += 1
+            ranges[-1] = (last, high)
+            result.append(text + high_text)
+            last = None
+
+        else:
+            result.append(RE2_SPACES if text == '\\s' else text)
+            last = code
+            if code is not None:
+                ranges.append((code, code))
+
+    return ''.join(result)
+
+
+class RE2Regex(object):
+
+    '''A compiled RE2 regex with the match() and search() of a re regex.
+
+    google-re2 encodes a str to UTF-8 on every call, which makes matching
+    at each trigger of a long text quadratic. RE2Regex matches the bytes of
+    the text instead: every text is encoded once, by the first regex of an
+    engine that sees it, and the offsets are converted from a cursor that
+    follows the calls through the text.
+
+    '''
+    __slots__ = ('_regex', '_cursors')
+
+    def __init__(self, regex, cursors):
+        self._regex = regex
+        self._cursors = cursors
+
+    @property
+    def pattern(self):
+        return self._regex.pattern
+
+    def match(self, text, pos=0):
+        cursor = self._cursor(text)
+        return cursor.result(self._regex.match(cursor.data,
+                                               cursor.to_byte(pos)))
+
+    def search(self, text, pos=0):
+        cursor = self._cursor(text)
+        return cursor.result(self._regex.search(cursor.data,
+                                                cursor.to_byte(pos)))
+
+    def _cursor(self, text):
+        cursor = getattr(self._cursors, 'cursor', None)
+        if cursor is None or cursor.text is not text:
+            cursor = self._cursors.cursor = _Cursor(text)
+
+        return cursor
+
+
+class _Cursor(object):
+
+    '''A text and its UTF-8 bytes, with a character offset and the offset
+    of its bytes. The scanner moves forward through the text, converting an
+    offset only has to encode or decode the part between it and the cursor.
+
+    '''
+    __slots__ = ('text', 'data', 'ascii', 'char', 'byte')
+
+    def __init__(self, text):
+        self.text = text
+        # A lone surrogate can't be encoded otherwise
+        self.data = text.encode('utf-8', 'surrogatepass')
+        self.ascii = len(self.data) == len(text)
+        self.char = self.byte = 0
+
+    def to_byte(self, char):
+        if self.ascii:
+            return char
+
+        if char >= self.char:
+            self.byte += len(self.text[self.char:char].encode('utf-8',
+                                                              'surrogatepass'))
+        else:
+            self.byte -= len(self.text[char:self.char].encode('utf-8',
+                                                              'surrogatepass'))
+        self.char = char
+        return self.byte
+
+    def to_char(self, byte):
+        if self.ascii or byte == -1:
+            return byte
+
+        if byte >= self.byte:
+            self.char += len(self.data[self.byte:byte].decode('utf-8',
+                                                              'surrogatepass'))
+        else:
+            self.char -= len(self.data[byte:self.byte].decode('utf-8',
+                                                              'surrogatepass'))
+        self.byte = byte
+        return self.char
+
+    def result(self, match):
+        if match is None:
+            return None
+
+        to_char = self.to_char
+        spans = []
+        for group in range(match.re.groups + 1):
+            start, end = match.span(group)
+            spans.append((to_char(start), to_char(end)))
+
+        return RE2Match(self.text, spans)
+
+
+class RE2Match(object):
+
+    '''The match of an RE2Regex, with the offsets and groups of the text
+    it matched instead of those of its bytes.'''
+
+    __slots__ = ('string', 'regs')
+
+    def __init__(self, string, regs):
+        self.string = string
+        self.regs = regs
+
+    def span(self, group=0):
+        return self.regs[group]
+
+    def start(self, group=0):
+        return self.regs[group][0]
+
+    def end(self, group=0):
+        return self.regs[group][1]
+
+    def group(self, *groups):
+        found = [self._group(group) for group in groups or (0,)]
+        return found[0] if len(found) == 1 else tuple(found)
+
+    def groups(self, default=None):
+        return tuple(self._group(group, default)
+                     for group in range(1, len(self.regs)))
+
+    def _group(self, group, default=None):
+        start, end = self.regs[group]
+        return default if start == -1 else self.string[start:end]
+
+
+COMPILERS = {'re': _re_compiler, 'regex': _regex_compiler,
+             're2': _re2_compiler}
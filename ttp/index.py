@@ -0,0 +1,311 @@
+#  This file is part of twitter-text-python.
+#
+#  twitter-text-python is free software: you can redistribute it and/or
+#  modify it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  twitter-text-python is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License along with
+#  twitter-text-python. If not, see <http://www.gnu.org/licenses/>.
+
+# Inverted entity index --------------------------------------------------------
+# ------------------------------------------------------------------------------
+"""An on disk index from users, hashtags, lists and URL domains to tweet ids.
+
+    >>> index = EntityIndex('archive.idx')
+    >>> index.add_many(pairs)   # (tweet id, text)
+    >>> index.flush()
+    >>> index.users('ianozsvald')
+    [1, 5, 12]
+
+The index is a directory of immutable segment files, every flush() writes
+the tweets added since the last one as a new segment. Segments are memory
+mapped and never read as a whole: a lookup binary searches the key table of
+each segment and reads the postings of that key only. merge() rewrites all
+segments as one.
+
+Segment layout, all numbers little endian:
+- header
+    magic, number of keys, offset of the key table
+- records
+    for each key its bytes, then its tweet ids as sorted unsigned 64 bit ints
+- key table
+    for each key, in the byte order of the keys: offset and length of the
+    key, offset and number of its tweet ids
+
+A key is the ttp.ENTITY_* kind as one byte followed by the lower case entity
+text in UTF-8, for ENTITY_URL the domain of the URL without a leading www.
+
+"""
+import errno
+import heapq
+import mmap
+import os
+import struct
+
+from . import ttp
+
+MAGIC = b'TTPIDX01'
+HEADER = struct.Struct('<8sQQ')
+ENTRY = struct.Struct('<QIQI')
+POSTING = struct.Struct('<Q')
+
+# Postings buffered in memory before add() flushes them to a segment
+BUFFER_SIZE = 100000
+
+SEGMENT_SUFFIX = '.seg'
+
+
+def url_domain(url):
+    '''Return the lower case host of a URL, without a leading www.'''
+    host = url.split('://', 1)[-1]
+    for separator in '/?#:':
+        host = host.split(separator, 1)[0]
+
+    host = host.lower()
+    return host[4:] if host.startswith('www.') else host
+
+
+def make_key(kind, text):
+    '''Return the key of an entity text, as stored in the segments.'''
+    return struct.pack('<B', kind) + text.lower().encode('utf-8')
+
+
+class Segment(object):
+
+    '''A memory mapped segment file.'''
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, 'rb') as f:
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        magic, self.key_count, self._table = HEADER.unpack_from(self._map, 0)
+        if magic != MAGIC:
+            self._map.close()
+            raise ValueError('%s is not an index segment' % path)
+
+    def _entry(self, i):
+        key_offset, key_length, offset, count = ENTRY.unpack_from(
+            self._map, self._table + i * ENTRY.size)
+        return self._map[key_offset:key_offset + key_length], offset, count
+
+    def _postings(self, offset, count):
+        return list(struct.unpack_from('<%dQ' % count, self._map, offset))
+
+    def find(self, key):
+        '''Return the tweet ids of key, an empty list if it has none.'''
+        low, high = 0, self.key_count
+        while low < high:
+            middle = (low + high) // 2
+            found, offset, count = self._entry(middle)
+            if found < key:
+                low = middle + 1
+
+            elif found > key:
+                high = middle
+
+            else:
+                return self._postings(offset, count)
+
+        return []
+
+    def __iter__(self):
+        '''Yield (key, tweet ids) for all keys in order.'''
+        for i in range(self.key_count):
+            key, offset, count = self._entry(i)
+            yield key, self._postings(offset, count)
+
+    def close(self):
+        self._map.close()
+
+
+def write_segment(path, items):
+    '''Write a segment from an iterable of (key, tweet ids) in key order.
+
+    The file is written under a temporary name and renamed once complete,
+    so that a segment is either all there or not at all.
+
+    '''
+    temporary = path + '.tmp'
+    table = []
+    with open(temporary, 'wb') as f:
+        f.write(HEADER.pack(MAGIC, 0, 0))
+        offset = HEADER.size
+        for key, ids in items:
+            f.write(key)
+            f.write(struct.pack('<%dQ' % len(ids), *ids))
+            table.append(ENTRY.pack(offset, len(key), offset + len(key),
+                                    len(ids)))
+            offset += len(key) + len(ids) * POSTING.size
+
+        f.write(b''.join(table))
+        f.seek(0)
+        f.write(HEADER.pack(MAGIC, len(table), offset))
+
+    os.rename(temporary, path)
+
+
+def _merge_ids(lists):
+    # Tweet ids of one key from several segments, sorted and unique
+    ids = []
+    for more in lists:
+        if ids and more and more[0] <= ids[-1]:
+            return sorted(set(ids).union(*lists))
+
+        ids.extend(more)
+
+    return ids
+
+
+class EntityIndex(object):
+
+    '''An on disk index of the users, hashtags, lists and URL domains of
+    tweets, see the module documentation for the format.
+
+    Tweets are added with add() or add_many() and kept in memory until
+    flush(), or until more than buffer_size postings are buffered. Lookups
+    see the buffered tweets too. Uses a default Parser if none is given.
+
+    Only one EntityIndex may write to a directory at a time.
+
+    '''
+
+    def __init__(self, path, parser=None, buffer_size=BUFFER_SIZE):
+        self.path = path
+        self._parser = parser if parser is not None else ttp.Parser()
+        self._buffer_size = buffer_size
+        self._buffer = {}
+        self._buffered = 0
+        try:
+            os.makedirs(path)
+
+        except OSError as e:
+            if e.errno != errno.EEXIST:
+                raise
+
+        self._segments = [Segment(os.path.join(path, name))
+                          for name in sorted(os.listdir(path))
+                          if name.endswith(SEGMENT_SUFFIX)]
+
+    def add(self, tweet_id, text):
+        '''Index the entities of a tweet.'''
+        keys = set()
+        for entity in self._parser.extract(text):
+            if entity.kind == ttp.ENTITY_URL:
+                keys.add(make_key(entity.kind, url_domain(entity.text)))
+
+            else:
+                keys.add(make_key(entity.kind, entity.text))
+
+        buffer = self._buffer
+        for key in keys:
+            ids = buffer.get(key)
+            if ids is None:
+                buffer[key] = [tweet_id]
+
+            else:
+                ids.append(tweet_id)
+
+        self._buffered += len(keys)
+        if self._buffered >= self._buffer_size:
+            self.flush()
+
+    def add_many(self, pairs):
+        '''Index an iterable of (tweet id, text) pairs.'''
+        add = self.add
+        for tweet_id, text in pairs:
+            add(tweet_id, text)
+
+    def flush(self):
+        '''Write the buffered tweets as a new segment.'''
+        if not self._buffer:
+            return
+
+        items = sorted((key, sorted(set(ids)))
+                       for key, ids in self._buffer.items())
+        self._write(items)
+        self._buffer = {}
+        self._buffered = 0
+
+    def merge(self):
+        '''Flush, then rewrite all segments as a single one.'''
+        self.flush()
+        if len(self._segments) < 2:
+            return
+
+        def items():
+            merged = heapq.merge(*[iter(segment)
+                                   for segment in self._segments])
+            key, lists = None, []
+            for next_key, ids in merged:
+                if next_key != key and lists:
+                    yield key, _merge_ids(lists)
+                    lists = []
+
+                key = next_key
+                lists.append(ids)
+
+            if lists:
+                yield key, _merge_ids(lists)
+
+        old = list(self._segments)
+        self._write(items())
+        self._segments = self._segments[-1:]
+        for segment in old:
+            segment.close()
+            os.remove(segment.path)
+
+    def lookup(self, kind, text):
+        '''Return the sorted ids of the tweets with an entity of a
+        ttp.ENTITY_* kind and text, for ENTITY_URL text is a domain.'''
+        if kind == ttp.ENTITY_URL:
+            text = url_domain(text)
+
+        key = make_key(kind, text)
+        lists = [segment.find(key) for segment in self._segments]
+        if key in self._buffer:
+            lists.append(sorted(set(self._buffer[key])))
+
+        return _merge_ids(lists)
+
+    def users(self, user):
+        return self.lookup(ttp.ENTITY_USER, user)
+
+    def tags(self, tag):
+        return self.lookup(ttp.ENTITY_TAG, tag)
+
+    def lists(self, user_list):
+        return self.lookup(ttp.ENTITY_LIST, user_list)
+
+    def domains(self, domain):
+        return self.lookup(ttp.ENTITY_URL, domain)
+
+    def close(self):
+        '''Flush and unmap all segments.'''
+        self.flush()
+        for segment in self._segments:
+            segment.close()
+
+        self._segments = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def _write(self, items):
+        number = 1
+        if self._segments:
+            name = os.path.basename(self._segments[-1].path)
+            number = int(name[:-len(SEGMENT_SUFFIX)]) + 1
+
+        path = os.path.join(self.path, '%08d%s' % (number, SEGMENT_SUFFIX))
+        write_segment(path, items)
+        self._segments.append(Segment(path))
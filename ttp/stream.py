@@ -0,0 +1,299 @@
+#  This file is part of twitter-text-python.
+#
+#  twitter-text-python is free software: you can redistribute it and/or
+#  modify it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  twitter-text-python is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License along with
+#  twitter-text-python. If not, see <http://www.gnu.org/licenses/>.
+
+# Streaming Tweet Parser -------------------------------------------------------
+# ------------------------------------------------------------------------------
+"""Parse newline delimited tweet files lazily, one line at a time.
+
+Everything in here is a generator, nothing is read before it is needed and
+nothing is kept after it has been yielded, so memory use does not depend on
+the size of the input.
+
+"""
+import json
+import mmap
+import os
+import re
+
+from . import ttp
+
+FORMATS = ('auto', 'jsonl', 'text')
+
+
+def read_tweets(lines, format='auto', field='text', on_error=None):
+    '''Yield a (record, text) tuple for each tweet in an iterable of lines.
+
+    `format` is one of:
+    - jsonl
+        Every line is a JSON object, the text is taken from `field`. Records
+        without that field (delete notices and the like) are skipped.
+
+    - text
+        Every line is the text of one tweet, record is None.
+
+    - auto
+        Lines starting with { are read as JSON, all others as text.
+
+    Blank lines are always skipped.
+
+    A line that isn't UTF-8, or JSON that isn't an object or has a `field`
+    which isn't a string, raises a ValueError naming the line number
+    (counting from 1). With on_error it is skipped instead, after calling
+    on_error(line number, error message).
+
+    '''
+    if format not in FORMATS:
+        raise ValueError('unknown format %r, use one of %s'
+                         % (format, ', '.join(FORMATS)))
+
+    for number, line in enumerate(lines, 1):
+        try:
+            if isinstance(line, bytes):
+                line = line.decode('utf-8')
+
+            stripped = line.strip()
+            if not stripped:
+                continue
+
+            if format == 'jsonl' or (format == 'auto' and stripped[0] == '{'):
+                record = json.loads(stripped)
+                if not isinstance(record, dict):
+                    raise ValueError('not a JSON object')
+
+                text = record.get(field)
+                if text is None:
+                    continue
+
+                if not isinstance(text, type(u'')):
+                    raise ValueError('%s is not a string' % field)
+
+                tweet = record, text
+
+            else:
+                tweet = None, line.rstrip(u'\r\n')
+
+        except ValueError as e:
+            # Also UnicodeDecodeError and the JSONDecodeError of Python 3
+            if on_error is None:
+                raise ValueError('line %d: %s' % (number, e))
+
+            on_error(number, str(e))
+            continue
+
+        yield tweet
+
+
+def parse_stream(lines, parser=None, html=False, format='auto', field='text',
+                 on_error=None):
+    '''Yield a (record, ParseResult) tuple for each tweet in lines.
+
+    See read_tweets for `format`, `field` and `on_error`. Uses a default
+    Parser if none is given.
+
+    '''
+    if parser is None:
+        parser = ttp.Parser()
+
+    for record, text in read_tweets(lines, format, field, on_error):
+        yield record, parser.parse(text, html)
+
+
+def result_to_dict(result):
+    '''Return the entities of a ParseResult as a JSON serialisable dict.'''
+    entities = {'urls': result.urls, 'users': result.users,
+                'lists': result.lists, 'tags': result.tags,
+                'reply': result.reply}
+
+    if result.html is not None:
+        entities['html'] = result.html
+
+    return entities
+
+
+def enrich(lines, parser=None, html=False, format='auto', field='text',
+           key='entities', on_error=None):
+    '''Yield a line of JSON for each tweet in lines with its entities added.
+
+    The entities of JSON records are stored under `key`, plain text tweets
+    become {field: text, key: entities}. See read_tweets for `on_error`.
+
+    '''
+    if parser is None:
+        parser = ttp.Parser()
+
+    for record, text in read_tweets(lines, format, field, on_error):
+        if record is None:
+            record = {field: text}
+
+        record[key] = result_to_dict(parser.parse(text, html))
+        yield json.dumps(record) + '\n'
+
+
+def write_jsonl(lines, out, **kwargs):
+    '''Write the enriched JSON lines of enrich to the file like object out.
+
+    Takes the same keyword arguments as enrich and returns the number of
+    tweets written.
+
+    '''
+    count = 0
+    for line in enrich(lines, **kwargs):
+        out.write(line)
+        count += 1
+
+    return count
+
+
+# Memory mapped plain text -----------------------------------------------------
+# The bytes of ttp.ENTITY_TRIGGERS in UTF-8, U+FF20 and U+FF03 are the full
+# width at sign and number sign. Starting with a character class lets the
+# regex engine skip ahead to candidates, which is three times faster than the
+# plain alternation.
+BYTE_TRIGGERS = re.compile(br'[@#\xefhHwW](?:(?<=[@#])|(?<=\xef)\xbc[\xa0\x83]'
+                           br'|(?<=[hH])[tT][tT][pP][sS]?://'
+                           br'|(?<=[wW])[wW][wW]\.)')
+
+
+# Bytes of the file mapped at a time, the mapped pages of a window count
+# towards the memory use of the process until it is unmapped
+WINDOW_SIZE = 16 * 1024 * 1024
+
+
+class MappedText(object):
+
+    '''A UTF-8 file of one tweet per line, memory mapped.
+
+    spans() finds the entities of every line as (offset, length) spans of
+    bytes in the file. The file is searched for the characters entities start
+    with without reading it into strings first, only the lines which have
+    one are ever decoded, so most of a dump is never copied at all.
+
+    The file is mapped window_size bytes at a time (a multiple of
+    mmap.ALLOCATIONGRANULARITY), lines longer than that get a bigger window.
+
+    '''
+
+    def __init__(self, path, window_size=WINDOW_SIZE):
+        if window_size <= 0 or window_size % mmap.ALLOCATIONGRANULARITY:
+            raise ValueError('window_size must be a multiple of %d'
+                             % mmap.ALLOCATIONGRANULARITY)
+
+        self.path = path
+        self._window_size = window_size
+        self._file = open(path, 'rb')
+        self._size = os.fstat(self._file.fileno()).st_size
+
+    def __len__(self):
+        return self._size
+
+    def text(self, offset, length):
+        '''Return the text of a span of the file.'''
+        self._file.seek(offset)
+        return self._file.read(length).decode('utf-8')
+
+    def spans(self, parser=None):
+        '''Yield (offset, length, entities) for each line with entities.
+
+        offset and length are the span of the line without its line break,
+        entities is a list of (kind, offset, length) tuples of the ttp.ENTITY_*
+        kind and the span of each entity in the file. Uses a default Parser if
+        none is given.
+
+        '''
+        if parser is None:
+            parser = ttp.Parser()
+
+        extract = parser.extract
+        search = BYTE_TRIGGERS.search
+        for base, data, pos, limit in self._windows():
+            while True:
+                trigger = search(data, pos, limit)
+                if trigger is None:
+                    break
+
+                start = data.rfind(b'\n', 0, trigger.start()) + 1
+                end = data.find(b'\n', trigger.end(), limit)
+                if end == -1:
+                    end = limit
+
+                pos = end + 1
+                line_end = end - 1 if data[end - 1:end] == b'\r' else end
+                line = data[start:line_end].decode('utf-8')
+                entities = extract(line)
+                if not entities:
+                    continue
+
+                spans = []
+                if len(line) == line_end - start:
+                    # ASCII, characters are bytes
+                    for entity in entities:
+                        spans.append((entity.kind, base + start + entity.start,
+                                      entity.end - entity.start))
+
+                else:
+                    char, byte = 0, base + start
+                    for entity in entities:
+                        byte += len(line[char:entity.start].encode('utf-8'))
+                        length = len(line[entity.start:entity.end]
+                                     .encode('utf-8'))
+                        spans.append((entity.kind, byte, length))
+                        char = entity.start
+
+                yield base + start, line_end - start, spans
+
+    def _windows(self):
+        '''Map the file one window at a time, yield (offset, map, start,
+        limit) with the lines from start to limit of the map to be read.'''
+        offset, start = 0, 0
+        length = self._window_size
+        while offset + start < self._size:
+            length = min(length, self._size - offset)
+            data = mmap.mmap(self._file.fileno(), length,
+                             access=mmap.ACCESS_READ, offset=offset)
+            try:
+                if offset + length == self._size:
+                    limit = length
+
+                else:
+                    # Up to the end of the last whole line
+                    limit = data.rfind(b'\n', start) + 1
+
+                if limit:
+                    if hasattr(data, 'madvise'):
+                        data.madvise(mmap.MADV_SEQUENTIAL)
+
+                    yield offset, data, start, limit
+
+            finally:
+                data.close()
+
+            if not limit:
+                # Not even one line in the window
+                length *= 2
+                continue
+
+            # The next window starts at the limit of this one, or a little
+            # before it to keep its offset aligned
+            start = limit % mmap.ALLOCATIONGRANULARITY
+            offset += limit - start
+
+    def close(self):
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
@@ -17,8 +17,50 @@
 
 # twp - Unittests --------------------------------------------------------------
 # ------------------------------------------------------------------------------
+import json
+import mmap
+import multiprocessing
+import os
+import pickle
+import random
+import re
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
 import unittest
-import ttp
+
+# Import the package, not the modules next to this file
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from ttp import aggregate
+from ttp import cache
+from ttp import columns
+from ttp import engines
+from ttp import index as ttp_index
+from ttp import stream
+from ttp import ttp
+from ttp import utils
+from ttp import validation
+
+try:
+    import asyncio
+    from ttp import aio
+except (ImportError, SyntaxError):
+    # Python 2
+    aio = None
+
+try:
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+    from socketserver import ThreadingMixIn
+    from urllib.parse import quote
+except ImportError:
+    # Python 2
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+    from SocketServer import ThreadingMixIn
+    from urllib import quote
 
 
 class TWPTests(unittest.TestCase):
@@ -585,6 +627,41 @@ class TWPTestsWithSpans(unittest.TestCase):
         self.assertEqual(result.users, [(u'CokeZero', (7, 16)), (u'EASPORTS', (47, 56)), (u'EANCAAFootball', (57, 72))])
         self.assertEqual(result.tags, [(u'GameOn', (76, 83)), (u'ad', (84, 87))])
 
+    def test_spans_html_mode(self):
+        """Spans are the same with and without HTML and point into the original text"""
+        text = u'RT @someone: #GameOn ＠user/my-list, see www.example.com/path?q=1&r=2 ＃ad@x'
+        result = self.parser.parse(text)
+        self.assertEqual(result.users, [(u'someone', (3, 11))])
+        self.assertEqual(result.lists, [(u'user', u'my-list', (21, 34))])
+        self.assertEqual(result.tags, [(u'GameOn', (13, 20)), (u'ad', (69, 72))])
+        self.assertEqual(result.urls, [(u'www.example.com/path?q=1&r=2', (40, 68))])
+
+        plain = self.parser.parse(text, html=False)
+        self.assertEqual((result.urls, result.users, result.lists, result.tags),
+                         (plain.urls, plain.users, plain.lists, plain.tags))
+
+    def test_spans_point_into_text(self):
+        for text in [u'@a @b/c #d http://e.com', u'.@username/list', u'text @username/list',
+                     u'@@user/list ＠＠user', u'いまなにしてるhttp://example.comいまなにしてる #hashtagの',
+                     u'Follow @CokeZero & Retweet for a chance to win @EASPORTS @EANCAAFootball 13 #GameOn #ad Rules: http://bit.ly/EANCAA @someone']:
+            result = self.parser.parse(text)
+            for url, (start, end) in result.urls:
+                self.assertEqual(text[start:end], url)
+
+            for user, (start, end) in result.users:
+                self.assertEqual(text[start:end], (u'@' if text[start] == u'@' else u'＠') + user)
+
+            for user, list_name, (start, end) in result.lists:
+                self.assertTrue(text[start] in u'@＠')
+                self.assertEqual(text[start:end].lstrip(u'@＠'), user + u'/' + list_name)
+
+            for tag, (start, end) in result.tags:
+                self.assertTrue(text[start] in u'#＃')
+                self.assertEqual(text[start + 1:end], tag)
+
+            for entity in result.entities:
+                self.assertTrue(text[entity.start:entity.end].endswith(entity.text))
+
     def test_users_in_tweets(self):
         result = self.parser.parse(u'Follow @CokeZero & Retweet for a chance to win @EASPORTS @EANCAAFootball 13 #GameOn #ad Rules: http://bit.ly/EANCAA @someone', html=False)
         self.assertEqual(result.users, [(u'CokeZero', (7, 16)), (u'EASPORTS', (47, 56)), (u'EANCAAFootball', (57, 72)), (u'someone', (116, 124))])
@@ -601,6 +678,1388 @@ class TWPTestsWithSpans(unittest.TestCase):
         self.assertEqual(result.urls, [(u'http://some.com', (1, 16))])
 
 
+class TWPExtractTests(unittest.TestCase):
+
+    """Test the entity only fast path"""
+    def setUp(self):
+        self.parser = ttp.Parser()
+
+    def test_extract(self):
+        text = u'@user: see http://example.com/path, @user/list-foo #tag #1234'
+        self.assertEqual(self.parser.extract(text), [ttp.Mention(u'user', 0, 5),
+                                                     ttp.Url(u'http://example.com/path', 11, 34),
+                                                     ttp.ListRef(u'user', u'list-foo', 36, 50),
+                                                     ttp.Hashtag(u'tag', 51, 55)])
+
+    def test_extract_none(self):
+        self.assertEqual(self.parser.extract(u'nothing to see here'), [])
+
+    def test_extract_matches_parse(self):
+        text = u'Follow @CokeZero & Retweet for a chance to win @EASPORTS @EANCAAFootball 13 #GameOn #ad Rules: http://bit.ly/EANCAA'
+        result = ttp.Parser(include_spans=True).parse(text, html=False)
+        entities = self.parser.extract(text)
+        self.assertEqual([(entity.text, entity.span) for entity in entities if entity.kind == ttp.ENTITY_URL], result.urls)
+        self.assertEqual([(entity.text, entity.span) for entity in entities if entity.kind == ttp.ENTITY_USER], result.users)
+        self.assertEqual([(entity.text, entity.span) for entity in entities if entity.kind == ttp.ENTITY_TAG], result.tags)
+
+
+class TWPPrefilterTests(unittest.TestCase):
+
+    """Test the substring prefilter in front of the scanner"""
+    def test_prefilter(self):
+        self.assertEqual(ttp.prefilter(u'no entities here, not even www or w.'), 0)
+        self.assertEqual(ttp.prefilter(u'hi @user'), ttp.TRIGGER_MENTION)
+        self.assertEqual(ttp.prefilter(u'hi ＠user'), ttp.TRIGGER_MENTION)
+        self.assertEqual(ttp.prefilter(u'＃tag'), ttp.TRIGGER_HASHTAG)
+        self.assertEqual(ttp.prefilter(u'see http://example.com'), ttp.TRIGGER_URL)
+        self.assertEqual(ttp.prefilter(u'see WwW.example.com'), ttp.TRIGGER_URL)
+        self.assertEqual(ttp.prefilter(u'know. how.'), 0)
+        self.assertEqual(ttp.prefilter(u'@a #b www.c.com'), ttp.TRIGGER_ALL)
+
+    def test_partial_triggers(self):
+        parser = ttp.Parser()
+        result = parser.parse(u'   @user #tag')
+        self.assertEqual((result.users, result.tags, result.reply), ([u'user'], [u'tag'], u'user'))
+
+        result = parser.parse(u'WWW.EXAMPLE.COM/path#frag')
+        self.assertEqual((result.urls, result.tags), ([u'WWW.EXAMPLE.COM/path#frag'], []))
+
+        result = parser.parse(u'no entities at all')
+        self.assertEqual((result.entities, result.reply, result.html), ((), None, u'no entities at all'))
+
+    @unittest.skipUnless(bytes is str, 'byte strings are only parsed on Python 2')
+    def test_byte_string(self):
+        # UTF-8 byte strings parse as bytes, like they did in 1.0.1
+        parser = ttp.Parser()
+        self.assertEqual(ttp.prefilter(b'plain caf\xc3\xa9 w.'), 0)
+        self.assertEqual(parser.parse(b'plain caf\xc3\xa9').html, b'plain caf\xc3\xa9')
+        result = parser.parse(b'caf\xc3\xa9 @user #tag @a/b http://\xc3\xa9x.com/path and more')
+        self.assertEqual((result.users, result.tags, result.lists, result.urls),
+                         ([b'user'], [b'tag'], [(b'a', b'b')], [b'http://\xc3\xa9x.com/path']))
+        html = result.html
+        self.assertTrue(isinstance(html, bytes))
+        self.assertTrue(b'<a href="http://\xc3\xa9x.com/path">http://\xc3\xa9x.com/path</a>' in html)
+
+
+class TWPParseResultTests(unittest.TestCase):
+
+    """Test the entity records and the lazy HTML of ParseResult"""
+    def setUp(self):
+        self.parser = ttp.Parser()
+        self.text = u'＠user @user/list www.example.com ＃tag'
+
+    def test_entities(self):
+        result = self.parser.parse(self.text)
+        self.assertEqual(result.entities, (ttp.Mention(u'user', 0, 5),
+                                           ttp.ListRef(u'user', u'list', 6, 16),
+                                           ttp.Url(u'www.example.com', 17, 32),
+                                           ttp.Hashtag(u'tag', 33, 37)))
+        self.assertEqual([entity.kind for entity in result.entities],
+                         [ttp.ENTITY_USER, ttp.ENTITY_LIST, ttp.ENTITY_URL, ttp.ENTITY_TAG])
+        self.assertEqual(result.entities[1].text, u'user/list')
+        self.assertEqual(result.entities[1].span, (6, 16))
+        self.assertFalse(hasattr(result, '__dict__'))
+        self.assertFalse(hasattr(result.entities[0], '__dict__'))
+
+    def test_lazy_html(self):
+        result = self.parser.parse(self.text)
+        self.assertEqual(result._html, None)
+        self.assertEqual(result.html, u'<a href="http://twitter.com/user">＠user</a> <a href="http://twitter.com/user/list">@user/list</a> '
+                                      u'<a href="http://www.example.com">www.example.com</a> <a href="http://search.twitter.com/search?q=%23tag">＃tag</a>')
+        self.assertEqual(result._parser, None)
+        self.assertEqual(self.parser.parse(self.text, html=False).html, None)
+
+    def test_pickle(self):
+        for protocol in range(pickle.HIGHEST_PROTOCOL + 1):
+            result = pickle.loads(pickle.dumps(self.parser.parse(self.text), protocol))
+            self.assertEqual(result.entities, self.parser.parse(self.text).entities)
+            self.assertEqual(result.users, [u'user'])
+            self.assertEqual(result.html, self.parser.parse(self.text).html)
+
+    def test_old_constructor(self):
+        result = ttp.ParseResult([u'http://a.com'], [u'a'], u'a', None, [u'b'], u'<a>')
+        self.assertEqual((result.urls, result.users, result.reply, result.lists, result.tags, result.html),
+                         ([u'http://a.com'], [u'a'], u'a', [], [u'b'], u'<a>'))
+        self.assertEqual(result.entities, ())
+        result = pickle.loads(pickle.dumps(result))
+        self.assertEqual((result.urls, result.tags), ([u'http://a.com'], [u'b']))
+
+    def test_lists_are_kept(self):
+        result = self.parser.parse(self.text)
+        self.assertTrue(result.users is result.users)
+        result.users.append(u'other')
+        result.tags = [u'replaced']
+        self.assertEqual((result.users, result.tags), ([u'user', u'other'], [u'replaced']))
+        self.assertEqual(len(result.entities), 4)
+
+        copy = result.__copy__()
+        copy.users.append(u'third')
+        self.assertEqual(result.users, [u'user', u'other'])
+        self.assertEqual(pickle.loads(pickle.dumps(result)).tags, [u'replaced'])
+
+
+class TWPThreadingTests(unittest.TestCase):
+
+    """Test that one Parser can be shared between threads"""
+    def setUp(self):
+        self.parser = ttp.Parser(include_spans=True)
+        self.tweets = [u'@user%d: see http://example%d.com/%d #tag%d @user%d/list%d' % ((i,) * 6)
+                       for i in range(32)]
+
+    def expected(self, tweet):
+        result = ttp.Parser(include_spans=True).parse(tweet)
+        return (result.urls, result.users, result.lists, result.tags, result.reply, result.html)
+
+    def test_shared_parser(self):
+        expected = dict((tweet, self.expected(tweet)) for tweet in self.tweets)
+        failures = []
+
+        def worker(offset):
+            for i in range(200):
+                tweet = self.tweets[(offset + i) % len(self.tweets)]
+                result = self.parser.parse(tweet, html=i % 2 == 0)
+                got = (result.urls, result.users, result.lists, result.tags, result.reply)
+                if got != expected[tweet][:5] or (result.html is not None and result.html != expected[tweet][5]):
+                    failures.append((tweet, got))
+
+        # Switch threads as often as possible to provoke any interleaving
+        if hasattr(sys, 'setswitchinterval'):
+            interval = sys.getswitchinterval()
+            sys.setswitchinterval(1e-6)
+        else:
+            interval = sys.getcheckinterval()
+            sys.setcheckinterval(1)
+
+        try:
+            threads = [threading.Thread(target=worker, args=(n,)) for n in range(16)]
+            for thread in threads:
+                thread.start()
+
+            for thread in threads:
+                thread.join()
+
+        finally:
+            if hasattr(sys, 'setswitchinterval'):
+                sys.setswitchinterval(interval)
+            else:
+                sys.setcheckinterval(interval)
+
+        self.assertEqual(failures, [])
+
+
+class UpperTagParser(ttp.Parser):
+
+    """A Parser with a custom hashtag formatter, used by TWPParseManyTests"""
+    def format_tag(self, tag, text):
+        return u'<b>%s%s</b>' % (tag, text.upper())
+
+
+class TWPParseManyTests(unittest.TestCase):
+
+    """Test Parser.parse_many with and without a process pool"""
+    def setUp(self):
+        self.tweets = [u'@user%d: see http://example.com/%d #tag%d' % (i, i, i)
+                       for i in range(ttp.POOL_MIN_BATCH + 50)]
+
+    def assertResultsEqual(self, results, expected):
+        self.assertEqual(len(results), len(expected))
+        for result, other in zip(results, expected):
+            self.assertEqual((result.urls, result.users, result.lists, result.tags, result.reply, result.html),
+                             (other.urls, other.users, other.lists, other.tags, other.reply, other.html))
+
+    def test_small_batch(self):
+        parser = ttp.Parser(include_spans=True)
+        tweets = self.tweets[:10]
+        results = parser.parse_many(iter(tweets), workers=4)
+        self.assertResultsEqual(results, [parser.parse(tweet) for tweet in tweets])
+
+    def test_pool_keeps_order(self):
+        parser = ttp.Parser(include_spans=True)
+        results = parser.parse_many(self.tweets, html=False, workers=2, chunksize=7)
+        self.assertResultsEqual(results, [parser.parse(tweet, html=False) for tweet in self.tweets])
+        self.assertEqual(results[-1].users, [(u'user%d' % (len(self.tweets) - 1), (0, 9))])
+
+    def test_pool_subclass(self):
+        parser = UpperTagParser(max_url_length=10)
+        results = parser.parse_many(self.tweets, workers=2)
+        self.assertResultsEqual(results, [parser.parse(tweet) for tweet in self.tweets])
+        self.assertTrue(results[3].html.endswith(u'<b>#TAG3</b>'))
+
+    def test_pool_stats(self):
+        stats = ttp.ParseStats()
+        stats.add(ttp.STAGE_SCAN, 0.5, 2)
+        parser = ttp.Parser(stats=stats)
+        parser.parse_many(self.tweets, workers=2, chunksize=100)
+        counters = stats.as_dict()
+        count = len(self.tweets)
+        self.assertEqual(counters['stages']['scan']['calls'], count + 1)
+        self.assertEqual(counters['stages']['scan']['entities'], 3 * count + 2)
+        self.assertTrue(counters['stages']['scan']['time'] > 0.5)
+        self.assertEqual(counters['stages']['html']['calls'], count)
+        self.assertEqual(counters['entities'], {'urls': count, 'users': count, 'lists': 0, 'tags': count})
+
+
+class TWPStreamTests(unittest.TestCase):
+
+    """Test the streaming parser and the command line interface"""
+    def setUp(self):
+        self.lines = [b'{"id": 1, "text": "@user hi http://example.com #tag"}\n',
+                      b'{"delete": {"status": {"id": 2}}}\n',
+                      b'\n',
+                      u'plain text @other\n'.encode('utf-8'),
+                      u'{"id": 3, "text": "\uff03hashtag\u306e"}\n'.encode('utf-8')]
+
+    def test_read_tweets(self):
+        tweets = list(stream.read_tweets(self.lines))
+        self.assertEqual(tweets, [({u'id': 1, u'text': u'@user hi http://example.com #tag'}, u'@user hi http://example.com #tag'),
+                                  (None, u'plain text @other'),
+                                  ({u'id': 3, u'text': u'\uff03hashtag\u306e'}, u'\uff03hashtag\u306e')])
+
+        tweets = list(stream.read_tweets(self.lines, format='text'))
+        self.assertEqual(len(tweets), 4)
+        self.assertEqual(tweets[0], (None, u'{"id": 1, "text": "@user hi http://example.com #tag"}'))
+
+        self.assertRaises(ValueError, list, stream.read_tweets(self.lines, format='xml'))
+
+    def test_parse_stream_is_lazy(self):
+        def lines():
+            yield b'{"text": "#first"}'
+            raise AssertionError('read too far')
+
+        results = stream.parse_stream(lines())
+        record, result = next(results)
+        self.assertEqual(result.tags, [u'first'])
+        self.assertEqual(result.html, None)
+
+    def test_write_jsonl(self):
+        class Out(object):
+            def __init__(self):
+                self.lines = []
+
+            def write(self, line):
+                self.lines.append(line)
+
+        out = Out()
+        count = stream.write_jsonl(self.lines, out, parser=ttp.Parser(include_spans=True), html=True)
+        self.assertEqual(count, 3)
+        records = [json.loads(line) for line in out.lines]
+        self.assertEqual(records[0][u'id'], 1)
+        self.assertEqual(records[0][u'entities'][u'users'], [[u'user', [0, 5]]])
+        self.assertEqual(records[0][u'entities'][u'urls'], [[u'http://example.com', [9, 27]]])
+        self.assertEqual(records[0][u'entities'][u'reply'], u'user')
+        self.assertEqual(records[1][u'text'], u'plain text @other')
+        self.assertEqual(records[1][u'entities'][u'users'], [[u'other', [11, 17]]])
+        self.assertEqual(records[2][u'entities'][u'html'], u'<a href="http://search.twitter.com/search?q=%23hashtag">\uff03hashtag</a>\u306e')
+
+    def test_command_line(self):
+        root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        process = subprocess.Popen([sys.executable, '-m', 'ttp', '--key', 'ttp'], cwd=root,
+                                   stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+        output = process.communicate(b''.join(self.lines))[0]
+        self.assertEqual(process.returncode, 0)
+        records = [json.loads(line) for line in output.decode('utf-8').splitlines()]
+        self.assertEqual([record[u'ttp'][u'tags'] for record in records], [[u'tag'], [], [u'hashtag']])
+
+    def test_bad_records(self):
+        lines = [b'{"text": "#a"}', b'{"text": "trunc', b'[1, 2]', b'{"text": 5}', b'\xff\xfe', b'{"text": "#b"}']
+        with self.assertRaises(ValueError) as caught:
+            list(stream.read_tweets(lines, format='jsonl'))
+
+        self.assertTrue(str(caught.exception).startswith('line 2: '))
+        with self.assertRaises(ValueError) as caught:
+            list(stream.read_tweets(lines[2:], format='jsonl'))
+
+        self.assertEqual(str(caught.exception), 'line 1: not a JSON object')
+
+        errors = []
+        tweets = list(stream.read_tweets(lines, format='jsonl', on_error=lambda *error: errors.append(error)))
+        self.assertEqual([text for record, text in tweets], [u'#a', u'#b'])
+        self.assertEqual([number for number, message in errors], [2, 3, 4, 5])
+        self.assertEqual(errors[2], (4, 'text is not a string'))
+
+    def test_command_line_errors(self):
+        root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        lines = b'{"text": "#a"}\n{"text": "trunc\n{"text": "#b"}\n'
+        for args, status, tags in ((['--skip-errors'], 0, [[u'a'], [u'b']]), ([], 1, [[u'a']])):
+            process = subprocess.Popen([sys.executable, '-m', 'ttp'] + args, cwd=root, stdin=subprocess.PIPE,
+                                       stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+            output, errors = process.communicate(lines)
+            self.assertEqual(process.returncode, status)
+            self.assertTrue(b'line 2: ' in errors)
+            self.assertFalse(b'Traceback' in errors)
+            self.assertEqual(b'skipped 1 lines' in errors, bool(args))
+            records = [json.loads(line) for line in output.decode('utf-8').splitlines()]
+            self.assertEqual([record[u'entities'][u'tags'] for record in records], tags)
+
+
+class TWPEscapeTests(unittest.TestCase):
+
+    """Test the HTML escaping"""
+    def test_entities(self):
+        self.assertEqual(ttp.escape(u'<a href="x">Tom\'s & Jerry</a>'),
+                         u'&lt;a href=&quot;x&quot;&gt;Tom&apos;s &amp; Jerry&lt;/a&gt;')
+
+    def test_no_double_escape(self):
+        self.assertEqual(ttp.escape(u'&amp;<'), u'&amp;amp;&lt;')
+
+    def test_type_kept(self):
+        self.assertEqual(type(ttp.escape('a&b')), str)
+        self.assertEqual(type(ttp.escape(u'a&b\u2603')), type(u''))
+        self.assertEqual(ttp.escape(u'plain \u2603'), u'plain \u2603')
+
+    def test_long_url(self):
+        url = u'http://example.com/?' + u'a=1&' * 1000
+        self.assertEqual(ttp.escape(url), u'http://example.com/?' + u'a=1&amp;' * 1000)
+
+
+class TWPFormatterTests(unittest.TestCase):
+
+    """Test the HTML formatter and its hashtag memo"""
+    def test_base_urls(self):
+        formatter = ttp.HTMLFormatter(tag_url='https://twitter.com/search?f=%s&q=', user_url='https://twitter.com/')
+        result = ttp.Parser(formatter=formatter).parse(u'@user @user/list #tag')
+        self.assertEqual(result.html, u'<a href="https://twitter.com/user">@user</a> <a href="https://twitter.com/user/list">@user/list</a> '
+                                      u'<a href="https://twitter.com/search?f=%s&q=%23tag">#tag</a>')
+
+    def test_override_hook(self):
+        result = UpperTagParser().parse(u'#tag @user')
+        self.assertEqual(result.html, u'<b>#TAG</b> <a href="http://twitter.com/user">@user</a>')
+
+    def test_tag_memo(self):
+        formatter = ttp.HTMLFormatter(tag_cache_size=4)
+        for tag in (u'caf\xe9', u'a', u'b', u'caf\xe9', u'c', u'd', u'caf\xe9'):
+            self.assertEqual(formatter.tag(u'#', tag), u'<a href="http://search.twitter.com/search?q=%%23%s">#%s</a>'
+                             % (quote(tag.encode('utf-8')), tag))
+
+        self.assertTrue(len(formatter._quoted_tags) <= 4)
+
+    def test_memo_cache(self):
+        memo = cache.MemoCache(4)
+        for key in 'abcdef':
+            memo.set(key, key.upper())
+            self.assertEqual(memo.get('a'), 'A')
+
+        self.assertEqual(len(memo), 4)
+        self.assertEqual((memo.get('a'), memo.get('b'), memo.get('f')), ('A', None, 'F'))
+
+
+class TWPParseCacheTests(unittest.TestCase):
+
+    """Test the cache of parse results"""
+    def setUp(self):
+        self.parser = ttp.Parser(cache_size=2)
+
+    def test_stats(self):
+        self.assertEqual(ttp.Parser().cache_stats(), None)
+        for text in (u'RT @a: #b', u'RT @a: #b', u'RT @a: #b', u'@c', u'@d', u'RT @a: #b'):
+            self.parser.parse(text)
+
+        self.assertEqual(self.parser.cache_stats(), {'hits': 2, 'misses': 4, 'size': 2, 'max_size': 2})
+
+    def test_same_results(self):
+        plain = ttp.Parser()
+        for text in (u'RT @a: #b http://t.co/x', u'RT @a: #b http://t.co/x', u'@user/list'):
+            for html in (True, False):
+                cached, expected = self.parser.parse(text, html), plain.parse(text, html)
+                self.assertEqual(cached.entities, expected.entities)
+                self.assertEqual(cached.reply, expected.reply)
+                self.assertEqual(cached.html, expected.html)
+
+        self.assertEqual(self.parser.cache_stats()['hits'], 2)
+
+    def test_results_are_copies(self):
+        result = self.parser.parse(u'@a #b')
+        result.reply = u'x'
+        result.entities[0].text = u'x'
+        again = self.parser.parse(u'@a #b')
+        self.assertEqual(again.reply, u'a')
+        self.assertEqual(again.entities, (ttp.Mention(u'a', 0, 2), ttp.Hashtag(u'b', 3, 5)))
+        self.assertFalse(again.entities[0] is self.parser.parse(u'@a #b').entities[0])
+
+    def test_config_in_key(self):
+        parser = ttp.Parser(include_spans=True, max_url_length=10, cache_size=10)
+        parser.parse(u'@a http://example.com/long/path')
+        parser._include_spans, parser._max_url_length = False, 30
+        result = parser.parse(u'@a http://example.com/long/path')
+        self.assertEqual(result.users, [u'a'])
+        self.assertEqual(result.html, ttp.Parser().parse(u'@a http://example.com/long/path').html)
+        self.assertEqual(parser.cache_stats()['misses'], 2)
+
+    def test_cached_results_are_rendered(self):
+        # Threads hitting the cache share the cached result, it must not
+        # change after it is cached
+        self.parser.parse(u'#a @b', html=True)
+        self.parser.parse(u'#a @b', html=False)
+        for html in (True, False):
+            cached = self.parser._cache.get((u'#a @b', html, False, 30))
+            self.assertEqual((cached._parser, cached._text), (None, None))
+
+        self.assertEqual(cached.html, None)
+
+    def test_pickle(self):
+        self.parser.parse(u'@a')
+        parser = pickle.loads(pickle.dumps(self.parser))
+        self.assertEqual(parser.cache_stats(), {'hits': 0, 'misses': 0, 'size': 0, 'max_size': 2})
+        self.assertEqual(parser.parse(u'@a').users, [u'a'])
+
+
+class TickClock(object):
+
+    """A clock that advances by one second every time it is read"""
+    def __init__(self):
+        self.now = 0
+
+    def __call__(self):
+        self.now += 1
+        return self.now
+
+
+class TWPParseStatsTests(unittest.TestCase):
+
+    """Test the per stage counters of Parser.parse"""
+    def setUp(self):
+        self.stats = ttp.ParseStats(clock=TickClock())
+        self.parser = ttp.Parser(stats=self.stats)
+
+    def test_stages(self):
+        results = [self.parser.parse(text) for text in (u'@a hi #b @c/d http://t.co/x', u'no entities', u'#one #two')]
+        self.assertEqual(self.stats.as_dict(), {
+            'stages': {'prefilter': {'calls': 3, 'entities': 0, 'time': 3},
+                       'reply': {'calls': 1, 'entities': 1, 'time': 1},
+                       'scan': {'calls': 3, 'entities': 6, 'time': 3},
+                       'html': {'calls': 0, 'entities': 0, 'time': 0}},
+            'entities': {'urls': 1, 'users': 1, 'lists': 1, 'tags': 3}})
+
+        results[0].html
+        results[0].html
+        self.assertEqual(self.stats.as_dict()['stages']['html'], {'calls': 1, 'entities': 4, 'time': 1})
+
+    def test_same_results(self):
+        plain = ttp.Parser()
+        for text in (u'@a hi #b @c/d http://t.co/x', u'  @reply www.example.com'):
+            for html in (True, False):
+                result, expected = self.parser.parse(text, html), plain.parse(text, html)
+                self.assertEqual((result.entities, result.reply, result.html),
+                                 (expected.entities, expected.reply, expected.html))
+
+    def test_with_cache(self):
+        parser = ttp.Parser(stats=self.stats, cache_size=10)
+        for _ in range(3):
+            self.assertEqual(parser.parse(u'#a').html, u'<a href="http://search.twitter.com/search?q=%23a">#a</a>')
+
+        # The HTML is rendered once, before the result is cached
+        stages = self.stats.as_dict()['stages']
+        self.assertEqual((stages['scan']['calls'], stages['html']['calls']), (1, 1))
+
+    def test_reset_and_pickle(self):
+        self.parser.parse(u'@a')
+        parser = pickle.loads(pickle.dumps(self.parser))
+        parser.parse(u'@a')
+        self.assertEqual(self.stats.as_dict()['stages']['scan']['calls'], 1)
+        self.stats.reset()
+        self.assertEqual(self.stats.as_dict()['entities'], {'urls': 0, 'users': 0, 'lists': 0, 'tags': 0})
+
+    def test_merge(self):
+        self.parser.parse(u'@a #b')
+        other = ttp.ParseStats()
+        other.merge(self.stats.as_dict())
+        other.merge(self.stats.as_dict())
+        self.assertEqual(other.as_dict()['stages']['scan'], {'calls': 2, 'entities': 4, 'time': 2})
+        self.assertEqual(other.as_dict()['entities']['tags'], 2)
+
+
+def parse_in_child(text):
+    """Target of the child processes of TWPBacktrackingTests"""
+    ttp.Parser().parse(text)
+
+
+class TWPBacktrackingTests(unittest.TestCase):
+
+    """Test that adversarial input is parsed in linear time
+
+    A regex stuck in backtracking can't be interrupted, so every input is
+    parsed in a child process which must finish within the time limit. These
+    inputs took hours (or years) with the nested patterns of 1.0.1.
+
+    """
+    limit = 5.0
+
+    def assertFast(self, text):
+        child = multiprocessing.Process(target=parse_in_child, args=(text,))
+        child.start()
+        child.join(self.limit)
+        if child.is_alive():
+            child.terminate()
+            child.join()
+            self.fail('parsing %r... took more than %ss' % (text[:40], self.limit))
+
+        self.assertEqual(child.exitcode, 0)
+        return ttp.Parser(include_spans=True).parse(text)
+
+    def test_url_domain_dashes(self):
+        result = self.assertFast(u'http://' + u'-' * 20000 + u'!')
+        self.assertEqual(result.urls, [])
+
+    def test_url_path_commas(self):
+        result = self.assertFast(u'http://example.com/' + u',' * 20000 + u' ')
+        self.assertEqual(result.urls, [(u'http://example.com/', (0, 19))])
+
+    def test_url_many(self):
+        result = self.assertFast(u'http://a.com/' * 2000)
+        self.assertEqual(result.urls, [])
+
+    def test_www_runs(self):
+        result = self.assertFast(u'www.-' * 4000 + u'a.com')
+        self.assertEqual(result.urls, [])
+        result = self.assertFast(u'www.a.com-' * 2000)
+        self.assertEqual([span for url, span in result.urls], [(0, 19999)])
+
+    def test_at_signs(self):
+        result = self.assertFast(u'@' * 20000 + u'!')
+        self.assertEqual(result.users, [])
+        result = self.assertFast(u'a' + u'@' * 20000)
+        self.assertEqual(result.users, [])
+        result = self.assertFast(u'@' * 20000 + u'user')
+        self.assertEqual(result.users, [(u'user', (19999, 20004))])
+
+    def test_hash_signs(self):
+        result = self.assertFast(u'#' * 20000)
+        self.assertEqual(result.tags, [])
+        result = self.assertFast(u'#a' * 10000)
+        self.assertEqual(result.tags, [(u'a', (0, 2))])
+
+
+class TWPReparseTests(unittest.TestCase):
+
+    """Test Parser.reparse against a full parse of the edited text"""
+    def setUp(self):
+        self.parser = ttp.Parser(include_spans=True)
+
+    def edit(self, text, offset, deleted, inserted, html=True):
+        result = self.parser.parse(text, html)
+        edited = text[:offset] + inserted + text[offset + deleted:]
+        return self.parser.reparse(result, edited, offset, deleted, inserted, html), \
+            self.parser.parse(edited, html)
+
+    def assertSameResult(self, result, expected):
+        self.assertEqual(result.entities, expected.entities)
+        self.assertEqual(result.reply, expected.reply)
+        self.assertEqual(result.html, expected.html)
+
+    def test_typing(self):
+        text = u''
+        result = self.parser.parse(text)
+        for char in u'@user: see www.example.com/path?q=1, #tag @user/list \uff03caf\xe9':
+            offset = len(text)
+            text += char
+            result = self.parser.reparse(result, text, offset, 0, char)
+            self.assertSameResult(result, self.parser.parse(text))
+
+        self.assertEqual(result.users, [(u'user', (0, 5))])
+        self.assertEqual(result.urls, [(u'www.example.com/path?q=1', (11, 35))])
+        self.assertEqual(result.tags, [(u'tag', (37, 41)), (u'caf\xe9', (53, 58))])
+
+    def test_backspacing(self):
+        text = u'hello @user http://example.com #tag'
+        result = self.parser.parse(text)
+        while text:
+            text = text[:-1]
+            result = self.parser.reparse(result, text, len(text), 1, u'')
+            self.assertSameResult(result, self.parser.parse(text))
+
+    def test_moves_entities_after_the_edit(self):
+        result, expected = self.edit(u'@a #b http://example.com #c', 3, 2, u'#longer')
+        self.assertSameResult(result, expected)
+        self.assertEqual(result.tags, [(u'longer', (3, 10)), (u'c', (30, 32))])
+        self.assertEqual(result.urls, [(u'http://example.com', (11, 29))])
+
+    def test_edits_that_join_and_split_words(self):
+        for args in [(u'#a #b', 2, 1, u''),           # #a#b
+                     (u'#ab', 2, 0, u' '),            # #a b
+                     (u'see example.com', 4, 0, u'www.'),
+                     (u'www.example.com', 7, 1, u'-'),
+                     (u'@user http://a.com/path', 5, 1, u''),
+                     (u'@user', 0, 0, u'\u3000'),
+                     (u'text #tag', 0, 4, u'')]:
+            result, expected = self.edit(*args)
+            self.assertSameResult(result, expected)
+            result, expected = self.edit(*args, html=False)
+            self.assertSameResult(result, expected)
+
+    def test_does_not_change_the_previous_result(self):
+        text = u'#a @b http://example.com'
+        previous = self.parser.parse(text)
+        entities = [entity.__copy__() for entity in previous.entities]
+        self.parser.reparse(previous, u'x' + text, 0, 0, u'x')
+        self.assertEqual(list(previous.entities), entities)
+
+    def test_bad_edit(self):
+        result = self.parser.parse(u'#tag')
+        self.assertRaises(ValueError, self.parser.reparse, result, u'#tags', 4, 0, u'x')
+        self.assertRaises(ValueError, self.parser.reparse, result, u'#tag', -1, 0, u'')
+
+
+class TWPValidationTests(unittest.TestCase):
+
+    """Test the weighted length of tweets"""
+    def setUp(self):
+        self.validator = validation.Validator()
+
+    def assertLength(self, text, length, valid=True):
+        result = self.validator.validate(text)
+        self.assertEqual((result.weighted_length, result.valid), (length, valid))
+        return result
+
+    def test_latin(self):
+        self.assertLength(u'a' * 280, 280)
+        result = self.assertLength(u'a' * 281, 281, False)
+        self.assertEqual(result.valid_range, (0, 280))
+        self.assertEqual(result.permillage, 1003)
+        self.assertLength(u'éдא — “quoted”', 14)
+
+    def test_cjk(self):
+        self.assertLength(u'漢' * 140, 280)
+        result = self.assertLength(u'あ' * 141, 282, False)
+        self.assertEqual(result.valid_range, (0, 140))
+        self.assertLength(u'漢字 kanji', 10)
+
+    def test_urls(self):
+        self.assertLength(u'http://example.com/' + u'x' * 300, 23)
+        self.assertLength(u'see www.example.com ok', 30)
+        result = self.assertLength(u'a' * 260 + u' http://t.co/abc', 284, False)
+        self.assertEqual(result.valid_range, (0, 261))
+        self.assertEqual([entity.text for entity in result.entities], [u'http://t.co/abc'])
+
+    def test_emoji(self):
+        self.assertLength(u'\U0001F600', 2)
+        self.assertLength(u'\U0001F468\u200d\U0001F469\u200d\U0001F467\u200d\U0001F466', 2)
+        self.assertLength(u'\U0001F44D\U0001F3FD', 2)
+        self.assertLength(u'\U0001F1EC\U0001F1E7\U0001F1EB\U0001F1F7', 4)
+        self.assertLength(u'1\ufe0f\u20e3 ❤\ufe0f', 5)
+        self.assertLength(u'\U0001F3F4\U000E0067\U000E0062\U000E0073\U000E0063\U000E0074\U000E007F', 2)
+        result = self.assertLength(u'漢' * 139 + u'\U0001F600\U0001F600', 282, False)
+        self.assertEqual(result.valid_range, (0, 140))
+
+    def test_normalization(self):
+        result = self.assertLength(u'cafe\u0301', 4)
+        self.assertEqual(result.text, u'café')
+
+    def test_invalid(self):
+        self.assertLength(u'', 0, False)
+        self.assertLength(u' \n ', 3, False)
+        self.assertLength(u'text\ufeff', 6, False)
+
+    def test_settings(self):
+        validator = validation.Validator(max_length=140, url_length=20, default_weight=100)
+        result = validator.validate(u'漢' * 100 + u' http://example.com')
+        self.assertEqual((result.weighted_length, result.valid), (121, True))
+        result = validator.validate(u'漢' * 141)
+        self.assertEqual((result.weighted_length, result.valid, result.valid_range), (141, False, (0, 140)))
+
+    def test_validate_many(self):
+        texts = [u'#tag', u'a' * 300, u'漢' * 200, u'@user http://example.com']
+        results = self.validator.validate_many(iter(texts))
+        self.assertEqual([(result.weighted_length, result.valid) for result in results],
+                         [(4, True), (300, False), (400, False), (29, True)])
+
+
+class TWPColumnsTests(unittest.TestCase):
+
+    """Test the columnar output of extract_columns"""
+    def setUp(self):
+        self.texts = [u'@User #Tag http://example.com', u'no entities', u'#tag @user/list #TAG']
+
+    def test_columns(self):
+        result = columns.extract_columns(iter(self.texts))
+        self.assertEqual(len(result), 6)
+        self.assertEqual(result.text_count, 3)
+        self.assertEqual(list(result.tweet), [0, 0, 0, 2, 2, 2])
+        self.assertEqual(list(result.kind), [ttp.ENTITY_USER, ttp.ENTITY_TAG, ttp.ENTITY_URL,
+                                             ttp.ENTITY_TAG, ttp.ENTITY_LIST, ttp.ENTITY_TAG])
+        self.assertEqual(list(result.start), [0, 6, 11, 0, 5, 16])
+        self.assertEqual(list(result.end), [5, 10, 29, 4, 15, 20])
+        self.assertEqual(result.strings, [u'User', u'Tag', u'http://example.com', u'tag', u'user/list', u'TAG'])
+        self.assertEqual(list(result.text_id), [0, 1, 2, 3, 4, 5])
+
+    def test_fold_case(self):
+        result = columns.extract_columns(self.texts, fold_case=True)
+        self.assertEqual(result.strings, [u'user', u'tag', u'http://example.com', u'user/list'])
+        self.assertEqual(list(result.text_id), [0, 1, 2, 1, 3, 1])
+
+    def test_append(self):
+        result = columns.extract_columns(self.texts[:2], ttp.Parser())
+        self.assertTrue(columns.extract_columns(self.texts[2:], columns=result) is result)
+        self.assertEqual(list(result.tweet), [0, 0, 0, 2, 2, 2])
+        self.assertEqual(result.text_count, 3)
+        self.assertEqual(result.strings, columns.extract_columns(self.texts).strings)
+        columns.extract_columns([], columns=result)
+        self.assertEqual(result.text_count, 3)
+
+    @unittest.skipIf(columns.numpy is None, 'needs NumPy')
+    def test_numpy(self):
+        arrays = columns.extract_columns(self.texts).numpy()
+        self.assertEqual(sorted(arrays), sorted(columns.FIELDS))
+        self.assertEqual(arrays['end'].tolist(), [5, 10, 29, 4, 15, 20])
+        self.assertEqual(arrays['kind'].dtype.itemsize, 1)
+        self.assertEqual(len(columns.extract_columns([]).numpy()['tweet']), 0)
+
+
+class TWPAggregateTests(unittest.TestCase):
+
+    """Test the windowed hashtag and mention counts"""
+    def setUp(self):
+        self.pairs = [(0, u'#Python @ann'), (10, u'#python #ruby'), (59, u'@Ann @bob'),
+                      (60, u'#ruby'), (130, u'#go @ann'), (500, u'#python')]
+
+    def summary(self, windows):
+        return [(window.start, window.end, window.tweets, window.top[ttp.ENTITY_TAG],
+                 window.top[ttp.ENTITY_USER]) for window in windows]
+
+    def test_tumbling(self):
+        aggregator = aggregate.FrequencyAggregator(window=60, top=None)
+        self.assertEqual(self.summary(aggregator.aggregate(self.pairs)), [
+            (0, 60, 3, [(u'python', 2), (u'ruby', 1)], [(u'ann', 2), (u'bob', 1)]),
+            (60, 120, 1, [(u'ruby', 1)], []),
+            (120, 180, 1, [(u'go', 1)], [(u'ann', 1)]),
+            (480, 540, 1, [(u'python', 1)], [])])
+
+    def test_sliding(self):
+        aggregator = aggregate.FrequencyAggregator(window=120, step=60, top=1)
+        self.assertEqual(self.summary(aggregator.aggregate(self.pairs)), [
+            (-60, 60, 3, [(u'python', 2)], [(u'ann', 2)]),
+            (0, 120, 4, [(u'python', 2)], [(u'ann', 2)]),
+            (60, 180, 2, [(u'go', 1)], [(u'ann', 1)]),
+            (120, 240, 1, [(u'go', 1)], [(u'ann', 1)]),
+            (420, 540, 1, [(u'python', 1)], []),
+            (480, 600, 1, [(u'python', 1)], [])])
+
+    def test_add_and_open_window(self):
+        aggregator = aggregate.FrequencyAggregator(window=60, kinds=(ttp.ENTITY_TAG,))
+        self.assertEqual(aggregator.add(u'#a #b', 1), [])
+        self.assertEqual(aggregator.add(u'#A', 2), [])
+        self.assertEqual(aggregator.top(), [(u'a', 2), (u'b', 1)])
+        self.assertEqual(aggregator.top(n=1), [(u'a', 2)])
+        closed = aggregator.add(u'#c @user', 61)
+        self.assertEqual([(window.start, window.top) for window in closed], [(0, {ttp.ENTITY_TAG: [(u'a', 2), (u'b', 1)]})])
+        self.assertEqual(aggregator.top(), [(u'c', 1)])
+        self.assertEqual([window.tweets for window in aggregator.flush()], [1])
+        self.assertEqual(aggregator.flush(), [])
+
+    def test_clock(self):
+        clock = FakeClock()
+        aggregator = aggregate.FrequencyAggregator(window=10, clock=clock)
+        windows = []
+        for text in (u'#a', u'#b', u'#a'):
+            windows.extend(aggregator.add(text))
+            clock.now += 6
+
+        self.assertEqual(self.summary(windows + aggregator.flush()),
+                         [(1000, 1010, 2, [(u'a', 1), (u'b', 1)], []), (1010, 1020, 1, [(u'a', 1)], [])])
+
+    def test_approximate(self):
+        exact = aggregate.FrequencyAggregator(window=120, step=60, top=2)
+        approximate = aggregate.FrequencyAggregator(window=120, step=60, top=2, approximate=True)
+        self.assertEqual(self.summary(approximate.aggregate(self.pairs)),
+                         self.summary(exact.aggregate(self.pairs)))
+
+    def test_heavy_hitters(self):
+        hitters = aggregate.HeavyHitters(k=3, width=64, depth=4)
+        for i in range(3000):
+            hitters.add(u'hot%d' % (i % 3) if i % 2 else u'cold%d' % i)
+
+        self.assertEqual(sorted(key for key, count in hitters.top()), [u'hot0', u'hot1', u'hot2'])
+        for key, count in hitters.top():
+            self.assertTrue(count >= 500)
+
+    def test_sketch(self):
+        sketch = aggregate.CountMinSketch(width=16, depth=3)
+        other = aggregate.CountMinSketch(width=16, depth=3)
+        for i in range(100):
+            sketch.add(i)
+            other.add(i % 10)
+
+        self.assertTrue(all(sketch.estimate(i) >= 1 for i in range(100)))
+        sketch.update(other)
+        self.assertTrue(sketch.estimate(3) >= 11)
+        sketch.update(other, subtract=True)
+        self.assertEqual(sketch.total, 100)
+        self.assertRaises(ValueError, sketch.update, aggregate.CountMinSketch(width=8))
+
+    def test_bad_arguments(self):
+        self.assertRaises(ValueError, aggregate.FrequencyAggregator, window=100, step=30)
+        self.assertRaises(ValueError, aggregate.FrequencyAggregator, approximate=True, top=None)
+
+
+class TWPLazyRegexTests(unittest.TestCase):
+
+    """Test the regexes compiled on first use"""
+    def test_lazy(self):
+        regex = ttp.LazyRegex(r'a(b+)', re.IGNORECASE)
+        self.assertFalse('match' in vars(regex))
+        self.assertEqual(regex.match(u'xABb', 1).group(1), u'Bb')
+        self.assertTrue('match' in vars(regex))
+        self.assertEqual(regex.sub(u'-', u'ab ab'), u'- -')
+        self.assertEqual(regex.pattern, r'a(b+)')
+
+    def test_ascii(self):
+        # The same matches on Python 2 and 3
+        self.assertEqual(ttp.LazyRegex(r'\s').search(u'\u3000\xa0'), None)
+        self.assertEqual(ttp.LazyRegex(r's', re.IGNORECASE).search(u'\u017f'), None)
+        self.assertEqual(ttp.Parser().parse(u'http://a\u3000b.com').urls,
+                         [u'http://a\u3000b.com'])
+
+    def test_import(self):
+        root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        code = ('import sys\n'
+                'from ttp import ttp\n'
+                'print(sorted(name for name, value in vars(ttp).items()\n'
+                '             if isinstance(value, ttp.LazyRegex)\n'
+                '             and "match" in vars(value)))\n'
+                'print("multiprocessing" in sys.modules)\n')
+        output = subprocess.check_output([sys.executable, '-c', code], cwd=root)
+        self.assertEqual(output.split(), [b'[]', b'False'])
+
+
+class TWPMappedTextTests(unittest.TestCase):
+
+    """Test the memory mapped plain text mode"""
+    def setUp(self):
+        self.parser = ttp.Parser()
+        fd, self.path = tempfile.mkstemp()
+        os.close(fd)
+
+    def tearDown(self):
+        os.remove(self.path)
+
+    def write(self, text):
+        with open(self.path, 'wb') as f:
+            f.write(text.encode('utf-8'))
+
+        return text.encode('utf-8')
+
+    def assertSpans(self, data, window_size=stream.WINDOW_SIZE):
+        expected = []
+        offset = 0
+        for line in data.split(b'\n'):
+            length = len(line) - line.endswith(b'\r')
+            text = line[:length].decode('utf-8')
+            entities = self.parser.extract(text)
+            if entities:
+                expected.append((offset, length, [
+                    (entity.kind,
+                     offset + len(text[:entity.start].encode('utf-8')),
+                     len(text[entity.start:entity.end].encode('utf-8')))
+                    for entity in entities]))
+
+            offset += len(line) + 1
+
+        with stream.MappedText(self.path, window_size) as mapped:
+            self.assertEqual(list(mapped.spans(self.parser)), expected)
+
+        return expected
+
+    def test_spans(self):
+        data = self.write(u'plain\n@ann: #tag http://ab.com\r\n\ncaf\xe9 #caf\xe9 '
+                          u'\uff20bob\nno entity www.\n\uff03x www.b.org')
+        with stream.MappedText(self.path) as mapped:
+            spans = list(mapped.spans())
+            self.assertEqual(len(mapped), len(data))
+            self.assertEqual([mapped.text(offset, length)
+                              for _, offset, length in spans[1][2]],
+                             [u'#caf\xe9', u'\uff20bob'])
+
+        self.assertEqual(spans, self.assertSpans(data))
+        self.assertEqual(spans[0], (6, 24, [(ttp.ENTITY_USER, 6, 4),
+                                            (ttp.ENTITY_TAG, 12, 4),
+                                            (ttp.ENTITY_URL, 17, 13)]))
+
+    def test_windows(self):
+        lines = [u'@a%d #b\xe9 http://c.com/%d' % (i, i) for i in range(2000)]
+        data = self.write(u'\n'.join(lines) + u'\n')
+        self.assertEqual(len(self.assertSpans(data, mmap.ALLOCATIONGRANULARITY)),
+                         2000)
+
+        data = self.write((u'x' * 3 * mmap.ALLOCATIONGRANULARITY + u' @a\n') * 3)
+        self.assertEqual(len(self.assertSpans(data, mmap.ALLOCATIONGRANULARITY)),
+                         3)
+
+    def test_empty(self):
+        self.assertSpans(self.write(u''))
+        self.assertSpans(self.write(u'\n\n'))
+        self.assertRaises(ValueError, stream.MappedText, self.path, 1000)
+
+
+class TWPIndexTests(unittest.TestCase):
+
+    """Test the on disk entity index"""
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'index')
+        self.tweets = [(10, u'@Ann likes #Python http://www.Example.com/a'),
+                       (11, u'@bob: #python @ann/friends'),
+                       (12, u'see https://example.com:8080?q=1 and http://other.org'),
+                       (13, u'nothing here'),
+                       (14, u'@ann @ann #go')]
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def assertLookups(self, index):
+        self.assertEqual(index.users(u'ann'), [10, 14])
+        self.assertEqual(index.users(u'ANN'), [10, 14])
+        self.assertEqual(index.tags(u'python'), [10, 11])
+        self.assertEqual(index.lists(u'ann/friends'), [11])
+        self.assertEqual(index.domains(u'example.com'), [10, 12])
+        self.assertEqual(index.domains(u'http://www.example.com/b'), [10, 12])
+        self.assertEqual(index.lookup(ttp.ENTITY_URL, u'other.org'), [12])
+        self.assertEqual(index.users(u'nobody'), [])
+
+    def test_buffered_and_flushed(self):
+        index = ttp_index.EntityIndex(self.path)
+        index.add_many(self.tweets)
+        self.assertLookups(index)
+        index.flush()
+        self.assertEqual(os.listdir(self.path), ['00000001.seg'])
+        self.assertLookups(index)
+        index.close()
+        with ttp_index.EntityIndex(self.path) as index:
+            self.assertLookups(index)
+
+    def test_appends_and_merge(self):
+        with ttp_index.EntityIndex(self.path, buffer_size=2) as index:
+            index.add_many(self.tweets[3:])
+            index.add_many(self.tweets[:3])
+            index.add(14, u'#go again')
+
+        with ttp_index.EntityIndex(self.path) as index:
+            self.assertTrue(len(os.listdir(self.path)) > 2)
+            self.assertLookups(index)
+            self.assertEqual(index.tags(u'go'), [14])
+            index.add(9, u'@ann')
+            self.assertEqual(index.users(u'ann'), [9, 10, 14])
+            index.merge()
+            self.assertEqual(len(os.listdir(self.path)), 1)
+            self.assertEqual(index.users(u'ann'), [9, 10, 14])
+            self.assertEqual(index.tags(u'python'), [10, 11])
+
+    def test_segment_format(self):
+        path = os.path.join(self.directory, 'test.seg')
+        ttp_index.write_segment(path, [(b'a', [1, 2 ** 63]), (b'b', []), (b'c', [3])])
+        segment = ttp_index.Segment(path)
+        self.assertEqual(segment.key_count, 3)
+        self.assertEqual(segment.find(b'a'), [1, 2 ** 63])
+        self.assertEqual(segment.find(b'b'), [])
+        self.assertEqual(segment.find(b'bb'), [])
+        self.assertEqual(list(segment), [(b'a', [1, 2 ** 63]), (b'b', []), (b'c', [3])])
+        segment.close()
+
+        with open(path, 'wb') as f:
+            f.write(b'x' * 64)
+
+        self.assertRaises(ValueError, ttp_index.Segment, path)
+
+
+class TWPEngineTests(unittest.TestCase):
+
+    """Test that every regex engine finds the same entities as re"""
+    pieces = [u'@', u'\uff20', u'#', u'\uff03', u'http://', u'HTTPS://', u'www.', u'WwW.',
+              u'.com', u'.CO', u':80', u'/', u'?', u'list/', u'a', u'Z', u'_', u'9', u'-', u'.',
+              u',', u'&', u'!', u'(', u')', u'=', u' ', u'\n', u'\x0b', u'\xa0', u'\u3000',
+              u'\xe9', u'\xff', u'\u0178', u'\xb5', u'\u212b', u'\u017f', u'\u212a', u'\U0001f600']
+
+    def texts(self):
+        # Case folding and whitespace are where the engines differ the most
+        rnd = random.Random(25)
+        texts = [u'@user: see www.example.com/path?q=1, #tag @user/list \uff03caf\xe9',
+                 u'\u3000@\u017fam http://ex\u212aample.com #\u017f @a/\u212a',
+                 u'http://a\x0bb.com http://a\u3000b.com #\xff\u0178 @x/a\xb5']
+        for _ in range(2000):
+            texts.append(u''.join(rnd.choice(self.pieces) for _ in range(rnd.randint(1, 20))))
+
+        return texts
+
+    def assertConforms(self, name):
+        if not engines.available(name):
+            return
+
+        expected = ttp.Parser(include_spans=True)
+        parser = ttp.Parser(include_spans=True, engine=name)
+        for text in self.texts():
+            result = parser.parse(text)
+            wanted = expected.parse(text)
+            self.assertEqual((result.entities, result.reply, result.html),
+                             (wanted.entities, wanted.reply, wanted.html), text)
+
+            result = parser.reparse(wanted, text + u'#a', len(text), 0, u'#a')
+            self.assertEqual(result.entities, expected.parse(text + u'#a').entities)
+
+    def test_re(self):
+        self.assertConforms('re')
+        self.assertTrue(ttp.Parser()._engine.mention is ttp.MENTION_ENTITY_REGEX)
+
+    @unittest.skipUnless(engines.available('regex'), 'needs regex')
+    def test_regex(self):
+        self.assertConforms('regex')
+
+    @unittest.skipUnless(engines.available('re2'), 'needs google-re2')
+    def test_re2(self):
+        self.assertConforms('re2')
+        # Offsets of text before the cursor
+        regex = engines.get_engine('re2').mention
+        text = u'\xe9\U0001f600 @ab @cd'
+        self.assertEqual(regex.match(text, 7).span(2), (8, 10))
+        self.assertEqual(regex.match(text, 3).groups(), (u'@', u'ab', None))
+        self.assertEqual(regex.match(text, 4), None)
+
+    def test_re2_pattern(self):
+        self.assertEqual(engines.re2_pattern(r'[^a-c\s_]x\u3000\s\.', True),
+                         r'[^A-Ca-c \t\n\r\f\v_][xX]\x{3000}[ \t\n\r\f\v]\.')
+        self.assertEqual(engines.re2_pattern(r'[a\x80-\xFF-]{2}'), r'[a\x80-\xFF-]{2}')
+        self.assertEqual(engines.re2_pattern(r'[a\x80-\xFF-]', True), r'[Aa\x80-\xFF-]')
+
+    def test_get_engine(self):
+        self.assertTrue(engines.get_engine('re') is engines.get_engine('re'))
+        self.assertTrue(engines.get_engine().name in engines.ENGINES)
+        self.assertRaises(ValueError, ttp.Parser, engine='pcre')
+        parser = pickle.loads(pickle.dumps(ttp.Parser(engine='auto')))
+        self.assertTrue(parser._engine is engines.get_engine('auto'))
+
+
+class RedirectServer(ThreadingMixIn, HTTPServer):
+
+    """A local stand-in for shortlink services, used by TWPShortlinkTests"""
+    daemon_threads = True
+
+    def __init__(self):
+        HTTPServer.__init__(self, ('127.0.0.1', 0), RedirectHandler)
+        self.port = self.server_address[1]
+        self.lock = threading.Lock()
+        self.requests = []
+        self.active = self.max_active = 0
+        self.redirects = {'/a': (301, '/b'),
+                          '/b': (302, 'http://localhost:%d/c' % self.port),
+                          '/relative/a': (307, 'b'),
+                          '/nohead': (302, '/c'),
+                          '/loop': (302, '/loop'),
+                          '/malformed': (302, 'http://[::1/')}
+
+    def handle_error(self, request, client_address):
+        # clients hanging up early (timeouts, unread GET bodies) are expected
+        pass
+
+
+class RedirectHandler(BaseHTTPRequestHandler):
+
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, *args):
+        pass
+
+    def do_HEAD(self):
+        self.respond()
+
+    def do_GET(self):
+        self.respond()
+
+    def respond(self):
+        server = self.server
+        with server.lock:
+            server.requests.append((self.command, self.path))
+            server.active += 1
+            server.max_active = max(server.active, server.max_active)
+
+        try:
+            if self.path.startswith('/slow') or self.path.startswith('/busy'):
+                time.sleep(0.3)
+
+            if self.path == '/nohead' and self.command == 'HEAD':
+                self.send(405)
+
+            elif self.path in server.redirects:
+                self.send(*server.redirects[self.path])
+
+            else:
+                self.send(200)
+
+        finally:
+            with server.lock:
+                server.active -= 1
+
+    def send(self, status, location=None):
+        self.send_response(status)
+        if location is not None:
+            self.send_header('Location', location)
+
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+
+class RedirectServerTestCase(unittest.TestCase):
+
+    """Run a RedirectServer for each test"""
+    def setUp(self):
+        self.server = RedirectServer()
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+        self.base = 'http://127.0.0.1:%d' % self.server.port
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+class TWPShortlinkTests(RedirectServerTestCase):
+
+    """Test the shortlink resolver against a local redirect server"""
+    def test_redirect_chain(self):
+        links = utils.follow_shortlinks([self.base + '/a', self.base + '/relative/a', self.base + '/c'])
+        self.assertEqual(links, {self.base + '/a': [self.base + '/a', self.base + '/b', 'http://localhost:%d/c' % self.server.port],
+                                 self.base + '/relative/a': [self.base + '/relative/a', self.base + '/relative/b'],
+                                 self.base + '/c': [self.base + '/c']})
+        self.assertTrue(all(method == 'HEAD' for method, path in self.server.requests))
+
+    def test_get_fallback(self):
+        links = utils.follow_shortlinks([self.base + '/nohead'])
+        self.assertEqual(links, {self.base + '/nohead': [self.base + '/nohead', self.base + '/c']})
+        self.assertEqual(self.server.requests, [('HEAD', '/nohead'), ('GET', '/nohead'), ('HEAD', '/c')])
+
+    def test_failures(self):
+        closed = socket.socket()
+        closed.bind(('127.0.0.1', 0))
+        dead = 'http://127.0.0.1:%d/a' % closed.getsockname()[1]
+        closed.close()
+
+        links = utils.follow_shortlinks([self.base + '/slow', self.base + '/loop', dead], timeout=0.1, max_redirects=3)
+        self.assertEqual(links, {self.base + '/slow': [], self.base + '/loop': [], dead: []})
+
+    def test_malformed(self):
+        long_label = 'http://' + 'a' * 70 + '.com/x'
+        links = utils.follow_shortlinks([long_label, 'http://[::1/', self.base + '/malformed', self.base + '/c'])
+        self.assertEqual(links, {long_label: [], 'http://[::1/': [], self.base + '/malformed': [],
+                                 self.base + '/c': [self.base + '/c']})
+
+    def test_per_host_limit(self):
+        resolver = utils.ShortlinkResolver(max_workers=6, max_per_host=2)
+        links = resolver.resolve([self.base + '/busy/%d' % i for i in range(6)])
+        resolver.close()
+        self.assertEqual(sorted(links.values()), [[self.base + '/busy/%d' % i] for i in range(6)])
+        self.assertEqual(self.server.max_active, 2)
+
+
+class FakeTransport(object):
+
+    """Answer requests after a delay without any network, see aio"""
+    def __init__(self, responses, delays={}):
+        self.responses = responses
+        self.delays = delays
+        self.active = self.max_active = 0
+
+    def __call__(self, method, url):
+        loop = asyncio.get_event_loop()
+        response = loop.create_future()
+        self.active += 1
+        self.max_active = max(self.active, self.max_active)
+
+        def respond():
+            self.active -= 1
+            if not response.cancelled():
+                response.set_result(self.responses.get(url, (200, None)))
+
+        loop.call_later(self.delays.get(url, 0.01), respond)
+        return response
+
+
+class AsyncLinks(object):
+
+    """An async iterator over a list"""
+    def __init__(self, links):
+        self.links = iter(links)
+
+    def __aiter__(self):
+        return self
+
+    def __anext__(self):
+        for link in self.links:
+            return asyncio.sleep(0.001, result=link)
+
+        raise StopAsyncIteration
+
+
+@unittest.skipIf(aio is None, 'asyncio needs Python 3')
+class TWPAsyncShortlinkTests(RedirectServerTestCase):
+
+    """Test the asyncio shortlink follower"""
+    def collect(self, shortlinks, **kwargs):
+        loop = asyncio.new_event_loop()
+        links = aio.follow_shortlinks(shortlinks, **kwargs)
+        results = []
+        try:
+            while True:
+                results.append(loop.run_until_complete(links.__anext__()))
+
+        except StopAsyncIteration:
+            return results
+
+        finally:
+            loop.close()
+
+    def test_redirect_chain(self):
+        base = self.base
+        results = self.collect([base + '/a', base + '/relative/a', base + '/nohead', base + '/loop', base + '/a'], max_redirects=3)
+        self.assertEqual(len(results), 4)
+        self.assertEqual(dict(results), {base + '/a': [base + '/a', base + '/b', 'http://localhost:%d/c' % self.server.port],
+                                         base + '/relative/a': [base + '/relative/a', base + '/relative/b'],
+                                         base + '/nohead': [base + '/nohead', base + '/c'],
+                                         base + '/loop': []})
+        self.assertEqual(dict(results), utils.follow_shortlinks(dict(results), max_redirects=3))
+
+    def test_failures(self):
+        closed = socket.socket()
+        closed.bind(('127.0.0.1', 0))
+        dead = 'http://127.0.0.1:%d/a' % closed.getsockname()[1]
+        closed.close()
+        results = self.collect([self.base + '/slow', dead, 'ftp://example.com/'], timeout=0.1)
+        self.assertEqual(dict(results), {self.base + '/slow': [], dead: [], 'ftp://example.com/': []})
+
+    def test_malformed(self):
+        long_label = 'http://' + 'a' * 70 + '.com/x'
+        links = [long_label, 'http://a.com:99999/', self.base + '/malformed', self.base + '/c']
+        results = self.collect(links, timeout=1)
+        self.assertEqual(dict(results), {long_label: [], 'http://a.com:99999/': [], self.base + '/malformed': [],
+                                         self.base + '/c': [self.base + '/c']})
+
+    def test_seen_size(self):
+        transport = FakeTransport({})
+        links = ['http://t.co/%s' % name for name in 'abacda']
+        results = self.collect(AsyncLinks(links), seen_size=2, transport=transport)
+        # The second a is a duplicate, the last one was forgotten
+        self.assertEqual(sorted(link for link, chain in results), sorted(links[:2] + links[3:]))
+
+    def test_yields_as_finished(self):
+        transport = FakeTransport({'http://t.co/a': (301, 'http://example.com/a')}, {'http://t.co/a': 0.1})
+        results = self.collect(['http://t.co/a', 'http://t.co/b'], transport=transport)
+        self.assertEqual(results, [('http://t.co/b', ['http://t.co/b']),
+                                   ('http://t.co/a', ['http://t.co/a', 'http://example.com/a'])])
+
+    def test_limit(self):
+        transport = FakeTransport({})
+        links = ['http://t.co/%d' % i for i in range(20)]
+        results = self.collect(AsyncLinks(links), limit=3, transport=transport)
+        self.assertEqual(sorted(results), sorted((link, [link]) for link in links))
+        self.assertEqual(transport.max_active, 3)
+
+
+class FakeClock(object):
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+class TWPCacheTests(unittest.TestCase):
+
+    """Test the LRU cache and the shortlink cache"""
+    def setUp(self):
+        self.clock = FakeClock()
+        self.tmp = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def test_lru_eviction(self):
+        lru = cache.LRUCache(2)
+        lru.set('a', 1)
+        lru.set('b', 2)
+        self.assertEqual(lru.get('a'), 1)
+        lru.set('c', 3)
+        self.assertEqual((lru.get('a'), lru.get('b'), lru.get('c')), (1, None, 3))
+        self.assertEqual(lru.stats(), {'hits': 3, 'misses': 1, 'size': 2, 'max_size': 2})
+
+    def test_lru_ttl(self):
+        lru = cache.LRUCache(10, ttl=60, clock=self.clock)
+        lru.set('a', 1)
+        lru.set('b', 2, ttl=10)
+        self.clock.now += 30
+        self.assertEqual((lru.get('a'), lru.get('b')), (1, None))
+        self.clock.now += 30
+        self.assertEqual(lru.get('a', 'gone'), 'gone')
+        self.assertEqual(len(lru), 0)
+
+    def test_negative_ttl(self):
+        links = utils.ShortlinkCache(ttl=100, negative_ttl=10, clock=self.clock)
+        links.update({'http://t.co/a': ['http://t.co/a', 'http://example.com/'], 'http://t.co/b': []})
+        self.assertEqual(links.get('http://t.co/b'), [])
+        self.clock.now += 50
+        self.assertEqual(links.get('http://t.co/a'), ['http://t.co/a', 'http://example.com/'])
+        self.assertEqual(links.get('http://t.co/b'), None)
+        self.clock.now += 50
+        self.assertEqual(links.get('http://t.co/a'), None)
+        self.assertEqual(links.stats(), {'hits': 2, 'misses': 2, 'size': 0})
+
+    def test_counters_from_threads(self):
+        links = utils.ShortlinkCache(clock=self.clock)
+        links.update({'http://t.co/a': ['http://t.co/a']})
+
+        def worker():
+            for i in range(2000):
+                links.get('http://t.co/a' if i % 2 else 'http://t.co/b')
+
+        threads = [threading.Thread(target=worker) for n in range(8)]
+        for thread in threads:
+            thread.start()
+
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(links.stats(), {'hits': 8000, 'misses': 8000, 'size': 1})
+
+    def check_store(self, store_class, path):
+        chains = {u'http://t.co/a': [u'http://t.co/a', u'http://example.com/\u2603'], u'http://t.co/b': []}
+        store = store_class(path)
+        utils.ShortlinkCache(store=store, clock=self.clock).update(chains)
+        store.close()
+
+        store = store_class(path)
+        links = utils.ShortlinkCache(store=store, negative_ttl=10, clock=self.clock)
+        self.assertEqual(links.get(u'http://t.co/a'), chains[u'http://t.co/a'])
+        self.assertEqual(links.get(u'http://t.co/b'), [])
+        self.assertEqual(links.get(u'http://t.co/c'), None)
+        self.clock.now += 3600
+        self.assertEqual(links.get(u'http://t.co/b'), None)
+        self.assertEqual(links.stats(), {'hits': 2, 'misses': 2, 'size': 1})
+        store.close()
+
+    def test_sqlite_store(self):
+        self.check_store(utils.SqliteStore, os.path.join(self.tmp, 'links.sqlite'))
+
+    def test_dbm_store(self):
+        self.check_store(utils.DbmStore, os.path.join(self.tmp, 'links.dbm'))
+
+    def test_resolver_uses_cache(self):
+        server = RedirectServer()
+        thread = threading.Thread(target=server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        base = 'http://127.0.0.1:%d' % server.port
+        links = utils.ShortlinkCache()
+        try:
+            first = utils.follow_shortlinks([base + '/relative/a', base + '/loop'], cache=links, max_redirects=2)
+            requests = len(server.requests)
+            second = utils.follow_shortlinks([base + '/relative/a', base + '/loop'], cache=links)
+
+        finally:
+            server.shutdown()
+            server.server_close()
+
+        self.assertEqual(first, second)
+        self.assertEqual(second[base + '/loop'], [])
+        self.assertEqual(len(server.requests), requests)
+        self.assertEqual(links.stats(), {'hits': 2, 'misses': 2, 'size': 2})
+
+
 # Test it!
 if __name__ == '__main__':
     unittest.main()
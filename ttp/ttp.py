@@ -20,38 +20,90 @@
 
 # Tweet Parser and Formatter ---------------------------------------------------
 # ------------------------------------------------------------------------------
+from __future__ import unicode_literals
+
+import itertools
 import re
-import urllib
+import threading
+import timeit
+
+from .cache import LRUCache, MemoCache
 
 __version__ = "1.0.1.0"
 
+# Python 2 matches \s, \w, \b and IGNORECASE the ASCII way unless told
+# otherwise, Python 3 the Unicode way. All regexes are ASCII on both, so that
+# they find the same entities.
+ASCII = getattr(re, 'ASCII', 0)
+
+
+class LazyRegex(object):
+
+    '''A regex that is only compiled when it is first used.
+
+    Compiling all the regexes of this module takes far longer than importing
+    it, short lived processes that never parse anything shouldn't pay for
+    that (for the same reason multiprocessing, pickle and urllib are only
+    imported by the code that needs them). A LazyRegex stands in for the
+    compiled regex: looking up any of its attributes compiles the pattern
+    (with the ASCII flag added) and copies the attributes of the compiled
+    regex over, later lookups find them directly.
+
+    '''
+
+    def __init__(self, pattern, flags=0):
+        self._pattern = pattern
+        self._flags = flags | ASCII
+
+    def __getattr__(self, name):
+        # Only called for attributes that aren't set yet
+        if name.startswith('__'):
+            raise AttributeError(name)
+
+        regex = re.compile(self._pattern, self._flags)
+        for attribute in dir(regex):
+            if not attribute.startswith('_'):
+                setattr(self, attribute, getattr(regex, attribute))
+
+        return getattr(regex, name)
+
+    def __repr__(self):
+        return '%s(%r)' % (self.__class__.__name__, self._pattern)
+
+
 # Some of this code has been translated from the twitter-text-java library:
 # <http://github.com/mzsanford/twitter-text-java>
-AT_SIGNS = ur'[@\uff20]'
-UTF_CHARS = ur'a-z0-9_\u00c0-\u00d6\u00d8-\u00f6\u00f8-\u00ff'
-SPACES = ur'[\u0020\u00A0\u1680\u180E\u2002-\u202F\u205F\u2060\u3000]'
+AT_SIGNS = r'[@\uff20]'
+UTF_CHARS = r'a-z0-9_\u00c0-\u00d6\u00d8-\u00f6\u00f8-\u00ff'
+SPACES = r'[\u0020\u00A0\u1680\u180E\u2002-\u202F\u205F\u2060\u3000]'
+
+# No pattern may let a character match in two ways, like [0-9A-Z_]*[A-Z_]+ or
+# ([\.-]|[^\s_\!\.\/])+ used to. A failing match then backtracks over each
+# character once instead of trying every combination, which took exponential
+# time on long runs of - or , in URLs.
 
 # Lists
-LIST_PRE_CHARS = ur'([^a-z0-9_]|^)'
-LIST_END_CHARS = ur'([a-z0-9_]{1,20})(/[a-z][a-z0-9\x80-\xFF-]{0,79})?'
-LIST_REGEX = re.compile(LIST_PRE_CHARS + '(' + AT_SIGNS + '+)' + LIST_END_CHARS,
-                        re.IGNORECASE)
+LIST_PRE_CHARS = r'([^a-z0-9_]|^)'
+LIST_END_CHARS = r'([a-z0-9_]{1,20})(/[a-z][a-z0-9\x80-\xFF-]{0,79})?'
+LIST_REGEX = LazyRegex(LIST_PRE_CHARS + '(' + AT_SIGNS + '+)' + LIST_END_CHARS,
+                       re.IGNORECASE)
 
 # Users
-USERNAME_REGEX = re.compile(ur'\B' + AT_SIGNS + LIST_END_CHARS, re.IGNORECASE)
-REPLY_REGEX = re.compile(ur'^(?:' + SPACES + ur')*' + AT_SIGNS
-                         + ur'([a-z0-9_]{1,20}).*', re.IGNORECASE)
+USERNAME_REGEX = LazyRegex(r'\B' + AT_SIGNS + LIST_END_CHARS, re.IGNORECASE)
+REPLY_REGEX = LazyRegex(r'^(?:' + SPACES + r')*' + AT_SIGNS
+                        + r'([a-z0-9_]{1,20}).*', re.IGNORECASE)
 
 # Hashtags
-HASHTAG_EXP = ur'(^|[^0-9A-Z&/]+)(#|\uff03)([0-9A-Z_]*[A-Z_]+[%s]*)' % UTF_CHARS
-HASHTAG_REGEX = re.compile(HASHTAG_EXP, re.IGNORECASE)
+HASHTAG_CHARS = r'[0-9]*[A-Z_][%s]*' % UTF_CHARS
+HASHTAG_EXP = r'(^|[^0-9A-Z&/])(#|\uff03)(%s)' % HASHTAG_CHARS
+HASHTAG_REGEX = LazyRegex(HASHTAG_EXP, re.IGNORECASE)
 
 
 # URLs
-PRE_CHARS = ur'(?:[^/"\':!=]|^|\:)'
-DOMAIN_CHARS = ur'([\.-]|[^\s_\!\.\/])+\.[a-z]{2,}(?::[0-9]+)?'
-PATH_CHARS = ur'(?:[\.,]?[%s!\*\'\(\);:=\+\$/%s#\[\]\-_,~@])' % (UTF_CHARS, '%')
-QUERY_CHARS = ur'[a-z0-9!\*\'\(\);:&=\+\$/%#\[\]\-_\.,~]'
+PRE_CHARS = r'(?:[^/"\':!=]|^|\:)'
+DOMAIN_CHARS = r'[^\s_\!\/]+\.[a-z]{2,}(?::[0-9]+)?'
+PATH_CHARS = r'(?:\.?[%s!\*\'\(\);:=\+\$/%s#\[\]\-_,~@])' % (UTF_CHARS, '%')
+QUERY_CHARS = r'[a-z0-9!\*\'\(\);:&=\+\$/%#\[\]\-_\.,~]'
 
 # Valid end-of-path chracters (so /foo. does not gobble the period).
 # 1. Allow ) for Wikipedia URLs.
@@ -59,13 +111,185 @@ QUERY_CHARS = ur'[a-z0-9!\*\'\(\);:&=\+\$/%#\[\]\-_\.,~]'
 PATH_ENDING_CHARS = r'[%s\)=#/]' % UTF_CHARS
 QUERY_ENDING_CHARS = '[a-z0-9_&=#]'
 
-URL_REGEX = re.compile('((%s)((https?://|www\\.)(%s)(\/(%s*%s)?)?(\?%s*%s)?))'
-                       % (PRE_CHARS, DOMAIN_CHARS, PATH_CHARS,
-                          PATH_ENDING_CHARS, QUERY_CHARS, QUERY_ENDING_CHARS),
-                       re.IGNORECASE)
+URL_REGEX = LazyRegex(r'((%s)((https?://|www\.)(%s)(\/(%s*%s)?)?(\?%s*%s)?))'
+                      % (PRE_CHARS, DOMAIN_CHARS, PATH_CHARS,
+                         PATH_ENDING_CHARS, QUERY_CHARS, QUERY_ENDING_CHARS),
+                      re.IGNORECASE)
 
 # Registered IANA one letter domains
-IANA_ONE_LETTER_DOMAINS = ('x.com', 'x.org', 'z.com', 'q.net', 'q.com', 'i.net')
+IANA_ONE_LETTER_DOMAINS = tuple(str(domain) for domain in (
+    'x.com', 'x.org', 'z.com', 'q.net', 'q.com', 'i.net'))
+ONE_LETTER_TLDS = tuple(str(tld) for tld in ('.com', '.org', '.net'))
+
+# Single pass scanner
+# Every entity starts with one of these trigger sequences, so a single walk
+# over the text finds all of them. The *_ENTITY_REGEX and URL_*_REGEX patterns
+# are the bodies of the regexes above and get matched in place at each trigger,
+# the character in front of the entity (which the full regexes consume) is
+# checked by the scanner against the *_PRE_EXCLUDE sets instead.
+ENTITY_TRIGGERS = LazyRegex(r'[@\uff20#\uff03]|https?://|www\.', re.IGNORECASE)
+
+# Prefilter
+# Most tweets have no entities at all. A few substring checks, which are far
+# cheaper than any regex, tell which kinds of trigger a tweet contains, so the
+# scanner only looks for those and skips tweets without any triggers at all.
+TRIGGER_MENTION, TRIGGER_HASHTAG, TRIGGER_URL = 1, 2, 4
+TRIGGER_ALL = TRIGGER_MENTION | TRIGGER_HASHTAG | TRIGGER_URL
+_TRIGGER_PATTERNS = ((TRIGGER_MENTION, r'[@\uff20]'),
+                     (TRIGGER_HASHTAG, r'[#\uff03]'),
+                     (TRIGGER_URL, r'https?://|www\.'))
+
+TRIGGER_REGEXES = {TRIGGER_ALL: ENTITY_TRIGGERS}
+for _kinds in range(1, TRIGGER_ALL):
+    TRIGGER_REGEXES[_kinds] = LazyRegex(u'|'.join(
+        pattern for kind, pattern in _TRIGGER_PATTERNS if _kinds & kind),
+        re.IGNORECASE)
+
+WWW_REGEX = LazyRegex(r'www\.', re.IGNORECASE)
+
+# URLs are matched in two steps, the path only once the domain is valid
+URL_DOMAIN_REGEX = LazyRegex(DOMAIN_CHARS, re.IGNORECASE)
+URL_PATH_REGEX = LazyRegex(r'(?:\/(?:%s*%s)?)?(?:\?%s*%s)?'
+                           % (PATH_CHARS, PATH_ENDING_CHARS, QUERY_CHARS,
+                              QUERY_ENDING_CHARS), re.IGNORECASE)
+MENTION_ENTITY_REGEX = LazyRegex(r'(' + AT_SIGNS + r'+)' + LIST_END_CHARS,
+                                 re.IGNORECASE)
+HASHTAG_ENTITY_REGEX = LazyRegex(r'(#|\uff03)(%s)' % HASHTAG_CHARS,
+                                 re.IGNORECASE)
+
+# Runs of characters a domain can be made of, and of at signs
+DOMAIN_RUN_REGEX = LazyRegex(r'[^\s_\!\/]*', re.IGNORECASE)
+AT_RUN_REGEX = LazyRegex(AT_SIGNS + r'+')
+
+# Incremental parsing
+# No entity contains ASCII whitespace and no match looks across it, so the
+# entities of a run of other characters only depend on that run. After an edit
+# only the runs it touches need to be scanned again.
+SEPARATORS = frozenset(str(' \t\n\r\f\v'))
+RUN_END_REGEX = LazyRegex(r'[^ \t\n\r\f\v]*')
+
+# Python 2 decodes a byte string as ASCII when it is searched for, compared
+# with or formatted with a unicode string, which fails for UTF-8 text. The
+# strings texts meet in the scanner and in the HTML are native strings (like
+# HTML_ESCAPES), so that parsing a byte string works and gives byte strings.
+_WORD_CHARS = str('abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ'
+                  '0123456789_')
+URL_PRE_EXCLUDE = frozenset(str('/"\'!='))
+MENTION_PRE_EXCLUDE = frozenset(_WORD_CHARS)
+HASHTAG_PRE_EXCLUDE = frozenset(_WORD_CHARS.replace('_', '') + '&/')
+DOMAIN_START_EXCLUDE = frozenset(str('.-'))
+DOT = str('.')
+EMPTY = str('')
+HTTP = str('http://')
+
+# Entity kinds, in order of precedence when two candidates overlap
+ENTITY_URL, ENTITY_USER, ENTITY_LIST, ENTITY_TAG = range(4)
+
+# Batches smaller than this are not worth the startup of a process pool
+POOL_MIN_BATCH = 1000
+
+# Entities escaped by escape(), in the order they are replaced. Native strings,
+# so that escaping a byte string on Python 2 still gives a byte string.
+HTML_ESCAPES = tuple((str(char), str(entity)) for char, entity in (
+    ('&', '&amp;'), ('"', '&quot;'), ('\'', '&apos;'), ('>', '&gt;'),
+    ('<', '&lt;')))
+
+
+class Entity(object):
+
+    '''An entity found in a Tweet.
+
+    Attributes:
+    - text
+        The url, username, list (as username/listname) or hashtag, without
+        the leading @ or #.
+
+    - start, end
+        The position of the entity in the Tweet, including the leading @
+        or #, so that tweet[start:end] is the entity as it was written.
+
+    '''
+
+    __slots__ = ('text', 'start', 'end')
+    kind = None
+
+    def __init__(self, text, start, end):
+        self.text = text
+        self.start = start
+        self.end = end
+
+    @property
+    def span(self):
+        return (self.start, self.end)
+
+    def __eq__(self, other):
+        return self.__class__ is other.__class__ and self.text == other.text \
+            and self.start == other.start and self.end == other.end
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __hash__(self):
+        return hash((self.kind, self.text, self.start, self.end))
+
+    def __reduce__(self):
+        return self.__class__, (self.text, self.start, self.end)
+
+    def __copy__(self):
+        return self.__class__(self.text, self.start, self.end)
+
+    def __repr__(self):
+        return '%s(%r, %d, %d)' % (self.__class__.__name__, self.text,
+                                   self.start, self.end)
+
+
+class Url(Entity):
+
+    '''A URL, text is the URL as it was written.'''
+
+    __slots__ = ()
+    kind = ENTITY_URL
+
+
+class Mention(Entity):
+
+    '''A username, text is the username without the @.'''
+
+    __slots__ = ()
+    kind = ENTITY_USER
+
+
+class ListRef(Entity):
+
+    '''A list, text is username/listname, also available as user and
+    list_name.'''
+
+    __slots__ = ('user', 'list_name')
+    kind = ENTITY_LIST
+
+    def __init__(self, user, list_name, start, end):
+        Entity.__init__(self, user + str('/') + list_name, start, end)
+        self.user = user
+        self.list_name = list_name
+
+    def __reduce__(self):
+        return self.__class__, (self.user, self.list_name, self.start,
+                                self.end)
+
+    def __copy__(self):
+        return self.__class__(self.user, self.list_name, self.start, self.end)
+
+    def __repr__(self):
+        return '%s(%r, %r, %d, %d)' % (self.__class__.__name__, self.user,
+                                       self.list_name, self.start, self.end)
+
+
+class Hashtag(Entity):
+
+    '''A hashtag, text is the hashtag without the #.'''
+
+    __slots__ = ()
+    kind = ENTITY_TAG
 
 
 class ParseResult(object):
@@ -73,6 +297,10 @@ class ParseResult(object):
     '''A class containing the results of a parsed Tweet.
 
     Attributes:
+    - entities
+        A tuple of all the Url, Mention, ListRef and Hashtag entities in the
+        Tweet, in the order they appear in it.
+
     - urls:
         A list containing all the valid urls in the Tweet.
 
@@ -98,166 +326,693 @@ class ParseResult(object):
         To change the formatting sublcass twp.Parser and override the format_*
         methods.
 
+    The urls, users, lists and tags lists are built from entities the first
+    time they are read, with include_spans every item also gets its span.
+    Like the attributes of 1.0 they can be changed or replaced, that doesn't
+    change entities. The HTML is only generated the first time it is read,
+    results of parsing with html=False have no HTML.
+
+    ParseResult(urls, users, reply, lists, tags, html) makes a result the way
+    1.0 did, with those lists and no entities. The Parser makes its results
+    with from_entities().
+
     '''
 
+    __slots__ = ('entities', 'reply', 'include_spans', '_urls', '_users',
+                 '_lists', '_tags', '_html', '_text', '_parser')
+
     def __init__(self, urls, users, reply, lists, tags, html):
-        self.urls = urls if urls else []
-        self.users = users if users else []
-        self.lists = lists if lists else []
+        self.entities = ()
         self.reply = reply if reply else None
-        self.tags = tags if tags else []
-        self.html = html
+        self.include_spans = False
+        self._urls = urls if urls else []
+        self._users = users if users else []
+        self._lists = lists if lists else []
+        self._tags = tags if tags else []
+        self._html = html
+        self._text = self._parser = None
+
+    @classmethod
+    def from_entities(cls, entities, reply, text=None, parser=None,
+                      include_spans=False):
+        '''Return the result of the entities of a text. With a parser its
+        _html() renders the HTML of the text when it is first read.'''
+        result = cls.__new__(cls)
+        result.entities = tuple(entities)
+        result.reply = reply if reply else None
+        result.include_spans = include_spans
+        result._urls = result._users = result._lists = result._tags = None
+        result._html = None
+        result._text = text
+        result._parser = parser
+        return result
+
+    def _select(self, kind):
+        return [entity for entity in self.entities if entity.kind == kind]
+
+    @property
+    def urls(self):
+        if self._urls is None:
+            if self.include_spans:
+                self._urls = [(url.text, url.span)
+                              for url in self._select(ENTITY_URL)]
+            else:
+                self._urls = [url.text for url in self._select(ENTITY_URL)]
+
+        return self._urls
+
+    @urls.setter
+    def urls(self, urls):
+        self._urls = urls
+
+    @property
+    def users(self):
+        if self._users is None:
+            if self.include_spans:
+                self._users = [(user.text, user.span)
+                               for user in self._select(ENTITY_USER)]
+            else:
+                self._users = [user.text
+                               for user in self._select(ENTITY_USER)]
+
+        return self._users
+
+    @users.setter
+    def users(self, users):
+        self._users = users
+
+    @property
+    def lists(self):
+        if self._lists is None:
+            if self.include_spans:
+                self._lists = [(ref.user, ref.list_name, ref.span)
+                               for ref in self._select(ENTITY_LIST)]
+            else:
+                self._lists = [(ref.user, ref.list_name)
+                               for ref in self._select(ENTITY_LIST)]
+
+        return self._lists
+
+    @lists.setter
+    def lists(self, lists):
+        self._lists = lists
+
+    @property
+    def tags(self):
+        if self._tags is None:
+            if self.include_spans:
+                self._tags = [(tag.text, tag.span)
+                              for tag in self._select(ENTITY_TAG)]
+            else:
+                self._tags = [tag.text for tag in self._select(ENTITY_TAG)]
+
+        return self._tags
+
+    @tags.setter
+    def tags(self, tags):
+        self._tags = tags
+
+    @property
+    def html(self):
+        # The text is read before the parser, which is cleared first, so
+        # that the parser is never seen without its text
+        text = self._text
+        parser = self._parser
+        if parser is None:
+            return self._html
+
+        html = self._html = parser._html(text, self.entities)
+        self._parser = None
+        self._text = None
+        return html
+
+    def __copy__(self):
+        # Copies the entities too, so that a copy shares nothing mutable
+        result = ParseResult.__new__(ParseResult)
+        result.entities = tuple([entity.__copy__()
+                                 for entity in self.entities])
+        result.reply = self.reply
+        result.include_spans = self.include_spans
+        result._urls = _copy_list(self._urls)
+        result._users = _copy_list(self._users)
+        result._lists = _copy_list(self._lists)
+        result._tags = _copy_list(self._tags)
+        result._text = self._text
+        result._parser = self._parser
+        result._html = self._html
+        return result
+
+    def __getstate__(self):
+        # Render the HTML now rather than pickling the text and the Parser,
+        # the lists only when they were read or set
+        return (self.entities, self.reply, self.include_spans, self.html,
+                self._urls, self._users, self._lists, self._tags)
+
+    def __setstate__(self, state):
+        (self.entities, self.reply, self.include_spans, self._html,
+         self._urls, self._users, self._lists, self._tags) = state
+        self._text = self._parser = None
+
+
+def _copy_list(items):
+    return None if items is None else list(items)
+
+
+def _native(text):
+    # A native string of text if it is ASCII, see _WORD_CHARS
+    try:
+        return str(text)
+
+    except UnicodeError:
+        return text
+
+
+class HTMLFormatter(object):
+
+    '''Render the links of entities, used by Parser.format_*
+
+    The base URLs are put into the link templates once, when the formatter is
+    created, rendering a link is then a single % operation. Hashtags repeat a
+    lot, so their quoted search URLs are memoized, at most tag_cache_size.
 
+    '''
+    def __init__(self, tag_url='http://search.twitter.com/search?q=',
+                 user_url='http://twitter.com/', tag_cache_size=4096):
+        tag_url = _native(tag_url.replace('%', '%%'))
+        user_url = _native(user_url.replace('%', '%%'))
+        self._tag_link = str('<a href="') + tag_url + str('%s">%s%s</a>')
+        self._user_link = str('<a href="') + user_url + str('%s">%s%s</a>')
+        self._list_link = (str('<a href="') + user_url
+                           + str('%s/%s">%s%s/%s</a>'))
+        self._quoted_tags = MemoCache(tag_cache_size)
 
-class Parser(object):
+    def tag(self, tag, text):
+        quoted = self._quoted_tags.get(text)
+        if quoted is None:
+            # Imported on first use like multiprocessing, see LazyRegex
+            try:
+                from urllib.parse import quote
 
-    '''A Tweet Parser'''
+            except ImportError:
+                from urllib import quote
 
-    def __init__(self, max_url_length=30, include_spans=False):
-        self._max_url_length = max_url_length
-        self._include_spans = include_spans
+            data = text if isinstance(text, bytes) else text.encode('utf-8')
+            quoted = quote(b'#' + data)
+            self._quoted_tags.set(text, quoted)
 
-    def parse(self, text, html=True):
-        '''Parse the text and return a ParseResult instance.'''
-        self._urls = []
-        self._users = []
-        self._lists = []
-        self._tags = []
+        return self._tag_link % (quoted, tag, text)
 
-        reply = REPLY_REGEX.match(text)
-        reply = reply.groups(0)[0] if reply is not None else None
+    def username(self, at_char, user):
+        return self._user_link % (user, at_char, user)
 
-        parsed_html = self._html(text) if html else self._text(text)
-        return ParseResult(self._urls, self._users, reply,
-                           self._lists, self._tags, parsed_html)
-
-    def _text(self, text):
-        '''Parse a Tweet without generating HTML.'''
-        URL_REGEX.sub(self._parse_urls, text)
-        USERNAME_REGEX.sub(self._parse_users, text)
-        LIST_REGEX.sub(self._parse_lists, text)
-        HASHTAG_REGEX.sub(self._parse_tags, text)
-        return None
-
-    def _html(self, text):
-        '''Parse a Tweet and generate HTML.'''
-        html = URL_REGEX.sub(self._parse_urls, text)
-        html = USERNAME_REGEX.sub(self._parse_users, html)
-        html = LIST_REGEX.sub(self._parse_lists, html)
-        return HASHTAG_REGEX.sub(self._parse_tags, html)
+    def list(self, at_char, user, list_name):
+        return self._list_link % (user, list_name, at_char, user, list_name)
 
-    # Internal parser stuff ----------------------------------------------------
-    def _parse_urls(self, match):
-        '''Parse URLs.'''
+    def url(self, url, text):
+        return URL_LINK % (escape(url), text)
 
-        mat = match.group(0)
 
-        # Fix a bug in the regex concerning www...com and www.-foo.com domains
-        # TODO fix this in the regex instead of working around it here
-        domain = match.group(5)
-        if domain[0] in '.-':
-            return mat
+URL_LINK = str('<a href="%s">%s</a>')
 
-        # Only allow IANA one letter domains that are actually registered
-        if len(domain) == 5 \
-           and domain[-4:].lower() in ('.com', '.org', '.net') \
-           and not domain.lower() in IANA_ONE_LETTER_DOMAINS:
+DEFAULT_FORMATTER = HTMLFormatter()
 
-            return mat
 
-        # Check for urls without http(s)
-        pos = mat.find('http')
-        if pos != -1:
-            pre, url = mat[:pos], mat[pos:]
-            full_url = url
+class ParseStats(object):
 
-        # Find the www and force http://
-        else:
-            pos = mat.lower().find('www')
-            pre, url = mat[:pos], mat[pos:]
-            full_url = 'http://%s' % url
-
-        if self._include_spans:
-            span = match.span(0)
-            # add an offset if pre is e.g. ' '
-            span = (span[0] + len(pre), span[1])
-            self._urls.append((url, span))
-        else:
-            self._urls.append(url)
+    '''Counters of the stages of Parser.parse, see Parser(stats=...)
 
-        if self._html:
-            return '%s%s' % (pre, self.format_url(full_url,
-                                                  self._shorten_url(escape(url))))
+    For each of the STAGES the number of calls, the number of entities found
+    (rendered for html) and the cumulative time in seconds, plus the number
+    of entities found of every kind. One instance can be shared by many
+    Parsers and threads.
 
-    def _parse_users(self, match):
-        '''Parse usernames.'''
+    Stages:
+    - prefilter
+        Looking for the entity triggers in the text.
 
-        # Don't parse lists here
-        if match.group(2) is not None:
-            return match.group(0)
+    - reply
+        The reply lookup, only run for texts with an @, entities counts the
+        replies found.
 
-        mat = match.group(0)
-        if self._include_spans:
-            self._users.append((mat[1:], match.span(0)))
-        else:
-            self._users.append(mat[1:])
+    - scan
+        The single pass over the text finding all URLs, usernames, lists and
+        hashtags.
 
-        if self._html:
-            return self.format_username(mat[0:1], mat[1:])
+    - html
+        Rendering the HTML, when a result's html is first read.
 
-    def _parse_lists(self, match):
-        '''Parse lists.'''
+    '''
 
-        # Don't parse usernames here
-        if match.group(4) is None:
-            return match.group(0)
+    STAGES = ('prefilter', 'reply', 'scan', 'html')
+    KINDS = ('urls', 'users', 'lists', 'tags')
 
-        pre, at_char, user, list_name = match.groups()
-        list_name = list_name[1:]
-        if self._include_spans:
-            self._lists.append((user, list_name, match.span(0)))
-        else:
-            self._lists.append((user, list_name))
+    def __init__(self, clock=timeit.default_timer):
+        self.clock = clock
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self._calls = [0] * len(self.STAGES)
+            self._entities = [0] * len(self.STAGES)
+            self._time = [0.0] * len(self.STAGES)
+            self._kinds = [0] * len(self.KINDS)
+
+    def add(self, stage, seconds, entities=0):
+        '''Count a call of the stage, an index into STAGES.'''
+        with self._lock:
+            self._calls[stage] += 1
+            self._entities[stage] += entities
+            self._time[stage] += seconds
+
+    def add_entities(self, entities):
+        '''Count the entities by kind.'''
+        with self._lock:
+            for entity in entities:
+                self._kinds[entity.kind] += 1
+
+    def merge(self, counters):
+        '''Add the counters of an as_dict() dict, e.g. of another process.'''
+        stages = counters['stages']
+        with self._lock:
+            for i, stage in enumerate(self.STAGES):
+                self._calls[i] += stages[stage]['calls']
+                self._entities[i] += stages[stage]['entities']
+                self._time[i] += stages[stage]['time']
+
+            for i, kind in enumerate(self.KINDS):
+                self._kinds[i] += counters['entities'][kind]
+
+    def as_dict(self):
+        '''Return the counters as a dict of plain numbers.'''
+        with self._lock:
+            stages = dict((stage, {'calls': self._calls[i],
+                                   'entities': self._entities[i],
+                                   'time': self._time[i]})
+                          for i, stage in enumerate(self.STAGES))
+            return {'stages': stages,
+                    'entities': dict(zip(self.KINDS, self._kinds))}
+
+    def __getstate__(self):
+        # Pickles as fresh counters, parse_many workers count on their own
+        # and send theirs back to be merged
+        return self.clock
+
+    def __setstate__(self, clock):
+        self.__init__(clock)
+
+
+STAGE_PREFILTER, STAGE_REPLY, STAGE_SCAN, STAGE_HTML = range(4)
+
+
+class _TimedRenderer(object):
+
+    '''Stands in for the Parser of instrumented ParseResults to time the
+    lazy HTML rendering.'''
 
-        if self._html:
-            return '%s%s' % (pre, self.format_list(at_char, user, list_name))
+    __slots__ = ('parser', 'stats')
 
-    def _parse_tags(self, match):
-        '''Parse hashtags.'''
+    def __init__(self, parser, stats):
+        self.parser = parser
+        self.stats = stats
 
-        mat = match.group(0)
+    def _html(self, text, entities):
+        start = self.stats.clock()
+        html = self.parser._html(text, entities)
+        self.stats.add(STAGE_HTML, self.stats.clock() - start, len(entities))
+        return html
+
+
+class Parser(object):
+
+    '''A Tweet Parser
+
+    A Parser only holds its configuration and keeps no state between calls,
+    one instance can therefore be used from many threads at once.
+
+    With a cache_size parse() keeps the results of the last cache_size texts
+    in an LRU cache, for streams where the same text (retweets) is parsed
+    over and over. Every call still gets a copy of its own.
+
+    With a ParseStats as stats parse() counts and times each of its stages
+    in it. Without one nothing is timed at all.
+
+    engine is the name of the regex engine to match with, see ttp.engines.
+    All engines find the same entities.
+
+    '''
+
+    def __init__(self, max_url_length=30, include_spans=False,
+                 formatter=DEFAULT_FORMATTER, cache_size=0, stats=None,
+                 engine='re'):
+        # Imported here, engines needs the regexes of this module
+        from .engines import get_engine
+
+        self._max_url_length = max_url_length
+        self._include_spans = include_spans
+        self._formatter = formatter
+        self._cache = LRUCache(cache_size) if cache_size else None
+        self._stats = stats
+        self._engine = get_engine(engine)
+
+    def parse(self, text, html=True):
+        '''Parse the text and return a ParseResult instance.'''
+        parse = self._parse if self._stats is None else self._timed_parse
+        if self._cache is None:
+            return parse(text, html)
+
+        key = (text, html, self._include_spans, self._max_url_length)
+        result = self._cache.get(key)
+        if result is None:
+            result = parse(text, html)
+            if html:
+                # Rendered before it is shared, a cached result never changes
+                # and the copies share its HTML
+                result.html
+
+            self._cache.set(key, result)
+
+        return result.__copy__()
+
+    def cache_stats(self):
+        '''Return the hits, misses and size of the parse() cache as a dict,
+        or None without a cache.'''
+        return self._cache.stats() if self._cache is not None else None
+
+    def _parse(self, text, html):
+        triggers = prefilter(text)
+        reply = None
+        if triggers & TRIGGER_MENTION:
+            reply = self._engine.reply.match(text)
+            reply = reply.groups(0)[0] if reply is not None else None
+
+        if html:
+            return ParseResult.from_entities(self._scan(text, triggers),
+                                             reply, text, self,
+                                             self._include_spans)
+
+        return ParseResult.from_entities(self._scan(text, triggers), reply,
+                                         include_spans=self._include_spans)
+
+    def _timed_parse(self, text, html):
+        # _parse with every stage timed, see ParseStats
+        stats = self._stats
+        clock = stats.clock
+        start = clock()
+        triggers = prefilter(text)
+        now = clock()
+        stats.add(STAGE_PREFILTER, now - start)
+
+        reply = None
+        if triggers & TRIGGER_MENTION:
+            start = now
+            reply = self._engine.reply.match(text)
+            reply = reply.groups(0)[0] if reply is not None else None
+            now = clock()
+            stats.add(STAGE_REPLY, now - start, reply is not None)
+
+        entities = self._scan(text, triggers)
+        stats.add(STAGE_SCAN, clock() - now, len(entities))
+        stats.add_entities(entities)
+        if html:
+            return ParseResult.from_entities(entities, reply, text,
+                                             _TimedRenderer(self, stats),
+                                             self._include_spans)
+
+        return ParseResult.from_entities(
+            entities, reply, include_spans=self._include_spans)
+
+    def extract(self, text):
+        '''Return the entities of the text without building a ParseResult.
+
+        The fast path for callers that never render HTML: no HTML, no reply
+        lookup, no per type lists. Returns a list of the Url, Mention, ListRef
+        and Hashtag entities in the order they appear in the text.
+
+        '''
+        return self._scan(text, prefilter(text))
+
+    def reparse(self, result, text, offset, deleted, inserted, html=True):
+        '''Return the ParseResult of an edited text from the previous one.
+
+        result is the ParseResult of the text before the edit, text the text
+        after it. The edit replaced `deleted` characters at `offset` with the
+        string `inserted`. Only the whitespace delimited runs of text touched
+        by the edit are scanned again, the other entities are copied from
+        result and moved by the change in length. The ParseResult is the same
+        parse(text, html) would return.
+
+        '''
+        end = offset + len(inserted)
+        if offset < 0 or deleted < 0 or text[offset:end] != inserted:
+            raise ValueError('the edit does not match the text')
+
+        start = offset
+        while start and text[start - 1] not in SEPARATORS:
+            start -= 1
+
+        end = self._engine.run_end.match(text, end).end()
+        shift = len(inserted) - deleted
+        entities = [entity.__copy__() for entity in result.entities
+                    if entity.end <= start]
+        region = text[start:end]
+        for entity in self._scan(region, prefilter(region)):
+            entity.start += start
+            entity.end += start
+            entities.append(entity)
+
+        for entity in result.entities:
+            if entity.start >= end - shift:
+                entity = entity.__copy__()
+                entity.start += shift
+                entity.end += shift
+                entities.append(entity)
+
+        reply = self._engine.reply.match(text)
+        reply = reply.groups(0)[0] if reply is not None else None
+        if html:
+            return ParseResult.from_entities(entities, reply, text, self,
+                                             self._include_spans)
+
+        return ParseResult.from_entities(
+            entities, reply, include_spans=self._include_spans)
+
+    def parse_many(self, texts, html=True, workers=None, chunksize=100):
+        '''Parse an iterable of texts and return a list of ParseResults.
+
+        The texts are spread over a pool of `workers` processes (defaults to
+        the number of CPUs) in chunks of `chunksize`, the results come back in
+        input order. Each worker gets a pickled copy of this Parser, so
+        subclasses that override the format_* methods work as long as they
+        can be pickled, i.e. are defined at the top level of a module.
+
+        Batches of less than POOL_MIN_BATCH texts, or workers=1, are parsed in
+        the current process.
+
+        With stats the workers count in their own ParseStats and send the
+        counters of each chunk back with its results, they are merged into
+        this Parser's. The HTML is then rendered, and timed, in the workers.
+
+        '''
+        import multiprocessing
+        import pickle
+
+        texts = iter(texts)
+        head = list(itertools.islice(texts, POOL_MIN_BATCH))
+        if workers is None:
+            workers = multiprocessing.cpu_count()
+
+        if workers == 1 or len(head) < POOL_MIN_BATCH:
+            return [self.parse(text, html) for text in itertools.chain(head,
+                                                                       texts)]
+
+        config = pickle.dumps(self, pickle.HIGHEST_PROTOCOL)
+        pool = multiprocessing.Pool(workers, _init_worker, (config, html))
+        try:
+            results = []
+            for chunk, counters in pool.imap(
+                    _parse_in_worker,
+                    _chunks(itertools.chain(head, texts), chunksize)):
+                results.extend(chunk)
+                if counters is not None:
+                    self._stats.merge(counters)
+
+            pool.close()
+
+        except:
+            pool.terminate()
+            raise
+
+        finally:
+            pool.join()
+
+        return results
+
+    def _html(self, text, entities):
+        '''Generate the HTML of a Tweet from its entities.'''
+        html = []
+        last = 0
+        for entity in entities:
+            html.append(text[last:entity.start])
+            if entity.kind == ENTITY_URL:
+                url = entity.text
+
+                # Find the www and force http://
+                full_url = HTTP + url if url[0] in 'wW' else url
+                html.append(self.format_url(full_url,
+                                            self._shorten_url(escape(url))))
+
+            elif entity.kind == ENTITY_USER:
+                html.append(self.format_username(text[entity.start],
+                                                 entity.text))
+
+            elif entity.kind == ENTITY_LIST:
+                at_chars = text[entity.start:entity.end - len(entity.text)]
+                html.append(self.format_list(at_chars, entity.user,
+                                             entity.list_name))
+
+            else:
+                html.append(self.format_tag(text[entity.start], entity.text))
+
+            last = entity.end
+
+        html.append(text[last:])
+        return EMPTY.join(html)
 
-        # Fix problems with the regex capturing stuff infront of the #
-        tag = None
-        for i in u'#\uff03':
-            pos = mat.rfind(i)
-            if pos != -1:
-                tag = i
+    # Internal parser stuff ----------------------------------------------------
+    def _scan(self, text, triggers=TRIGGER_ALL):
+        '''Find all entities in a single walk over the text.
+
+        Returns a list of Url, Mention, ListRef and Hashtag entities. URLs
+        take precedence over overlapping usernames, lists and hashtags, just
+        like they did when every entity type had a pass of its own.
+
+        Only the TRIGGER_* kinds in `triggers` are looked for.
+
+        Takes time linear in the length of the text: no character is matched
+        by more than a few regex attempts, whatever the text looks like.
+
+        '''
+        entities = []
+        if not triggers:
+            return entities
+
+        engine = self._engine
+        search = engine.triggers[triggers].search
+        last_end = 0
+        pos = 0
+
+        # The run of domain characters looked at by the last URL, and the dot
+        # in front of its top level domain (or -1 if it had none)
+        run_end = 0
+        dot = -1
+        while True:
+            trigger = search(text, pos)
+            if trigger is None:
                 break
 
-        pre, text = mat[:pos], mat[pos + 1:]
-        if self._include_spans:
-            span = match.span(0)
-            # add an offset if pre is e.g. ' '
-            span = (span[0] + len(pre), span[1])
-            self._tags.append((text, span))
-        else:
-            self._tags.append(text)
+            start = trigger.start()
+            pos = trigger.end()
+            char = text[start]
+            prev = text[start - 1] if start else None
+            if char in u'@\uff20':
+                if start < last_end or prev in MENTION_PRE_EXCLUDE:
+                    continue
+
+                match = engine.mention.match(text, start)
+                if match is None:
+                    # The other at signs of this run would fail just the same
+                    pos = engine.at_run.match(text, start).end()
+                    continue
+
+                last_end = match.end()
+                if match.group(3) is None:
+                    # Usernames always start at the last of the at signs
+                    entities.append(Mention(match.group(2), match.end(1) - 1,
+                                            last_end))
+                else:
+                    entities.append(ListRef(match.group(2),
+                                            match.group(3)[1:], start,
+                                            last_end))
+
+            elif char in u'#\uff03':
+                if start < last_end or prev in HASHTAG_PRE_EXCLUDE:
+                    continue
+
+                match = engine.hashtag.match(text, start)
+                if match is None:
+                    continue
+
+                last_end = match.end()
+                entities.append(Hashtag(match.group(2), start, last_end))
+
+            else:
+                if prev in URL_PRE_EXCLUDE:
+                    continue
+
+                # A domain ends at the last dot and letters in its run of
+                # domain characters. So a www. inside the run of the last URL
+                # ends where that one did, or has no domain if it starts after
+                # the dot. Without this every www. in www.-www.-www.-... would
+                # match all the way to the end of the run again.
+                if pos >= run_end:
+                    domain = engine.url_domain.match(text, pos)
+                    if domain is None:
+                        dot = -1
+                        run_end = engine.domain_run.match(text, pos).end()
+                        continue
+
+                    domain_end = domain.end()
+                    dot = text.rfind(DOT, pos, domain_end)
+                    run_end = engine.domain_run.match(text,
+                                                     domain_end).end()
+
+                elif pos >= dot:
+                    continue
+
+                # Check the first character before copying the domain, there
+                # might be a lot of rejected ones in the same run
+                if text[pos] in DOMAIN_START_EXCLUDE \
+                   or not self._valid_domain(text[pos:domain_end]):
+                    continue
+
+                # Drop anything the URL overlaps, URLs always win
+                while entities and entities[-1].end > start:
+                    entities.pop()
+
+                last_end = pos = engine.url_path.match(text, domain_end).end()
+                entities.append(Url(text[start:last_end], start, last_end))
+
+        return entities
+
+    def _valid_domain(self, domain):
+        '''Check the domain of a matched URL.'''
+
+        # Fix a bug in the regex concerning www...com and www.-foo.com domains
+        # TODO fix this in the regex instead of working around it here
+        if domain[0] in DOMAIN_START_EXCLUDE:
+            return False
+
+        # Only allow IANA one letter domains that are actually registered
+        if len(domain) == 5 \
+           and domain[-4:].lower() in ONE_LETTER_TLDS \
+           and not domain.lower() in IANA_ONE_LETTER_DOMAINS:
+
+            return False
 
-        if self._html:
-            return '%s%s' % (pre, self.format_tag(tag, text))
+        return True
 
     def _shorten_url(self, text):
         '''Shorten a URL and make sure to not cut of html entities.'''
 
         if len(text) > self._max_url_length and self._max_url_length != -1:
             text = text[0:self._max_url_length - 3]
-            amp = text.rfind('&')
-            close = text.rfind(';')
+            amp = text.rfind(str('&'))
+            close = text.rfind(str(';'))
             if amp != -1 and (close == -1 or close < amp):
                 text = text[0:amp]
 
-            return text + '...'
+            return text + str('...')
 
         else:
             return text
@@ -265,27 +1020,110 @@ class Parser(object):
     # User defined formatters --------------------------------------------------
     def format_tag(self, tag, text):
         '''Return formatted HTML for a hashtag.'''
-        return '<a href="http://search.twitter.com/search?q=%s">%s%s</a>' \
-            % (urllib.quote('#' + text.encode('utf-8')), tag, text)
+        return self._formatter.tag(tag, text)
 
     def format_username(self, at_char, user):
         '''Return formatted HTML for a username.'''
-        return '<a href="http://twitter.com/%s">%s%s</a>' \
-               % (user, at_char, user)
+        return self._formatter.username(at_char, user)
 
     def format_list(self, at_char, user, list_name):
         '''Return formatted HTML for a list.'''
-        return '<a href="http://twitter.com/%s/%s">%s%s/%s</a>' \
-               % (user, list_name, at_char, user, list_name)
+        return self._formatter.list(at_char, user, list_name)
 
     def format_url(self, url, text):
         '''Return formatted HTML for a url.'''
-        return '<a href="%s">%s</a>' % (escape(url), text)
+        return self._formatter.url(url, text)
+
+
+def prefilter(text):
+    '''Return the TRIGGER_* kinds of entity triggers found in the text.'''
+    triggers = 0
+    try:
+        if u'@' in text or u'\uff20' in text:
+            triggers = TRIGGER_MENTION
+
+        if u'#' in text or u'\uff03' in text:
+            triggers |= TRIGGER_HASHTAG
+
+    except UnicodeDecodeError:
+        return _prefilter_bytes(text)
+
+    # Every www. contains a w. so the regex only runs on a few tweets
+    if u'://' in text or ((u'w.' in text or u'W.' in text)
+                          and WWW_REGEX.search(text)):
+        triggers |= TRIGGER_URL
+
+    return triggers
+
+
+def _prefilter_bytes(text):
+    # prefilter of a Python 2 byte string that isn't ASCII, which can't be
+    # searched for unicode strings. The regexes can't match the full width
+    # signs in bytes anyway.
+    triggers = 0
+    if b'@' in text:
+        triggers = TRIGGER_MENTION
+
+    if b'#' in text:
+        triggers |= TRIGGER_HASHTAG
+
+    if b'://' in text or ((b'w.' in text or b'W.' in text)
+                          and WWW_REGEX.search(text)):
+        triggers |= TRIGGER_URL
+
+    return triggers
+
+
+# Process pool workers for Parser.parse_many
+_worker_parser = None
+_worker_html = True
+
+
+def _init_worker(config, html):
+    '''Set up the Parser of a pool worker.'''
+    global _worker_parser, _worker_html
+    import pickle
+
+    _worker_parser = pickle.loads(config)
+    _worker_html = html
+
+
+def _parse_in_worker(texts):
+    '''Parse a chunk of texts in a pool worker, return the results and the
+    counters of the worker's ParseStats (None without one).'''
+    results = [_worker_parser.parse(text, _worker_html) for text in texts]
+    stats = _worker_parser._stats
+    if stats is None:
+        return results, None
+
+    if _worker_html:
+        # Rendered when the results are pickled otherwise, after counting
+        for result in results:
+            result.html
+
+    counters = stats.as_dict()
+    stats.reset()
+    return results, counters
+
+
+def _chunks(iterable, size):
+    '''Yield lists of size items of an iterable, the last one shorter.'''
+    iterator = iter(iterable)
+    while True:
+        chunk = list(itertools.islice(iterator, size))
+        if not chunk:
+            return
+
+        yield chunk
 
 
 # Simple URL escaper
 def escape(text):
     '''Escape some HTML entities.'''
-    return ''.join({'&': '&amp;', '"': '&quot;',
-                    '\'': '&apos;', '>': '&gt;',
-                    '<': '&lt;'}.get(c, c) for c in text)
+    # One C level replace per entity that occurs, instead of a Python call per
+    # character. & has to go first so the other entities aren't escaped twice.
+    for char, entity in HTML_ESCAPES:
+        if char in text:
+            text = text.replace(char, entity)
+
+    return text
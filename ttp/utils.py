@@ -1,28 +1,285 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
 """Unwind short-links e.g. bit.ly, t.co etc to their canonical links"""
+import json
+import sqlite3
+import threading
+import time
+from multiprocessing.pool import ThreadPool
+
 import requests
+from requests.adapters import HTTPAdapter
+
+from .cache import LRUCache
+
+try:
+    from urllib.parse import urljoin, urlsplit
+    import dbm
+
+except ImportError:
+    from urlparse import urljoin, urlsplit
+    import anydbm as dbm
+
+REDIRECT_CODES = (301, 302, 303, 307, 308)
+
+
+class ShortlinkResolver(object):
+    """Follow the redirects of many shortlinks in parallel
+
+    All requests go through one pooled requests.Session, so connections to
+    the same host are reused across shortlinks and threads. Each hop is a
+    HEAD request first, if the server rejects HEAD it is retried as a GET
+    (without downloading the body). At most max_per_host requests run
+    against any one host at the same time, at most max_workers overall.
+
+    timeout is passed to requests, either a number or a (connect, read)
+    tuple of seconds. With a ShortlinkCache only the shortlinks missing from
+    it go to the network, and their chains are added to it."""
+
+    def __init__(self, max_workers=8, max_per_host=2, timeout=(3.05, 10),
+                 max_redirects=10, session=None, cache=None):
+        self.max_workers = max_workers
+        self.max_per_host = max_per_host
+        self.timeout = timeout
+        self.max_redirects = max_redirects
+        if session is None:
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=max_workers,
+                                  pool_maxsize=max_workers)
+            session.mount('http://', adapter)
+            session.mount('https://', adapter)
+
+        self.session = session
+        self.cache = cache
+        self._host_limits = {}
+        self._host_limits_lock = threading.Lock()
+
+    def resolve(self, shortlinks):
+        """Follow redirects in list of shortlinks, return dict of resulting
+        URLs, see follow_shortlinks"""
+        chains = {}
+        todo = []
+        for shortlink in set(shortlinks):
+            chain = self.cache.get(shortlink) if self.cache else None
+            if chain is None:
+                todo.append(shortlink)
+
+            else:
+                chains[shortlink] = chain
+
+        if not todo:
+            return chains
 
+        pool = ThreadPool(min(self.max_workers, len(todo)))
+        try:
+            resolved = dict(zip(todo, pool.map(self.follow, todo)))
 
-def follow_shortlinks(shortlinks):
-    """Follow redirects in list of shortlinks, return dict of resulting URLs"""
-    links_followed = {}
-    for shortlink in shortlinks:
+        finally:
+            pool.close()
+            pool.join()
+
+        if self.cache is not None:
+            self.cache.update(resolved)
+
+        chains.update(resolved)
+        return chains
+
+    def follow(self, shortlink):
+        """Return the list of URLs shortlink redirects through, starting with
+        shortlink itself, or an empty list if it can't be followed"""
+        all_urls = [shortlink]
         url = shortlink
-        request_result = requests.get(url)
-        redirect_history = request_result.history
-        # history might look like:
-        # (<Response [301]>, <Response [301]>)
-        # where each response object has a URL
-        all_urls = []
-        for redirect in redirect_history:
-            all_urls.append(redirect.url)
-        # append the final URL that we finish with
-        all_urls.append(request_result.url)
-        links_followed[shortlink] = all_urls
-    return links_followed
+        try:
+            for _ in range(self.max_redirects + 1):
+                response = self._request(url)
+                location = response.headers.get('location')
+                if response.status_code not in REDIRECT_CODES \
+                   or location is None:
+                    return all_urls
+
+                url = urljoin(url, location)
+                all_urls.append(url)
+
+        except (requests.RequestException, ValueError):
+            # ValueError: malformed URLs, which requests and urlsplit don't
+            # always wrap in a RequestException
+            return []
+
+        # too many redirects
+        return []
+
+    def close(self):
+        """Close the connections of the session"""
+        self.session.close()
+
+    def _request(self, url):
+        """Make a single request for url, HEAD first and GET if that fails"""
+        limit = self._host_limit(urlsplit(url).netloc.lower())
+        with limit:
+            response = self.session.head(url, allow_redirects=False,
+                                         timeout=self.timeout)
+            response.close()
+            if response.status_code >= 400:
+                response = self.session.get(url, allow_redirects=False,
+                                            timeout=self.timeout, stream=True)
+                response.close()
+
+        return response
+
+    def _host_limit(self, host):
+        """Return the semaphore limiting the requests to host"""
+        with self._host_limits_lock:
+            limit = self._host_limits.get(host)
+            if limit is None:
+                limit = threading.BoundedSemaphore(self.max_per_host)
+                self._host_limits[host] = limit
+
+            return limit
+
+
+class ShortlinkCache(object):
+    """Cache of resolved shortlink chains
+
+    Chains are kept in memory in an LRU of max_size entries and, with a store
+    (SqliteStore or DbmStore), on disk so they survive restarts. Chains expire
+    after ttl seconds, failed lookups (empty chains) are cached too but expire
+    after negative_ttl seconds so they are retried sooner. hits and misses
+    count the lookups, a hit from the store counts as a hit. Safe to share
+    between threads, like the resolver workers."""
+
+    def __init__(self, max_size=10000, ttl=7 * 24 * 3600, negative_ttl=3600,
+                 store=None, clock=time.time):
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.store = store
+        self.hits = 0
+        self.misses = 0
+        self._memory = LRUCache(max_size, clock=clock)
+        self._clock = clock
+        self._lock = threading.Lock()
+
+    def get(self, shortlink):
+        """Return the cached chain of shortlink or None"""
+        chain = self._memory.get(shortlink)
+        if chain is None and self.store is not None:
+            entry = self.store.get(shortlink)
+            if entry is not None:
+                expires, chain = entry
+                ttl = expires - self._clock()
+                if ttl > 0:
+                    self._memory.set(shortlink, chain, ttl)
+
+                else:
+                    chain = None
+
+        with self._lock:
+            if chain is None:
+                self.misses += 1
+
+            else:
+                self.hits += 1
+
+        return chain
+
+    def update(self, chains):
+        """Add the chains of a dict as returned by follow_shortlinks"""
+        now = self._clock()
+        entries = []
+        for shortlink, chain in chains.items():
+            ttl = self.ttl if chain else self.negative_ttl
+            self._memory.set(shortlink, chain, ttl)
+            entries.append((shortlink, now + ttl, chain))
+
+        if self.store is not None:
+            self.store.update(entries)
+
+    def stats(self):
+        """Return the counters as a dict"""
+        with self._lock:
+            return {'hits': self.hits, 'misses': self.misses,
+                    'size': len(self._memory)}
+
+
+class SqliteStore(object):
+    """Keep cached chains in an sqlite database at path"""
+
+    def __init__(self, path):
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute('CREATE TABLE IF NOT EXISTS shortlinks '
+                         '(shortlink TEXT PRIMARY KEY, expires REAL, '
+                         'chain TEXT)')
+        self._lock = threading.Lock()
+
+    def get(self, shortlink):
+        """Return (expires, chain) for shortlink or None"""
+        with self._lock:
+            row = self._db.execute('SELECT expires, chain FROM shortlinks '
+                                   'WHERE shortlink = ?',
+                                   (shortlink,)).fetchone()
+
+        return None if row is None else (row[0], json.loads(row[1]))
+
+    def update(self, entries):
+        """Store a list of (shortlink, expires, chain) tuples"""
+        with self._lock:
+            with self._db:
+                self._db.executemany(
+                    'INSERT OR REPLACE INTO shortlinks VALUES (?, ?, ?)',
+                    [(shortlink, expires, json.dumps(chain))
+                     for shortlink, expires, chain in entries])
+
+    def purge(self, now=None):
+        """Delete the expired entries"""
+        with self._lock:
+            with self._db:
+                self._db.execute('DELETE FROM shortlinks WHERE expires <= ?',
+                                 (time.time() if now is None else now,))
+
+    def close(self):
+        self._db.close()
+
+
+class DbmStore(object):
+    """Keep cached chains in a dbm file at path"""
+
+    def __init__(self, path):
+        self._db = dbm.open(path, 'c')
+        self._lock = threading.Lock()
+
+    def get(self, shortlink):
+        """Return (expires, chain) for shortlink or None"""
+        with self._lock:
+            value = self._db.get(shortlink.encode('utf-8'))
+
+        return None if value is None else tuple(json.loads(value))
+
+    def update(self, entries):
+        """Store a list of (shortlink, expires, chain) tuples"""
+        with self._lock:
+            for shortlink, expires, chain in entries:
+                self._db[shortlink.encode('utf-8')] = json.dumps([expires,
+                                                                  chain])
+
+    def close(self):
+        self._db.close()
+
+
+def follow_shortlinks(shortlinks, **kwargs):
+    """Follow redirects in list of shortlinks, return dict of resulting URLs
+
+    Each shortlink maps to the list of URLs it redirected through, starting
+    with the shortlink and ending with the final URL. Shortlinks that could
+    not be followed (network errors, timeouts, redirect loops) map to an empty
+    list. The keyword arguments are passed to ShortlinkResolver, pass a
+    ShortlinkCache as cache to avoid resolving the same shortlinks again."""
+    resolver = ShortlinkResolver(**kwargs)
+    try:
+        return resolver.resolve(shortlinks)
+
+    finally:
+        resolver.close()
 
 
 if __name__ == "__main__":
     shortlinks = ['http://t.co/8o0z9BbEMu', u'http://bbc.in/16dClPF']
-    print follow_shortlinks(shortlinks)
+    print(follow_shortlinks(shortlinks))
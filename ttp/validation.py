@@ -0,0 +1,263 @@
+#  This file is part of twitter-text-python.
+#
+#  twitter-text-python is free software: you can redistribute it and/or
+#  modify it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  twitter-text-python is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License along with
+#  twitter-text-python. If not, see <http://www.gnu.org/licenses/>.
+
+# Tweet length validation ------------------------------------------------------
+# ------------------------------------------------------------------------------
+"""Weighted Tweet length, counted the way Twitter counts it.
+
+Every code point has a weight: Latin, Greek, Cyrillic, Hebrew, Arabic and a
+few punctuation ranges count as one character, everything else (CJK, most
+symbols) as two. Every URL counts as a t.co link of URL_LENGTH characters,
+whatever its own length, and an emoji sequence counts as two characters
+however many code points it is made of. The text is NFC normalized first.
+
+The weights are those of the v3 configuration of twitter-text.
+
+"""
+import re
+import sys
+import unicodedata
+
+from . import ttp
+
+try:
+    unichr
+
+except NameError:
+    # Python 3
+    unichr = chr
+
+# (first, last, weight) of the code points not of DEFAULT_WEIGHT, in 1/SCALE
+# characters
+WEIGHT_RANGES = ((0x0000, 0x10FF, 100), (0x2000, 0x200D, 100),
+                 (0x2010, 0x201F, 100), (0x2032, 0x2037, 100))
+DEFAULT_WEIGHT = 200
+SCALE = 100
+MAX_LENGTH = 280
+URL_LENGTH = 23
+
+# A Tweet can't contain these at all
+INVALID_CHARS = (u'\ufffe', u'\ufeff', u'\uffff')
+
+# Narrow builds of Python 2 store code points above U+FFFF as surrogate pairs
+NARROW = sys.maxunicode == 0xFFFF
+SURROGATE_PAIR_REGEX = re.compile(u'[\ud800-\udbff][\udc00-\udfff]')
+CODE_POINT_REGEX = re.compile(u'[\ud800-\udbff][\udc00-\udfff]|.', re.DOTALL)
+
+
+def _code_points(first, last):
+    '''Return a pattern matching one code point from first to last.'''
+    if last <= 0xFFFF or not NARROW:
+        return u'[%s-%s]' % (unichr(first), unichr(last))
+
+    # One alternative per high surrogate, or per run of them
+    patterns = []
+    high, low = divmod(first - 0x10000, 0x400)
+    last_high, last_low = divmod(last - 0x10000, 0x400)
+    if high == last_high:
+        return u'%s[%s-%s]' % (unichr(0xD800 + high), unichr(0xDC00 + low),
+                               unichr(0xDC00 + last_low))
+
+    patterns.append(u'%s[%s-\udfff]' % (unichr(0xD800 + high),
+                                        unichr(0xDC00 + low)))
+    if last_high > high + 1:
+        patterns.append(u'[%s-%s][\udc00-\udfff]' % (
+            unichr(0xD800 + high + 1), unichr(0xD800 + last_high - 1)))
+
+    patterns.append(u'%s[\udc00-%s]' % (unichr(0xD800 + last_high),
+                                        unichr(0xDC00 + last_low)))
+    return u'(?:%s)' % u'|'.join(patterns)
+
+
+# Emoji
+# Pictographs, flags (pairs of regional indicators), keycaps and any character
+# in emoji presentation (followed by U+FE0F), each with an optional skin tone
+# modifier, joined into sequences by zero width joiners, optionally followed
+# by tag characters (subdivision flags). This is looser than the Unicode emoji
+# data, but symbols without U+FE0F weigh two characters anyway.
+_PICTOGRAPH = _code_points(0x1F000, 0x1FAFF)
+_REGIONAL_INDICATOR = _code_points(0x1F1E6, 0x1F1FF)
+_MODIFIER = _code_points(0x1F3FB, 0x1F3FF)
+_TAG = _code_points(0xE0020, 0xE007F)
+_EMOJI_ELEMENT = (u'(?:%s%s|[0-9#*]\ufe0f?\u20e3|%s\ufe0f?|.\ufe0f)%s?'
+                  % (_REGIONAL_INDICATOR, _REGIONAL_INDICATOR, _PICTOGRAPH,
+                     _MODIFIER))
+EMOJI_REGEX = re.compile(u'%s(?:\u200d%s)*%s*' % (_EMOJI_ELEMENT,
+                                                  _EMOJI_ELEMENT, _TAG))
+
+# Every emoji has a code point above U+FFFF, U+FE0F or U+20E3, a negated class
+# is the fastest to search
+if NARROW:
+    EMOJI_PREFILTER_REGEX = re.compile(u'[\u20e3\ud800-\udbff\ufe0f]')
+else:
+    EMOJI_PREFILTER_REGEX = re.compile(u'[^\u0000-\u20e2\u20e4-\ufe0e]')
+
+
+class ValidationResult(object):
+
+    '''The weighted length of a Tweet and whether it can be posted.
+
+    Attributes:
+    - weighted_length
+        The length of the Tweet as Twitter counts it.
+
+    - permillage
+        weighted_length in thousandths of the maximum length.
+
+    - valid
+        True if the Tweet is not too long, not blank and has none of the
+        INVALID_CHARS.
+
+    - valid_range
+        The (start, end) span of the longest start of text that is not too
+        long, URLs and emoji are never cut.
+
+    - text
+        The NFC normalized text, all spans point into it.
+
+    - entities
+        The entities of text, as returned by Parser.extract.
+
+    '''
+
+    __slots__ = ('weighted_length', 'permillage', 'valid', 'valid_range',
+                 'text', 'entities')
+
+    def __init__(self, weighted_length, permillage, valid, valid_range, text,
+                 entities):
+        self.weighted_length = weighted_length
+        self.permillage = permillage
+        self.valid = valid
+        self.valid_range = valid_range
+        self.text = text
+        self.entities = entities
+
+    def __repr__(self):
+        return '%s(weighted_length=%d, valid=%r)' % (
+            self.__class__.__name__, self.weighted_length, self.valid)
+
+
+class Validator(object):
+
+    '''Count the weighted length of Tweets and check if they can be posted.
+
+    The URLs are those found by the parser, which only knows URLs starting
+    with http://, https:// or www. Uses a default Parser if none is given.
+    The weights and lengths default to the Twitter ones, ranges of weights
+    above U+FFFF are not supported by narrow builds of Python 2.
+
+    Like a Parser a Validator keeps no state between calls.
+
+    '''
+
+    def __init__(self, parser=None, max_length=MAX_LENGTH,
+                 url_length=URL_LENGTH, scale=SCALE,
+                 default_weight=DEFAULT_WEIGHT, ranges=WEIGHT_RANGES):
+        self._parser = parser if parser is not None else ttp.Parser()
+        self._max_length = max_length
+        self._scale = scale
+        self._limit = max_length * scale
+        self._url_weight = url_length * scale
+        self._default_weight = default_weight
+
+        # One regex matching runs of the code points of each weight, so that
+        # counting them is a single substitution
+        classes = {}
+        for first, last, weight in ranges:
+            if NARROW and last > 0xFFFF:
+                raise ValueError('weight ranges above U+FFFF need a wide '
+                                 'build of Python')
+
+            classes.setdefault(weight, []).append(u'%s-%s' % (
+                re.escape(unichr(first)), re.escape(unichr(last))))
+
+        self._classes = [(weight - default_weight,
+                          re.compile(u'[%s]+' % u''.join(runs)))
+                         for weight, runs in classes.items()
+                         if weight != default_weight]
+
+    def validate(self, text):
+        '''Return the ValidationResult of a Tweet.'''
+        text = unicodedata.normalize('NFC', text)
+        entities = self._parser.extract(text)
+        weight = self._weigh(text)
+
+        # Whole URLs and emoji, as (start, end, weight)
+        atoms = [(entity.start, entity.end, self._url_weight)
+                 for entity in entities if entity.kind == ttp.ENTITY_URL]
+        for atom in atoms:
+            weight += atom[2] - self._weigh(text[atom[0]:atom[1]])
+
+        if EMOJI_PREFILTER_REGEX.search(text):
+            urls = atoms[:]
+            for emoji in EMOJI_REGEX.finditer(text):
+                start = emoji.start()
+                if any(first <= start < last for first, last, _ in urls):
+                    continue
+
+                weight += self._default_weight - self._weigh(emoji.group())
+                atoms.append((start, emoji.end(), self._default_weight))
+
+            atoms.sort()
+
+        if weight <= self._limit:
+            valid_range = (0, len(text))
+
+        else:
+            valid_range = (0, self._valid_end(text, atoms))
+
+        valid = weight <= self._limit and text.strip() != u'' \
+            and not any(char in text for char in INVALID_CHARS)
+
+        weighted_length = weight // self._scale
+        return ValidationResult(weighted_length,
+                                weighted_length * 1000 // self._max_length,
+                                valid, valid_range, text, entities)
+
+    def validate_many(self, texts):
+        '''Return the ValidationResults of an iterable of Tweets, in order.'''
+        validate = self.validate
+        return [validate(text) for text in texts]
+
+    def _weigh(self, text):
+        '''Return the weight of every code point of text, in 1/scale.'''
+        length = len(text)
+        if NARROW:
+            # Surrogates have the default weight, count a pair only once
+            length -= len(SURROGATE_PAIR_REGEX.findall(text))
+
+        weight = length * self._default_weight
+        for difference, regex in self._classes:
+            weight += difference * (len(text) - len(regex.sub(u'', text)))
+
+        return weight
+
+    def _valid_end(self, text, atoms):
+        '''Return where the weight of text goes over the limit.'''
+        weight = 0
+        pos = 0
+        for start, end, atom_weight in atoms + [(len(text), len(text), 0)]:
+            for char in CODE_POINT_REGEX.finditer(text, pos, start):
+                weight += self._weigh(char.group())
+                if weight > self._limit:
+                    return char.start()
+
+            weight += atom_weight
+            if weight > self._limit:
+                return start
+
+            pos = end
+
+        return len(text)